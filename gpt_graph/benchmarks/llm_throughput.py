@@ -0,0 +1,254 @@
+import os
+import time
+import argparse
+import tempfile
+
+from gpt_graph.utils.mock_llm_server import MockLLMServer
+from gpt_graph.utils.llm_dispatcher import LLMDispatcher, CircuitBreaker
+
+"""
+Throughput benchmark of LLMModel and pipelines against the local MockLLMServer (no network):
+requests/sec, p50/p99 latency and tokens/sec of each dispatch strategy.
+
+    python -m gpt_graph.benchmarks.llm_throughput
+    python -m gpt_graph.benchmarks.llm_throughput --workloads batch single --n 200 --rate_limit_rate 0.05
+"""
+
+# name -> (overrides of the "mock" entry of llm_model_map.toml, LLMModel.run kwargs)
+# a strategy with run kwargs runs only on the workloads using them (see WORKLOADS)
+STRATEGIES = {
+    "serial": ({"max_concurrency": 1}, {}),
+    "concurrent": ({"max_concurrency": 8}, {}),
+    "token_budget": ({"max_concurrency": 16, "max_inflight_tokens": 2000}, {}),
+    "packed": ({"max_concurrency": 8}, {"pack_size": 10}),
+    "hedged": ({"max_concurrency": 8}, {"hedge_percentile": 90}),
+}
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _get_prompts(n, words=60):
+    return [
+        f"item {i}: is the following text about physics? "
+        + " ".join(f"word{(i * 7 + j) % 97}" for j in range(words))
+        for i in range(n)
+    ]
+
+
+def run_batch(n, run_kwargs, batch_size=20):
+    """LLMModel.run on batches of prompts, boolean outputs (e.g. classification steps)"""
+    from gpt_graph.components.llm import LLMModel
+
+    llm = LLMModel(model_name="mock")
+    prompts = _get_prompts(n)
+    latencies = []
+    for start in range(0, n, batch_size):
+        t = time.monotonic()
+        llm.run(prompts[start : start + batch_size], output_type="boolean", **run_kwargs)
+        latencies.append(time.monotonic() - t)
+    return latencies
+
+
+def run_single(n, run_kwargs):
+    """sequential LLMModel.run on single prompts (e.g. a serial pipeline)"""
+    from gpt_graph.components.llm import LLMModel
+
+    llm = LLMModel(model_name="mock")
+    latencies = []
+    for prompt in _get_prompts(n):
+        t = time.monotonic()
+        llm.run(prompt, **run_kwargs)
+        latencies.append(time.monotonic() - t)
+    return latencies
+
+
+def run_summarizer(n, run_kwargs):
+    """Pipeline | Summarizer on a text of about n chunks (no run kwargs)"""
+    from gpt_graph.core.pipeline import Pipeline
+    from gpt_graph.components.summarizer import Summarizer
+
+    content = "\n".join(_get_prompts(n, words=150))
+    p = Pipeline()
+    p | Summarizer()
+    t = time.monotonic()
+    p.run(
+        input_data=content,
+        params={
+            "prompt": "summarize the following as outlines: {context}",
+            "model_name": "mock",
+            "max_token_count": 500,
+            "verbose": False,
+        },
+    )
+    return [time.monotonic() - t]
+
+
+def run_rag(n, run_kwargs):
+    """
+    RAG pipeline on n generated files, all its llm steps using the mock model.
+    run_kwargs are set on its llm steps (single inputs), e.g. "llm:hedge_percentile".
+    """
+    from gpt_graph.pipelines.rag import RAG
+
+    with tempfile.TemporaryDirectory() as folder:
+        for i, prompt in enumerate(_get_prompts(n, words=200)):
+            with open(os.path.join(folder, f"{i}.txt"), "w", encoding="utf-8") as f:
+                f.write(prompt)
+        p = RAG()
+        t = time.monotonic()
+        p.run(
+            folder_path=folder,
+            prompt="what is it about?",
+            params={
+                "llm.0:model_name": "mock",
+                "llm.1:model_name": "mock",
+                "summarizer:model_name": "mock",
+                "saver:output_folder": folder,
+                **{f"llm:{k}": v for k, v in run_kwargs.items()},
+            },
+        )
+        return [time.monotonic() - t]
+
+
+# name -> (function, LLMModel.run kwargs it uses): pack_size applies to batch inputs only,
+# hedging to single inputs only
+WORKLOADS = {
+    "batch": (run_batch, {"pack_size"}),
+    "single": (run_single, {"hedge_percentile"}),
+    "summarizer": (run_summarizer, set()),
+    "rag": (run_rag, {"hedge_percentile"}),
+}
+
+
+def warm_up(n=None):
+    """
+    Send n (LLMDispatcher.min_latencies by default) requests to the mock model, so that its
+    dispatcher knows the latency percentiles that hedge_percentile needs.
+    """
+    from gpt_graph.components.llm import LLMModel
+
+    LLMModel(model_name="mock").run(_get_prompts(n or LLMDispatcher.min_latencies))
+
+
+def run_benchmark(
+    workloads=("batch", "single", "summarizer"),
+    strategies=tuple(STRATEGIES),
+    n=100,
+    server_kwargs=None,
+):
+    """
+    Run each workload with each strategy against a new MockLLMServer. The strategies using
+    run kwargs that the workload does not use are skipped, the hedged ones run after a warm_up
+    (not counted in the stats).
+
+    Args:
+        workloads (list): names of WORKLOADS.
+        strategies (list): names of STRATEGIES.
+        n (int): number of prompts (or chunks/files) per run.
+        server_kwargs (dict): MockLLMServer kwargs, e.g. latency, latency_sigma, rate_limit_rate.
+
+    Returns:
+        list[dict]: one row per (workload, strategy) with requests/sec, p50/p99 latency of the
+        requests (server side) and of the calls (client side), tokens/sec and the 429/500 counts.
+    """
+    from gpt_graph.components.llm import LLMModel
+
+    server_kwargs = {"latency": 0.2, "latency_sigma": 0.5, **(server_kwargs or {})}
+    rows = []
+    for workload in workloads:
+        for strategy in strategies:
+            limits, run_kwargs = STRATEGIES[strategy]
+            run_workload, used_kwargs = WORKLOADS[workload]
+            if not set(run_kwargs) <= used_kwargs:
+                print(f"skipped {workload} {strategy}: {workload} does not use {run_kwargs}")
+                continue
+            LLMDispatcher.clear()
+            CircuitBreaker.clear()
+            with MockLLMServer(**server_kwargs) as server:
+                # every LLMModel created by the workload, also inside pipelines
+                LLMModel.extra_model_nickname_map = {"mock": server.get_model_info(**limits)}
+                t = time.monotonic()
+                try:
+                    if "hedge_percentile" in run_kwargs:
+                        warm_up()
+                        server.reset_stats()
+                        t = time.monotonic()
+                    call_latencies = run_workload(n, run_kwargs)
+                    error = None
+                except Exception as e:  # e.g. the embedding model of rag is not available
+                    call_latencies, error = [], e
+                finally:
+                    LLMModel.extra_model_nickname_map = {}
+                elapsed = time.monotonic() - t
+                stats = server.stats
+
+            tokens = stats["prompt_tokens"] + stats["completion_tokens"]
+            rows.append(
+                {
+                    "workload": workload,
+                    "strategy": strategy,
+                    "seconds": elapsed,
+                    "requests": stats["ok"],
+                    "requests/s": stats["ok"] / elapsed,
+                    "tokens/s": tokens / elapsed,
+                    "p50": percentile(stats["latencies"], 50),
+                    "p99": percentile(stats["latencies"], 99),
+                    "call_p50": percentile(call_latencies, 50),
+                    "call_p99": percentile(call_latencies, 99),
+                    "429": stats["rate_limited"],
+                    "500": stats["errors"],
+                    "error": repr(error) if error is not None else None,
+                }
+            )
+            print_rows(rows[-1:], if_header=len(rows) == 1)
+    return rows
+
+
+def print_rows(rows, if_header=True):
+    columns = ["workload", "strategy", "seconds", "requests", "requests/s", "tokens/s"]
+    columns += ["p50", "p99", "call_p50", "call_p99", "429", "500"]
+    if if_header:
+        print(" ".join(f"{c:>12}" for c in columns))
+    for row in rows:
+        cells = []
+        for c in columns:
+            value = row[c]
+            cells.append(f"{value:>12.3f}" if isinstance(value, float) else f"{str(value):>12}")
+        print(" ".join(cells) + (f"  {row['error']}" if row["error"] else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="LLM throughput benchmark against the local mock server"
+    )
+    parser.add_argument("--workloads", nargs="+", default=["batch", "single", "summarizer"])
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES))
+    parser.add_argument("--n", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--latency_sigma", type=float, default=0.5)
+    parser.add_argument("--slow_rate", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=float, default=None)
+    parser.add_argument("--tpm", type=float, default=None)
+    args = parser.parse_args()
+
+    run_benchmark(
+        workloads=args.workloads,
+        strategies=args.strategies,
+        n=args.n,
+        server_kwargs={
+            "latency": args.latency,
+            "latency_sigma": args.latency_sigma,
+            "slow_rate": args.slow_rate,
+            "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+            "rpm": args.rpm,
+            "tpm": args.tpm,
+        },
+    )
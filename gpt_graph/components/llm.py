@@ -17,7 +17,7 @@ from gpt_graph.utils.load_env import load_env
 
 load_env()
 
-from litellm import completion, batch_completion
+from litellm import completion
 
 # import instructor
 from instructor import OpenAISchema
@@ -29,8 +29,8 @@ import ast
 import numpy as np
 from jsonfinder import only_json
 import inspect
+import functools
 import gpt_graph.prompts.prompts_components_llm as prompts
-import time
 
 try:
     from gpt_graph.components.llm_poe import LLM_POE
@@ -38,7 +38,83 @@ except:
     LLM_POE = None
 
 from gpt_graph.core.component import Component
-import tomli
+from gpt_graph.utils.config_registry import ConfigRegistry
+from gpt_graph.utils.llm_dispatcher import (
+    LLMDispatcher,
+    backoff_delay,
+    estimate_tokens,
+    hedged_call,
+)
+from gpt_graph.utils.llm_cache import LLMResponseCache, _MISS
+
+
+class OutputParseError(ValueError):
+    """a response whose output can not be parsed/validated (retried by LLMModel.run)"""
+
+    def __init__(self, response, error):
+        super().__init__(f"can not parse the response: {error}")
+        self.response = response
+        self.error = error
+
+
+# %% schemas and request preparation, built once per process and shared by all instances
+
+
+class ListStrSchema(OpenAISchema):
+    """
+    List of string
+    """
+
+    list_str: List[str] = Field(..., description="The string of a list")
+
+
+class BooleanSchema(OpenAISchema):
+    """
+    Boolean value
+    """
+
+    value: bool = Field(..., description="A boolean value", examples=[True, False])
+
+
+@functools.lru_cache(maxsize=None)
+def _get_completion_params():
+    """names of the parameters of litellm completion"""
+    return frozenset(inspect.signature(completion).parameters)
+
+
+@functools.lru_cache(maxsize=256)
+def _get_tool_schema(class_schema):
+    """json schema of a schema class, generated once per class"""
+    return class_schema.openai_schema
+
+
+@functools.lru_cache(maxsize=256)
+def _get_tool(class_schema):
+    """
+    openai tool of a schema class, built once per class and shared by all the requests:
+    read-only, do not modify it.
+    """
+    return {"type": "function", "function": _get_tool_schema(class_schema)}
+
+
+@functools.lru_cache(maxsize=256)
+def _get_prompt_prefix(system_message_type, output_example):
+    """
+    messages before the input, built once per system message and example and shared by all
+    the requests (e.g. the items of a batch): read-only, do not modify them.
+    """
+    contents = []
+    if system_message_type is not None:
+        contents.append(system_message_type)
+    if output_example is not None:
+        output_example_str = (
+            "The output example is: "
+            + output_example
+            + "\nPlease follow strictly this format. "
+        )
+        contents.append(output_example_str)
+    return tuple({"role": "user", "content": content} for content in contents)
+
 
 # %% LLMModel
 
@@ -89,8 +165,21 @@ class LLMModel(Component):
     cache_schema = {}
     output_schema = {"result": {"type": str}}
     output_format = "plain"
+    # process-wide nicknames added to (or overriding) llm_model_map.toml, also for the
+    # LLMModel instances created by other components, e.g. by benchmarks/llm_throughput.py
+    extra_model_nickname_map = {}
+    _schema_classes = {}  # (class_name, fields, output_type) -> class, see _create_schema_class_from_spec
 
-    def __init__(self, model_name=None, if_initialize_poe=False):
+    def __init__(self, model_name=None, if_initialize_poe=False, response_cache=None):
+        """
+        Args:
+            model_name (str): nickname in llm_model_map.toml. Default "test".
+            if_initialize_poe (bool): whether to initialize LLM_POE.
+            response_cache (LLMResponseCache or bool): opt-in cache of the formatted outputs,
+                keyed by model_id, messages, tools, output_type and the other run kwargs
+                (e.g. temperature). True uses the process-wide LLMResponseCache.get_default().
+                Default None, every run calls the model.
+        """
         super().__init__(if_auto_detect_input=True)
         # Initialize the different models with a nickname map and a boolean indicating if it's an OpenAI model
         # if __file__:  # TODO in formal version delete this
@@ -107,8 +196,12 @@ class LLMModel(Component):
             "llm_model_map.toml",
         )
 
-        with open(file_path, "rb") as f:
-            self.model_nickname_map = tomli.load(f)
+        # parsed once per process and shared by all instances and clones;
+        # copied shallowly so that add_model_nickname_map stays per instance
+        self.model_nickname_map = {
+            **ConfigRegistry.load_toml(file_path),
+            **self.extra_model_nickname_map,
+        }
 
         self.curr_model_name = model_name if model_name is not None else "test"
         self.current_model_info = self.model_nickname_map[self.curr_model_name]
@@ -120,6 +213,13 @@ class LLMModel(Component):
         else:
             self.llm_poe = None
 
+        # not `or None`: an empty LLMResponseCache is falsy (len 0)
+        if response_cache is True:
+            response_cache = LLMResponseCache.get_default()
+        elif response_cache is False:
+            response_cache = None
+        self.response_cache = response_cache
+
     def chg_curr_model(self, model_name):
         self.curr_model_name = model_name if model_name is not None else "chat_mistral"
         self.current_model_info = self.model_nickname_map[self.curr_model_name]
@@ -141,10 +241,41 @@ class LLMModel(Component):
         verbose=False,
         if_return_prompt=False,
         wait_time: float = 0,  # for batch input can use this
+        stream_callback=None,  # func(delta, partial), see below
+        pack_size=None,  # for batch_string input, see below
+        hedge_percentile=None,  # e.g. 95, see below
+        latency_slo=None,  # seconds
         # if_output_np = False,
         **kwargs,
         # batch_size: int = 5, for batch input can use this
     ) -> Union[str, list, dict]:
+        """
+        max_fail_trials: number of requests of an item whose output can not be parsed. Only the
+            failed items of a batch are requested again, with exponential backoff and jitter.
+            Transport errors are retried by LLMDispatcher (see llm_dispatcher.py), the errors
+            it raises (e.g. a 400, CircuitBreakerOpenError) are raised for a single input. In a
+            batch, the item is requested again with the unparsable ones, and its error is raised
+            if it still fails after max_fail_trials (the outputs of the other items are cached
+            if response_cache is on).
+        stream_callback: for string/message inputs, the completion is streamed and
+            stream_callback(delta, partial) is called as the tokens arrive, where delta is the new
+            text and partial["content"] the text so far. A retried request (transport error or
+            unparsable output) streams again from the start: partial["content"] restarts
+            from the first delta of the new attempt. The return value is unchanged (the
+            formatted full output). Inside a pipeline, set it with set_params({"llm:stream_callback": func}),
+            the Step then passes a partial node instead (see Step._wrap_stream_callback).
+            Batch inputs are not streamed.
+        pack_size: for batch_string inputs of openai models with output_type string/boolean/list,
+            pack_size items are sent in one request and answered through a list_dict tool, e.g.
+            for classification prompts of a list_to_list step:
+            set_params({"llm:<UPDATE_STEP_TYPE>": "list_to_list", "llm:pack_size": 20}).
+            Items missing from a response are requested individually. Default None, one request per item.
+        hedge_percentile / latency_slo: for string/message inputs, if no response arrived after the
+            hedge_percentile latency of the model (e.g. 95, from its recent requests) or after
+            latency_slo seconds (whichever is first), the request is sent again to the next model of
+            its fallbacks in llm_model_map.toml (else to the same model). The first response
+            that can be parsed wins. Default None, no hedging.
+        """
         output_type = output_type or "string"
 
         # Update current model if a new model name is provided
@@ -182,6 +313,11 @@ class LLMModel(Component):
 
             output = generate_test_output(output_type, input_data)
             messages = [{"role": "user", "content": str(input_data)[:char_limit]}]
+            if stream_callback is not None and output_type == "string":
+                content = ""
+                for delta in regex.findall(r"\S+\s*", output):
+                    content += delta
+                    stream_callback(delta, {"content": content})
             if if_return_prompt:
                 return output, messages
             else:
@@ -203,6 +339,20 @@ class LLMModel(Component):
             input_data
         )  # batch_string, message, or string, batch_message
 
+        if pack_size is not None and pack_size > 1:
+            if self._if_packable(
+                input_type, output_type, tools, output_example, output_schema
+            ) and not (if_return_prompt or stream_callback):
+                return self._run_packed(
+                    input_data,
+                    output_type,
+                    pack_size,
+                    max_fail_trials=max_fail_trials,
+                    verbose=verbose,
+                    wait_time=wait_time,
+                    **kwargs,
+                )
+
         # Check if the model is OpenAI and if tools should be used
         if tools is None:
             class_schema = self._get_tools_if_needed(input_type, output_type)
@@ -215,7 +365,7 @@ class LLMModel(Component):
             class_schema = None
 
         if class_schema is not None:
-            tools = [{"type": "function", "function": class_schema.openai_schema}]
+            tools = [_get_tool(class_schema)]
 
         messages = self._prepare_messages(
             input_data, input_type, output_type, output_example, output_schema, tools
@@ -229,43 +379,107 @@ class LLMModel(Component):
         if verbose:
             print("messages:", {j: k[:500] for i in messages for j, k in i.items()})
 
-        attempt = 0
-        if max_fail_trials > 0:
-            if wait_time:
+        if_batch = input_type in ("batch_message", "batch_string")
+        batch_messages = messages if if_batch else [messages]
+
+        # outputs of the response cache, by index in batch_messages
+        cache_keys = self._get_response_cache_keys(
+            batch_messages, tools, output_type, if_return_tool_name, kwargs
+        )
+        outputs = self._get_cached_outputs(cache_keys)
+        pending = [i for i in range(len(batch_messages)) if i not in outputs]
+        if not pending:  # all cached
+            self._response_raw = None  # for debug
+            if stream_callback is not None and not if_batch and isinstance(outputs[0], str):
+                stream_callback(outputs[0], {"content": outputs[0]})
+
+        # retry only the items whose output can not be parsed, with backoff and jitter.
+        # transport errors (timeouts, 5xx, 429) are retried by the dispatcher already,
+        # the errors left are raised
+        last_responses = {}
+        for trial in range(max_fail_trials):
+            if not pending:
+                break
+            if trial > 0:
+                delay = backoff_delay(trial, base=max(wait_time, 0.5))
+                print(f"Retrying {len(pending)} item(s) in {delay:.1f}s...")
+                time.sleep(delay)
+            elif wait_time:
                 time.sleep(wait_time)
-            response = self._get_model_response(input_type, messages, tools, **kwargs)
-            self._response_raw = response  # for debug
-            try:
-                # Parse and format the output
-                if input_type in ("batch_message", "batch_string"):
-                    output = []
-                    for i in response:
-                        output.append(
-                            self._format_output(i, output_type, tools)
-                        )  # ,if_output_np))
-                else:
-                    output = self._format_output(
+
+            if if_batch:
+                responses = self._get_model_response(
+                    input_type, [messages[i] for i in pending], tools, **kwargs
+                )
+            elif stream_callback is None and (
+                hedge_percentile is not None or latency_slo is not None
+            ):
+                try:
+                    responses = [
+                        self._get_hedged_response(
+                            input_type,
+                            messages,
+                            tools,
+                            output_type,
+                            hedge_percentile=hedge_percentile,
+                            latency_slo=latency_slo,
+                            **kwargs,
+                        )
+                    ]
+                except OutputParseError as e:  # no model of the chain gave a valid output
+                    responses = [e]
+            else:
+                responses = [
+                    self._get_model_response(
+                        input_type,
+                        messages,
+                        tools,
+                        stream_callback=stream_callback,
+                        **kwargs,
+                    )
+                ]
+            self._response_raw = responses if if_batch else responses[0]  # for debug
+
+            failed = []
+            for i, response in zip(pending, responses):
+                if isinstance(response, OutputParseError):
+                    last_responses[i] = response.response
+                    failed.append(i)
+                    continue
+                last_responses[i] = response
+                if isinstance(response, Exception):  # error of the dispatcher
+                    if not if_batch:
+                        raise response
+                    print(f"Item {i} failed: {response!r}")
+                    failed.append(i)  # retried with the unparsable items
+                    continue
+                try:
+                    # Parse and format the output
+                    outputs[i] = self._format_output(
                         response,
                         output_type,
                         tools,
-                        if_return_tool_name=if_return_tool_name,
+                        if_return_tool_name=if_return_tool_name and not if_batch,
                     )  # , if_output_np)
-            except Exception as e:
-                print(f"Error parsing JSON: {e}")
-                if attempt < max_fail_trials - 1:
-                    print("Retrying...")
-                    attempt += 1
-                    output = self.run(
-                        input_data=input_data,
-                        output_type=output_type,
-                        output_example=output_example,
-                        model_name=model_name,
-                        max_fail_trials=max_fail_trials - 1,
-                        **kwargs,
-                    )
-                else:
-                    print("Max retries reached. Returning last known response.")
-                    output = response
+                except Exception as e:
+                    print(f"Error parsing JSON: {e}")
+                    failed.append(i)
+                    continue
+                self._set_cached_outputs(cache_keys, [i], [outputs[i]])
+            pending = failed
+
+        if pending:
+            for i in pending:
+                if isinstance(last_responses.get(i), Exception):  # never an output
+                    raise last_responses[i]
+            print("Max retries reached. Returning last known response.")
+            for i in pending:
+                outputs[i] = last_responses.get(i)
+
+        if if_batch:
+            output = [outputs[i] for i in range(len(batch_messages))]
+        else:
+            output = outputs[0]
 
         if if_return_prompt:
             return output, messages
@@ -279,6 +493,116 @@ class LLMModel(Component):
         result = self.llm_poe.run(input_data)
         return result
 
+    # answer field type of a packed item (tool schema) and its check
+    _packed_answer_types = {
+        "string": (str, str),
+        "boolean": (bool, bool),
+        "list": (List[str], list),
+    }
+
+    def _if_packable(self, input_type, output_type, tools, output_example, output_schema):
+        return (
+            input_type == "batch_string"
+            and output_type in self._packed_answer_types
+            and tools is None
+            and output_example is None
+            and output_schema is None
+            and self.current_model_info["if_openai"]
+            and not self.current_model_info.get("if_poe", False)
+        )
+
+    def _run_packed(self, input_data, output_type, pack_size, **kwargs):
+        """
+        Sends the items of a batch_string input pack_size at a time, each request answered with a
+        list_dict tool of (index, answer), and splits the answers back to the items.
+        Items missing from a response (or with an answer of the wrong type) are requested individually.
+
+        Returns:
+            list: one output per item of input_data, as run without packing.
+        """
+        answer_type, answer_check = self._packed_answer_types[output_type]
+        spec = {
+            "class_name": "item_answer",
+            "fields": [["index", int], ["answer", answer_type]],
+        }
+        chunks = [
+            list(range(start, min(start + pack_size, len(input_data))))
+            for start in range(0, len(input_data), pack_size)
+        ]
+        packed_prompts = [
+            self._get_packed_prompt([input_data[i] for i in chunk], output_type)
+            for chunk in chunks
+        ]
+        responses = self.run(packed_prompts, output_type="list_dict", tools=spec, **kwargs)
+
+        outputs = {}
+        for chunk, response in zip(chunks, responses):
+            if not isinstance(response, list):  # not parsed
+                continue
+            for item in response:
+                try:
+                    index, answer = int(item["index"]), item["answer"]
+                except (TypeError, KeyError, ValueError):
+                    continue
+                if 0 <= index < len(chunk) and isinstance(answer, answer_check):
+                    outputs.setdefault(chunk[index], answer)
+
+        missing = [i for i in range(len(input_data)) if i not in outputs]
+        if missing:
+            print(
+                f"{len(missing)} item(s) missing from the packed responses, "
+                "requesting them individually..."
+            )
+            answers = self.run(
+                [input_data[i] for i in missing], output_type=output_type, **kwargs
+            )
+            outputs.update(zip(missing, answers))
+
+        return [outputs[i] for i in range(len(input_data))]
+
+    @staticmethod
+    def _get_packed_prompt(items, output_type):
+        text = prompts.packed_items_prompt.format(
+            n=len(items), answer_format=prompts.packed_answer_formats[output_type]
+        )
+        for i, item in enumerate(items):
+            text += f"\n<ITEM {i}>\n{item}\n</ITEM {i}>"
+        return text
+
+    def _get_response_cache_keys(
+        self, batch_messages, tools, output_type, if_return_tool_name, kwargs
+    ):
+        """one key per message list of batch_messages, None if there is no response_cache"""
+        if self.response_cache is None:
+            return None
+
+        return [
+            LLMResponseCache.make_key(
+                model_id=self.current_model_info["model_id"],
+                messages=msgs,
+                tools=tools,
+                output_type=output_type,
+                if_return_tool_name=if_return_tool_name,
+                params=kwargs,  # sampling params, e.g. temperature
+            )
+            for msgs in batch_messages
+        ]
+
+    def _get_cached_outputs(self, cache_keys):
+        """return {index: output} of the cache hits"""
+        outputs = {}
+        for i, key in enumerate(cache_keys or []):
+            value = self.response_cache.get(key, _MISS)
+            if value is not _MISS:
+                outputs[i] = value
+        return outputs
+
+    def _set_cached_outputs(self, cache_keys, indexes, outputs):
+        if cache_keys is None:
+            return
+        for i, output in zip(indexes, outputs):
+            self.response_cache.set(cache_keys[i], output)
+
     def _determine_input_type(self, input_data):
         if isinstance(input_data, str):
             return "string"
@@ -331,11 +655,6 @@ class LLMModel(Component):
             elif output_type == "dict":
                 system_message_type = prompts.dict_format_prompt
 
-        # Initialize the prompt list with system messages if needed
-        prompt_list = []
-        if system_message_type is not None:
-            prompt_list.append({"role": "user", "content": system_message_type})
-
         #         if tools is not None:
         #             prompt_list.append({"role":"system", "content":"""
         # Only use function/tool calling.
@@ -346,56 +665,25 @@ class LLMModel(Component):
                 "{" + ",".join([f'"{i[0]}":"xx"' for i in output_schema]) + "}"
             )
 
-        if output_example is not None:
-            output_example_str = (
-                "The output example is: "
-                + output_example
-                + "\nPlease follow strictly this format. "
-            )
-            prompt_list.append({"role": "user", "content": output_example_str})
+        # system and example messages, cached and shared by the items of a batch
+        prefix = _get_prompt_prefix(system_message_type, output_example)
 
         # Append the user input data to the prompt list
         if input_type == "string":
-            prompt_list.append({"role": "user", "content": input_data})
+            prompt_list = [*prefix, {"role": "user", "content": input_data}]
         elif input_type == "message":
             # Assuming input_data is already a list of dicts with "role" and "content"
-            prompt_list.extend(input_data)
+            prompt_list = [*prefix, *input_data]
         elif input_type == "batch_string":
             # Assuming each item in the batch should be treated as a separate message
-            output = []
-            for msg in input_data:
-                prompt_list_temp = prompt_list.copy()
-                prompt_list_temp.append({"role": "user", "content": msg})
-                output.append(prompt_list_temp)
-            prompt_list = output
+            prompt_list = [[*prefix, {"role": "user", "content": msg}] for msg in input_data]
         elif input_type == "batch_message":
             # Assuming each item in the batch should be treated as a separate message
-            output = []
-            for msg in input_data:
-                prompt_list_temp = prompt_list.copy()
-                prompt_list_temp.extend(msg)
-                output.append(prompt_list_temp)
-            prompt_list = output
+            prompt_list = [[*prefix, *msg] for msg in input_data]
 
         return prompt_list
 
     def _get_tools_if_needed(self, input_type: str, output_type: str):
-        class ListStrSchema(OpenAISchema):
-            """
-            List of string
-            """
-
-            list_str: List[str] = Field(..., description="The string of a list")
-
-        class BooleanSchema(OpenAISchema):
-            """
-            Boolean value
-            """
-
-            value: bool = Field(
-                ..., description="A boolean value", examples=[True, False]
-            )
-
         if self.current_model_info["if_openai"]:
             if input_type in ["string", "message"]:
                 if output_type == "list":
@@ -409,43 +697,157 @@ class LLMModel(Component):
         input_type,
         messages,
         tools,
-        batch_size: int = 5,
-        wait_time: float = 1.0,
+        stream_callback=None,
+        model_info=None,
+        if_coalesce=True,
         **kwargs,
     ):
-        # print(kwargs)
-        # print(tools)
-        target_params = inspect.signature(completion).parameters
+        """
+        Send the request(s) through the LLMDispatcher of the model, shared by all steps,
+        which applies the rpm/tpm/max_concurrency limits of llm_model_map.toml and backs off on 429.
+        Batch inputs are sent concurrently, the responses keep the order of messages.
+        The response of a batch item that still fails after the retries of the dispatcher
+        is its exception, so that the other items are kept.
+        Identical requests (same messages, tools and params) are sent once, within the batch
+        and across concurrent steps, and the response is shared.
+        With stream_callback (single input only), the completion is streamed to it and the chunks
+        are rebuilt into a normal response for _format_output.
+        model_info is the entry of another nickname (e.g. a fallback), default the current model.
+        if_coalesce False sends a single request even if an identical one is in flight (hedging).
+        """
+        model_info = model_info or self.current_model_info
+        target_params = _get_completion_params()
         filtered_kwargs = {
             key: value for key, value in kwargs.items() if key in target_params
         }
-        max_tokens = self.current_model_info.get("max_tokens")
-        if input_type in ("batch_string", "batch_message"):
-            # Handle batch completion if a list of message lists is provided
-            responses = []
-            for i in range(0, len(messages), batch_size):
-                batch_messages = messages[i : i + batch_size]
-                responses.extend(
-                    batch_completion(
-                        model=self.current_model_info["model_id"],
-                        messages=batch_messages,
-                        tools=tools,
-                        max_tokens=max_tokens,
-                        **filtered_kwargs,
-                    )
-                )
-                time.sleep(wait_time)
-            return responses
-        else:
-            # Handle single completion
+        max_tokens = model_info.get("max_tokens")
+        # e.g. a local OpenAI compatible server, see mock_llm_server.py
+        filtered_kwargs.update(
+            {key: model_info[key] for key in ("api_base", "api_key") if key in model_info}
+        )
+        dispatcher = LLMDispatcher.from_model_info(model_info)
+        model_id = model_info["model_id"]
+
+        def get_key(msgs):
+            return LLMResponseCache.make_key(
+                model_id=model_info["model_id"],
+                messages=msgs,
+                tools=tools,
+                max_tokens=max_tokens,
+                params=filtered_kwargs,
+            )
+
+        def get_completion(msgs):
             return completion(
-                model=self.current_model_info["model_id"],
-                messages=messages,
+                model=model_info["model_id"],
+                messages=msgs,
                 tools=tools,
                 max_tokens=max_tokens,
                 **filtered_kwargs,
             )
 
+        def get_streamed_completion(msgs):
+            chunks = []
+            content = ""
+            stream_kwargs = {k: v for k, v in filtered_kwargs.items() if k != "stream"}
+            for chunk in completion(
+                model=model_info["model_id"],
+                messages=msgs,
+                tools=tools,
+                max_tokens=max_tokens,
+                stream=True,
+                **stream_kwargs,
+            ):
+                chunks.append(chunk)
+                delta = chunk.choices[0].delta.content or ""
+                if delta:
+                    content += delta
+                    stream_callback(delta, {"content": content})
+            return litellm.stream_chunk_builder(chunks, messages=msgs)
+
+        if input_type in ("batch_string", "batch_message"):
+            # Handle batch completion if a list of message lists is provided
+            return dispatcher.map(
+                get_completion,
+                messages,
+                tokens=[estimate_tokens(msgs, max_tokens, model_id) for msgs in messages],
+                keys=[get_key(msgs) for msgs in messages],
+                if_return_exceptions=True,  # a failed item does not cost the whole batch
+            )
+        elif stream_callback is not None:
+            # not coalesced, every caller gets its own deltas
+            return dispatcher.call(
+                get_streamed_completion,
+                messages,
+                tokens=estimate_tokens(messages, max_tokens, model_id),
+            )
+        else:
+            # Handle single completion
+            return dispatcher.call(
+                get_completion,
+                messages,
+                tokens=estimate_tokens(messages, max_tokens, model_id),
+                key=get_key(messages) if if_coalesce else None,
+            )
+
+    def _get_hedged_response(
+        self,
+        input_type,
+        messages,
+        tools,
+        output_type,
+        hedge_percentile=None,
+        latency_slo=None,
+        **kwargs,
+    ):
+        """
+        Send a single request along the fallback chain of the model (its fallbacks in
+        llm_model_map.toml, else the model itself twice), the next one being sent when the
+        previous ones are slower than the hedge delay or failed. See hedged_call.
+        A response counts only if _format_output can parse it.
+        """
+        model_names = [self.curr_model_name] + list(
+            self.current_model_info.get("fallbacks", [])
+        )
+        model_infos = [
+            self.model_nickname_map[name]
+            for name in model_names
+            if not self.model_nickname_map[name].get("if_poe", False)
+            and (tools is None or self.model_nickname_map[name]["if_openai"])
+        ]
+        if len(model_infos) == 1:
+            model_infos = model_infos * 2
+
+        delay = None
+        if hedge_percentile is not None:
+            dispatcher = LLMDispatcher.from_model_info(self.current_model_info)
+            delay = dispatcher.get_latency_percentile(hedge_percentile)
+        if latency_slo is not None:
+            delay = latency_slo if delay is None else min(delay, latency_slo)
+
+        def get_valid_response(model_info, if_coalesce):
+            response = self._get_model_response(
+                input_type,
+                messages,
+                tools,
+                model_info=model_info,
+                if_coalesce=if_coalesce,
+                **kwargs,
+            )
+            try:
+                self._format_output(response, output_type, tools)
+            except Exception as e:
+                raise OutputParseError(response, e)
+            return response
+
+        return hedged_call(
+            [
+                functools.partial(get_valid_response, model_info, i == 0)
+                for i, model_info in enumerate(model_infos)
+            ],
+            delay,
+        )
+
     def _format_output(
         self,
         response,
@@ -528,7 +930,8 @@ class LLMModel(Component):
                 where each inner list contains a field specification in the format [field_name, field_type].
 
         Returns:
-        - Dynamically created class.
+        - Dynamically created class. It is cached by spec and output_type, so that every call
+          (and clone) with the same spec gets the same class and its generated schema.
 
         example input:
             {
@@ -539,6 +942,19 @@ class LLMModel(Component):
                 ]
             }
         """
+        try:
+            key = (spec["class_name"], tuple(map(tuple, spec["fields"])), output_type)
+            schema_class = self._schema_classes.get(key)
+        except TypeError:  # unhashable field type, not cached
+            key, schema_class = None, None
+
+        if schema_class is None:
+            schema_class = self._build_schema_class_from_spec(spec, output_type)
+            if key is not None:
+                self._schema_classes[key] = schema_class
+        return schema_class
+
+    def _build_schema_class_from_spec(self, spec: dict, output_type="dict"):
         class_name = spec["class_name"]
         fields_spec = spec["fields"]
 
@@ -5,14 +5,30 @@ Created on Thu Feb 29 16:09:23 2024
 @author: User
 """
 
+import os
+import json
 from transformers import AutoTokenizer, AutoModel
 import torch
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 from gpt_graph.core.component import Component
+from gpt_graph.utils.vector_index import ExactIndex, get_index, select
+from gpt_graph.utils.bm25 import BM25Index
+from gpt_graph.utils.embedding_cache import EmbeddingCache
+from gpt_graph.utils.model_registry import ModelRegistry
+from gpt_graph.utils.onnx_encoder import OnnxEncoder, export_encoder, compare_embeddings
 from typing import List, Dict
 
 
+def _load_transformers_encoder(model_name):
+    return AutoTokenizer.from_pretrained(model_name), AutoModel.from_pretrained(model_name)
+
+
+def _load_onnx_encoder(model_name, intra_op_threads=None):
+    return AutoTokenizer.from_pretrained(model_name), OnnxEncoder(
+        export_encoder(model_name), intra_op_threads=intra_op_threads
+    )
+
+
 class Retriever(Component):
     step_type = "list_to_list"
     input_schema = {
@@ -21,40 +37,446 @@ class Retriever(Component):
     cache_schema = {}
     output_schema = {"result": {"type": List[Dict]}}
     output_format = "node"
+    batch_size = 32  # texts per forward pass of the embedding model
+    default_model = "BAAI/bge-small-en-v1.5"
 
-    def __init__(self, **kwargs):
-        self.model = None
-        self.tokenizer = None  # AutoTokenizer.from_pretrained(model_name)
+    def __init__(
+        self,
+        embedding_cache=None,
+        index_backend="exact",
+        index_params=None,
+        encoder_backend="torch",
+        intra_op_threads=None,
+        lexical_index=None,
+        index_folder=None,
+        **kwargs,
+    ):
+        """
+        Args:
+            embedding_cache (EmbeddingCache or bool): opt-in persistent cache of the embeddings,
+                keyed by model name and text, consulted before running the model.
+                True uses EmbeddingCache.get_default(). Default None.
+            index_backend (str): "exact" (brute force, default) or "ivf" (approximate, for large
+                corpora), see vector_index.py.
+            index_params (dict): kwargs of the index, e.g. {"nprobe": 16, "min_train": 10000},
+                or {"dtype": "int8"} for compact rows rescored in full precision.
+                Per query knobs are set with run(search_params={"nprobe": 32}).
+            encoder_backend (str): "torch" (default) or "onnx": the model exported to ONNX
+                with int8 weights, run by onnxruntime on CPU (see onnx_encoder.py and
+                check_parity).
+            intra_op_threads (int): threads of the onnx encoder, None for all the cores.
+            lexical_index (BM25Index or bool): opt-in BM25 index of the node contents, a first
+                stage for run(lexical_top_m=..., lexical_weight=...). True uses BM25Index().
+            index_folder (str): opt-in folder where the index is persisted and reopened from,
+                so that the next runs only embed the added or modified sources
+                (see _reuse_rows and sync_sources). The backend and params of the saved
+                index take precedence over index_backend and index_params (a warning is
+                printed if they differ), capacity and full_precision_path are kept.
+        """
+        if encoder_backend not in ("torch", "onnx"):
+            raise ValueError(f"unknown encoder backend {encoder_backend}, use torch or onnx")
+        self.encoder_backend = encoder_backend
+        self.intra_op_threads = intra_op_threads
+        self.model_name = None
+        # tokenizer and model, shared with all the retrievers (and clones) of the same model
+        self.encoder = None
+        if embedding_cache is True:
+            embedding_cache = EmbeddingCache.get_default()
+        self.embedding_cache = embedding_cache or None
         self.nodes = []
+        # row i is the embedding of self.nodes[i] (extra["embedding_row"])
+        self.index_backend = index_backend
+        self.index_params = index_params or {}
+        self.index = get_index(index_backend, **self.index_params)
+        if lexical_index is True:
+            lexical_index = BM25Index()
+        # same rows as self.index. Not `or None`: an empty BM25Index is falsy (len 0)
+        self.lexical_index = None if lexical_index is False else lexical_index
+        self.index_folder = index_folder
+        self._live_rows = {}  # (source, content hash) -> row, if index_folder
+        self._source_rows = {}  # source -> rows not deleted, if index_folder
+        self._if_changed = False  # not saved yet
+        self._index_version = None  # st_mtime_ns of the nodes.jsonl loaded or saved
+        if index_folder is not None and os.path.exists(self._get_index_path("nodes.jsonl")):
+            self.load_index()
         super().__init__(**kwargs)
         # self.model = AutoModel.from_pretrained(model_name)
 
+    @staticmethod
+    def _get_registry_key(model_name, encoder_backend="torch", intra_op_threads=None):
+        if encoder_backend == "onnx":
+            return f"onnx:{model_name}:{intra_op_threads or 'all'}"
+        return f"transformers:{model_name}"
+
+    @staticmethod
+    def _get_loader(model_name, encoder_backend="torch", intra_op_threads=None):
+        if encoder_backend == "onnx":
+            return lambda: _load_onnx_encoder(model_name, intra_op_threads)
+        return lambda: _load_transformers_encoder(model_name)
+
+    @classmethod
+    def preload(cls, model_names=None, encoder_backend="torch", intra_op_threads=None):
+        """
+        Load the models in the ModelRegistry ahead of traffic, e.g. when a worker starts.
+        """
+        for model_name in model_names or [cls.default_model]:
+            key = cls._get_registry_key(model_name, encoder_backend, intra_op_threads)
+            ModelRegistry.register(
+                key, cls._get_loader(model_name, encoder_backend, intra_op_threads)
+            )
+            ModelRegistry.preload([key])
+
+    def set_model(self, model_name):
+        self.model_name = model_name
+        self.encoder = ModelRegistry.get_handle(
+            self._get_registry_key(model_name, self.encoder_backend, self.intra_op_threads),
+            self._get_loader(model_name, self.encoder_backend, self.intra_op_threads),
+        )
+
+    @property
+    def embedding_name(self):
+        """name of the embeddings in the embedding cache, per model and encoder backend"""
+        if self.encoder_backend == "onnx":
+            return f"{self.model_name}:onnx-int8"
+        return self.model_name
+
+    @property
+    def tokenizer(self):
+        return None if self.encoder is None else self.encoder.get()[0]
+
+    @property
+    def model(self):
+        return None if self.encoder is None else self.encoder.get()[1]
+
+    def get_node_embedding(self, node):
+        """normalized embedding (d,) of an added node, from its row in the index"""
+        return self.index.get_vectors([node["extra"]["embedding_row"]])[0]
+
     def _get_embedding(self, text):
         """Creates an embedding for the given text."""
-        inputs = self.tokenizer(
-            text, return_tensors="pt", padding=True, truncation=True
+        return self._get_embeddings([text])
+
+    def _get_embeddings(self, texts, batch_size=None, encoder=None, encoder_backend=None):
+        """
+        Creates the embeddings (n, d) of texts, batch_size texts per forward pass.
+        Texts are sorted by length so that each batch is padded to similar lengths,
+        and the mean pooling ignores the padding tokens.
+        encoder is a (tokenizer, model) of encoder_backend, by default the ones of self.
+        """
+        batch_size = batch_size or self.batch_size
+        tokenizer, model = encoder or (self.tokenizer, self.model)
+        encoder_backend = encoder_backend or self.encoder_backend
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            batch = order[start : start + batch_size]
+            inputs = tokenizer(
+                [texts[i] for i in batch],
+                return_tensors="np" if encoder_backend == "onnx" else "pt",
+                padding=True,
+                truncation=True,
+            )
+            if encoder_backend == "onnx":
+                hidden = model(**inputs)
+            else:
+                with torch.no_grad():
+                    hidden = model(**inputs).last_hidden_state.cpu().numpy()
+            mask = np.asarray(inputs["attention_mask"])[:, :, None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / mask.sum(axis=1)
+            for i, emb in zip(batch, pooled):
+                embeddings[i] = emb
+        return np.stack(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+
+    def check_parity(self, texts, min_cosine=0.99):
+        """
+        Compare the embeddings of texts by this encoder with the ones of the PyTorch model,
+        e.g. after switching to encoder_backend="onnx".
+
+        Returns:
+            dict of compare_embeddings, raises ValueError if min_cosine is not reached.
+        """
+        if self.encoder is None:
+            self.set_model(self.default_model)
+        reference = ModelRegistry.get_handle(
+            self._get_registry_key(self.model_name), self._get_loader(self.model_name)
         )
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-        return outputs.last_hidden_state.mean(dim=1).cpu().numpy()
+        result = compare_embeddings(
+            self._get_embeddings(texts),
+            self._get_embeddings(texts, encoder=reference.get(), encoder_backend="torch"),
+        )
+        print(f"parity of {self.embedding_name} with {self.model_name}: {result}")
+        if result["min_cosine"] < min_cosine:
+            raise ValueError(f"min cosine {result['min_cosine']:.4f} is below {min_cosine}")
+        return result
 
     def add_nodes(self, new_nodes):
+        node_dicts = []
         for node in new_nodes:
             if isinstance(node, str):
-                text = node
-                extra = {}
-                node_dict = {"content": text, "extra": extra}
+                node_dicts.append({"content": node, "extra": {}})
+            else:
+                node_dicts.append(node)
+
+        if self.index_folder is not None:
+            node_dicts = self._reuse_rows(node_dicts)
+
+        # embed the nodes without embedding in extra, nor a row of this index, in batches
+        embeddings = {}
+        for i, node in enumerate(node_dicts):
+            extra = node["extra"]
+            if "embedding" in extra:
+                embeddings[i] = np.asarray(extra["embedding"], dtype=np.float32).reshape(-1)
+            elif self._if_own_row(node):  # e.g. a node returned by run, added again
+                embeddings[i] = self.index.get_vectors(
+                    [extra["embedding_row"]], if_full_precision=True
+                )[0]
+        missing = [i for i in range(len(node_dicts)) if i not in embeddings]
+        if missing:
+            texts = [node_dicts[i]["content"] for i in missing]
+            if self.embedding_cache is not None:
+                found = self.embedding_cache.get_many(self.embedding_name, texts)
+            else:
+                found = {}
+            to_embed = [j for j in range(len(texts)) if j not in found]
+            if to_embed:
+                new_embeddings = self._get_embeddings([texts[j] for j in to_embed])
+                found.update(zip(to_embed, new_embeddings))
+                if self.embedding_cache is not None:
+                    self.embedding_cache.set_many(
+                        self.embedding_name, [texts[j] for j in to_embed], new_embeddings
+                    )
+            for j, i in enumerate(missing):
+                embeddings[i] = found[j]
+
+        if node_dicts:
+            rows = self.index.add(np.stack([embeddings[i] for i in range(len(node_dicts))]))
+            # the embedding is kept once, in the index: the node only refers to its row
+            for node, row in zip(node_dicts, rows):
+                node["extra"].pop("embedding", None)
+                node["extra"]["embedding_row"] = int(row)
+            if self.lexical_index is not None:
+                self.lexical_index.add([node["content"] for node in node_dicts])
+        self.nodes.extend(node_dicts)
+
+        if self.index_folder is not None:
+            for node in node_dicts:
+                self._add_live_row(node)
+            if node_dicts:
+                self._if_changed = True
+
+    def _if_own_row(self, node):
+        """whether extra["embedding_row"] of node is the row of its content in self.index"""
+        row = node["extra"].get("embedding_row")
+        return (
+            isinstance(row, int)
+            and 0 <= row < len(self.nodes)
+            and self.nodes[row]["content"] == node["content"]
+        )
+
+    @staticmethod
+    def _get_source(node):
+        return node["extra"].get("input_file_path")  # e.g. from TextExtractor
+
+    def _get_index_path(self, name):
+        return os.path.join(self.index_folder, name)
+
+    def _add_live_row(self, node):
+        source = self._get_source(node)
+        row = node["extra"]["embedding_row"]
+        self._live_rows[(source, node["extra"]["content_hash"])] = row
+        self._source_rows.setdefault(source, set()).add(row)
+
+    def _delete_rows(self, rows):
+        """tombstone rows, e.g. of a modified or deleted source"""
+        rows = list(rows)
+        if not rows:
+            return
+        self.index.delete(rows)
+        for row in rows:
+            node = self.nodes[row]
+            source = self._get_source(node)
+            self._live_rows.pop((source, node["extra"]["content_hash"]), None)
+            self._source_rows.get(source, set()).discard(row)
+            if not self._source_rows.get(source, True):
+                del self._source_rows[source]
+        self._if_changed = True
+
+    def _reuse_rows(self, node_dicts):
+        """
+        Incremental ingestion of a persisted index: a node with the same source and content
+        as a live row takes the row (no embedding), the other rows of its source are
+        tombstoned (e.g. a modified file).
+
+        Returns:
+            the nodes to embed and add.
+        """
+        new_nodes = []
+        source_hashes = {}
+        for node in node_dicts:
+            extra = node["extra"]
+            source = self._get_source(node)
+            extra["content_hash"] = EmbeddingCache.get_key(node["content"])
+            if source is not None and os.path.exists(source):
+                extra["source_mtime"] = os.path.getmtime(source)
+            source_hashes.setdefault(source, set()).add(extra["content_hash"])
+
+            row = self._live_rows.get((source, extra["content_hash"]))
+            if row is None:
+                new_nodes.append(node)
             else:
-                text = node["content"]
-                extra = node["extra"]
-                node_dict = node
+                extra.pop("embedding", None)
+                extra["embedding_row"] = row
+                self.nodes[row] = node  # lineage to the node of this run
+
+        for source, hashes in source_hashes.items():
+            if source is not None:
+                self._delete_rows(
+                    row
+                    for row in list(self._source_rows.get(source, ()))
+                    if self.nodes[row]["extra"]["content_hash"] not in hashes
+                )
+        return new_nodes
+
+    def sync_sources(self, sources):
+        """tombstone the rows of the sources that are not in sources (e.g. deleted files)"""
+        sources = set(sources)
+        self._delete_rows(
+            row
+            for source, rows in list(self._source_rows.items())
+            if source is not None and source not in sources
+            for row in rows
+        )
 
-            # Check if embedding already exists in extra
-            if "embedding" not in extra:
-                emb = self._get_embedding(text)
-                extra["embedding"] = emb
+    def save_index(self):
+        """
+        Persist the index in index_folder: index.npz (embeddings and tombstones) and
+        nodes.jsonl (content and extra of each row: content hash, source and its mtime).
+        """
+        os.makedirs(self.index_folder, exist_ok=True)
+        tmp_path = self._get_index_path("index.tmp.npz")
+        self.index.save(tmp_path)
+        os.replace(tmp_path, self._get_index_path("index.npz"))
 
-            self.nodes.append(node_dict)
+        tmp_path = self._get_index_path("nodes.tmp.jsonl")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for node in self.nodes:
+                # node_id is not kept: it refers to the node graph of the run
+                record = {"content": node["content"], "extra": node["extra"]}
+                f.write(json.dumps(record, default=str) + "\n")
+        os.replace(tmp_path, self._get_index_path("nodes.jsonl"))
+        self._if_changed = False
+        self._index_version = os.stat(self._get_index_path("nodes.jsonl")).st_mtime_ns
+        print(
+            f"saved {len(self.nodes)} nodes ({self.index.n_deleted} deleted) "
+            f"at {self.index_folder}"
+        )
+
+    def load_index(self):
+        """
+        reopen the index saved by save_index, with its saved backend and params
+        (see index_folder in __init__)
+        """
+        index = get_index(self.index_backend, **self.index_params)
+        params = index.get_params()
+        self.index = ExactIndex.load(self._get_index_path("index.npz"), index=index)
+        saved_params = self.index.get_params()
+        if saved_params != params:
+            diff = {
+                key: saved_params.get(key)
+                for key in set(params) | set(saved_params)
+                if saved_params.get(key) != params.get(key)
+            }
+            print(
+                f"Warning: the index saved at {self.index_folder} is used with its own "
+                f"settings {diff}, not index_backend/index_params"
+            )
+        with open(self._get_index_path("nodes.jsonl"), "r", encoding="utf-8") as f:
+            self.nodes = [json.loads(line) for line in f]
+        self._index_version = os.stat(self._get_index_path("nodes.jsonl")).st_mtime_ns
+        self._live_rows, self._source_rows = {}, {}
+        for row, node in enumerate(self.nodes):
+            if not self.index.is_deleted(row):
+                self._add_live_row(node)
+        if self.lexical_index is not None:
+            self.lexical_index.clear()
+            self.lexical_index.add([node["content"] for node in self.nodes])
+        self._if_changed = False
+
+    def refresh_index(self):
+        """
+        Reopen the index if it was saved by another retriever since it was loaded,
+        e.g. by the clone run by the previous run of a pipeline.
+        """
+        path = self._get_index_path("nodes.jsonl")
+        if not self._if_changed and os.path.exists(path):
+            if os.stat(path).st_mtime_ns != self._index_version:
+                self.load_index()
+
+    def get_indexed_texts(self):
+        """
+        Text of the sources indexed as one node (e.g. a file of TextExtractor), to skip the
+        extraction of the unchanged files: TextExtractor.run(cached_texts=...).
+
+        Returns:
+            {source: {"content": str, "mtime": float, "word_limit": int}}
+        """
+        self.refresh_index()
+        texts = {}
+        for source, rows in self._source_rows.items():
+            if source is not None and len(rows) == 1:
+                node = self.nodes[next(iter(rows))]
+                texts[source] = {
+                    "content": node["content"],
+                    "mtime": node["extra"].get("source_mtime"),
+                    "word_limit": node["extra"].get("word_limit"),
+                }
+        return texts
+
+    def _search_hybrid(
+        self,
+        text,
+        embedding,
+        top_k,
+        lower_threshold,
+        upper_threshold,
+        sorted,
+        lexical_top_m=None,
+        lexical_weight=0.0,
+        search_params=None,
+    ):
+        """
+        Score with the embeddings only the lexical_top_m best BM25 rows of text (all the rows
+        matching a term of text if None), so that the dense work per query scales with
+        lexical_top_m instead of the number of nodes.
+        The score is (1 - lexical_weight) * cosine + lexical_weight * BM25 / best BM25,
+        the thresholds apply to it.
+        Falls back to the dense search of all the rows if too few rows match text.
+        The deleted rows are not candidates.
+
+        Returns:
+            (indices, scores) as ExactIndex.search
+        """
+        rows, lexical_scores = self.lexical_index.search(
+            text, lexical_top_m, excluded_rows=self.index.get_deleted_rows()
+        )
+        if len(rows) < (top_k or 1):
+            return self.index.search(
+                embedding, top_k, lower_threshold, upper_threshold, sorted, **(search_params or {})
+            )
+        if not lexical_weight:
+            return self.index.search_rows(
+                embedding, rows, top_k, lower_threshold, upper_threshold, sorted
+            )
+
+        # in the order of rows, without the deleted ones
+        dense_rows, dense_scores = self.index.search_rows(embedding, rows, sorted=False)
+        lexical_scores = lexical_scores[np.isin(rows, dense_rows)]
+        rows = dense_rows
+        scores = (1 - lexical_weight) * dense_scores + lexical_weight * (
+            lexical_scores / max(lexical_scores.max(initial=0), 1e-12)
+        )
+        indices = select(scores, top_k, lower_threshold, upper_threshold, sorted)
+        return rows[indices], scores[indices]
 
     def run(
         self,
@@ -67,15 +489,44 @@ class Retriever(Component):
         upper_threshold=None,
         sorted=True,
         return_scores=False,
+        batch_size=None,
+        search_params=None,
+        if_group_by_query=False,
+        lexical_top_m=None,
+        lexical_weight=0.0,
+        if_sync_sources=True,
         **kwargs,
     ):
+        """
+        Embeds the nodes, then if query is given, returns copies of the top_k nodes most similar
+        to it (or of the nodes within the thresholds), with parent_nodes to the node and,
+        if query is a node, to the query.
+
+        query can also be a list of strings/nodes: they are embedded in one batch and scored
+        with one matrix product. The results of all the queries are returned in one list,
+        each node with extra["query_index"], or one list per query if if_group_by_query.
+
+        With a lexical_index, lexical_top_m and lexical_weight select a hybrid search,
+        see _search_hybrid.
+
+        With an index_folder, nodes are the whole corpus: only the added or modified ones are
+        embedded, the rows of the sources not in nodes are tombstoned if if_sync_sources, and
+        the index is saved if it changed. The unchanged files are not extracted again either
+        if TextExtractor gets cached_texts=get_indexed_texts() (see RAG).
+        """
         # Initialize model and tokenizer if model name is provided
-        if self.model is None and model is None:
-            model = "BAAI/bge-small-en-v1.5"
+        if self.encoder is None and model is None:
+            model = self.default_model
 
-        if model is not None:
-            self.tokenizer = AutoTokenizer.from_pretrained(model)
-            self.model = AutoModel.from_pretrained(model)
+        # loaded once per process, see ModelRegistry
+        if model is not None and model != self.model_name:
+            self.set_model(model)
+
+        if batch_size is not None:
+            self.batch_size = batch_size
+
+        if self.index_folder is not None:
+            self.refresh_index()
 
         # Use stored nodes if not provided
         if nodes is None:
@@ -83,67 +534,87 @@ class Retriever(Component):
         else:
             # Use provided nodes
             self.add_nodes(nodes)
+            if self.index_folder is not None and if_sync_sources:
+                self.sync_sources(
+                    self._get_source(node) for node in nodes if isinstance(node, dict)
+                )
             nodes = self.nodes
 
         # Add new nodes if provided
         if added_nodes is not None:
             self.add_nodes(added_nodes)
 
-        node_embeddings = [node["extra"]["embedding"] for node in nodes]
+        if self.index_folder is not None and self._if_changed:
+            self.save_index()
 
         # if query is None, do the embedding only
         if query is None:
             return nodes
 
         """Finds the top-k documents similar to the query or those above a similarity threshold."""
-        if isinstance(query, str):
-            query_text = query
-        else:
-            query_text = query["content"]
-        query_embedding = self._get_embedding(
-            query_text
-        )  # Assuming this returns a 2D array
-
-        scores = []
-        for node_emb in node_embeddings:
-            sim = cosine_similarity(query_embedding, node_emb)
-            scores.append(sim)
-
-        scores = [i.item() for i in scores]
-
-        if top_k is not None:
-            top_k_indices = np.argsort(scores)[-top_k:][::-1]
-        elif lower_threshold is not None or upper_threshold is not None:
-            if lower_threshold is None:
-                lower_threshold = -np.inf  # No lower bound if not specified
-            if upper_threshold is None:
-                upper_threshold = np.inf  # No upper bound if not specified
-            top_k_indices = np.where(
-                (np.array(scores) >= lower_threshold)
-                & (np.array(scores) <= upper_threshold)
-            )[0]
-        elif sorted:
-            top_k_indices = np.argsort(scores)[::-1]
+        # a list of queries (strings or nodes) is embedded in one batch and scored at once
+        queries = query if isinstance(query, list) else [query]
+        query_texts = [q if isinstance(q, str) else q["content"] for q in queries]
+        query_embeddings = self._get_embeddings(query_texts)
+
+        if self.lexical_index is not None and (lexical_top_m is not None or lexical_weight):
+            results = [
+                self._search_hybrid(
+                    text,
+                    embedding,
+                    top_k,
+                    lower_threshold,
+                    upper_threshold,
+                    sorted,
+                    lexical_top_m,
+                    lexical_weight,
+                    search_params,
+                )
+                for text, embedding in zip(query_texts, query_embeddings)
+            ]
         else:
-            top_k_indices = np.arange(len(scores))
+            # cosine similarity with all the nodes at once, see ExactIndex
+            results = self.index.search_many(
+                query_embeddings,
+                top_k=top_k,
+                lower_threshold=lower_threshold,
+                upper_threshold=upper_threshold,
+                sorted=sorted,
+                **(search_params or {}),
+            )
 
         # Embedded function to create a copy of a node
-        def create_copy_node(node):
+        def create_copy_node(node, query_node, query_index):
+            parent_nodes = [node["node_id"]] if "node_id" in node else []
+            if isinstance(query_node, dict) and "node_id" in query_node:
+                parent_nodes.append(query_node["node_id"])  # lineage to the query
+            extra = dict(node["extra"])  # e.g. add_nodes of the copy sets its embedding_row
+            if isinstance(query, list):
+                extra["query_index"] = query_index
             return {
                 "content": node["content"],
-                "extra": node["extra"],
-                "parent_nodes": [node["node_id"]],
+                "extra": extra,
+                "parent_nodes": parent_nodes,
             }
 
-        top_k_nodes = [create_copy_node(nodes[i]) for i in top_k_indices]
-
-        # top_k_nodes = [nodes[i] for i in top_k_indices]
+        outputs = []
+        for query_index, (query_node, (top_k_indices, top_k_scores)) in enumerate(
+            zip(queries, results)
+        ):
+            top_k_nodes = [
+                create_copy_node(nodes[i], query_node, query_index) for i in top_k_indices
+            ]
+            if return_scores:
+                outputs.append(list(zip(top_k_nodes, top_k_scores.tolist())))
+            else:
+                outputs.append(top_k_nodes)
 
-        if return_scores:
-            top_k_scores = [scores[i] for i in top_k_indices]
-            return list(zip(top_k_nodes, top_k_scores))
-        else:
-            return top_k_nodes
+        if not isinstance(query, list):
+            return outputs[0]
+        elif if_group_by_query:
+            return outputs
+        else:  # one list, e.g. for a list_to_list step, see extra["query_index"]
+            return [item for output in outputs for item in output]
 
 
 if __name__ == "__main__":
@@ -57,14 +57,30 @@ class TextExtractor(Component):
         word_limit=None,
         if_save=True,
         if_return_path=False,
+        cached_texts=None,
     ):
+        """
+        Args:
+            cached_texts (dict): {input_file_path: {"content", "mtime", "word_limit"}} of the
+                files extracted before, e.g. Retriever.get_indexed_texts(). A file not modified
+                since (same mtime and word_limit) is not read nor saved again.
+        """
         self.input_file_path = input_file_path
         # Determine the file extension
         file_extension = os.path.splitext(self.input_file_path)[1].lower()
         text = ""
 
+        cached = (cached_texts or {}).get(str(self.input_file_path))
+        if_cached = (
+            cached is not None
+            and cached.get("mtime") == os.path.getmtime(self.input_file_path)
+            and cached.get("word_limit") == word_limit
+        )
+
         # Process the file based on its extension
-        if file_extension == ".pdf":
+        if if_cached:
+            text = cached["content"]
+        elif file_extension == ".pdf":
             text = self._scrape_pdf(word_limit)
         elif file_extension in [".doc", ".docx"]:
             text = self._scrape_docx(word_limit)
@@ -79,6 +95,7 @@ class TextExtractor(Component):
             if output_file_path is None:
                 output_file_path = os.path.splitext(self.input_file_path)[0] + ".txt"
 
+        if if_save and not if_cached:
             with open(output_file_path, "w", encoding="utf-8") as txt_file:
                 txt_file.write(text)
                 print(f"written at: {output_file_path}")
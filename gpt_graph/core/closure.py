@@ -9,7 +9,8 @@ from gpt_graph.core.step_graph import StepGraph
 from gpt_graph.utils.uuid_ex import uuid_ex
 import re
 from gpt_graph.utils.load_env import load_env
-import importlib
+from gpt_graph.utils.config_registry import ConfigRegistry, thaw
+from gpt_graph.utils.retention import WeakList
 
 
 class Closure:
@@ -70,6 +71,10 @@ class Closure:
         self.config = {}
         self.if_load_env = if_load_env
         self.placeholders = {}
+        # bumped when the contains tree of self or a name in it changes (register/rename),
+        # so that the cached param index (see _get_param_index) can tell it is stale
+        self.structure_version = 0
+        self.param_index = None  # (structure_version, index), see _get_param_index
 
         if self.if_load_env:
             load_env()
@@ -109,6 +114,17 @@ class Closure:
         )
         self.contains.append(cp_or_pp)
         self.refresh_full_name(if_recursive=True)
+        self.bump_structure_version()
+
+    def bump_structure_version(self):
+        """
+        Invalidate the param indexes of self and of its ancestors (the ones that index self),
+        e.g. after a register or rename. The other trees keep theirs.
+        """
+        closure = self
+        while closure is not None:
+            closure.structure_version = getattr(closure, "structure_version", 0) + 1
+            closure = getattr(closure, "contained", None)
 
     def if_register(self, cp):
         result = id(cp) in [id(c) for c in self.contains]
@@ -185,7 +201,7 @@ class Closure:
 
             for edge_type in edge_types:
                 if hasattr(obj, edge_type):
-                    if isinstance(getattr(obj, edge_type), list):
+                    if isinstance(getattr(obj, edge_type), (list, WeakList)):
                         items = getattr(obj, edge_type)
                     elif isinstance(getattr(obj, edge_type), dict):
                         items = getattr(obj, edge_type).values()
@@ -307,6 +323,10 @@ class Closure:
             parsed = tomlkit.parse(toml_string)
             result = []
 
+            def unwrap(value):
+                # tomlkit returns bool (and None) as plain python values, without unwrap
+                return value.unwrap() if hasattr(value, "unwrap") else value
+
             def process_item(item, current_path):
                 if isinstance(item, tomlkit.items.Table):
                     for key, value in item.items():
@@ -317,12 +337,12 @@ class Closure:
                         if value == "<NONE>":
                             processed_inline[key] = None
                         else:
-                            processed_inline[key] = value
+                            processed_inline[key] = unwrap(value)
                     result.append(
                         (current_path[:-1], {current_path[-1]: processed_inline})
                     )
                 else:
-                    value = item
+                    value = unwrap(item)
                     if value == "<NONE>":
                         value = None
                     result.append((current_path[:-1], {current_path[-1]: value}))
@@ -343,22 +363,9 @@ class Closure:
 
             return final_result
 
-        def get_all_config_names(obj):
-            """
-            in config file, both using class name or base name can have effect on the obj
-            """
-            config_names = set()
-            if hasattr(obj, "base_name"):
-                config_names.add(obj.base_name)
-            if hasattr(obj, "__class__"):
-                config_names.add(obj.__class__.__name__)
-            if hasattr(obj, "contains"):
-                for contained_obj in obj.contains:
-                    config_names.update(get_all_config_names(contained_obj))
-            return config_names
-
         if config_names is None and params_file is None and placeholders_file is None:
-            config_names = list(get_all_config_names(self))
+            # in config file, both using class name or base name can have effect on the obj
+            config_names = list(self._get_param_index())
 
         if isinstance(config_names, list):
             results = []
@@ -380,9 +387,10 @@ class Closure:
             raise
 
         if params_file is None and placeholders_file is None:
-            config_path = os.path.join(gpt_graph_folder, r".\config\config.toml")
-            with open(config_path, "rb") as f:
-                config = dict(tomlkit.load(f))
+            config_path = ConfigRegistry.resolve_path(
+                r".\config\config.toml", base_folder=gpt_graph_folder
+            )
+            config = ConfigRegistry.load_toml(config_path)
 
             # config.toml have format:
             # [path]
@@ -440,6 +448,7 @@ class Closure:
 
             For Python files, it imports the file as a module and extracts its variables.
             For TOML files, it loads the content and processes it as a dictionary.
+            Both are parsed once and cached in ConfigRegistry (invalidated on mtime change).
 
             Parameters:
             file (str): The path to the file to be processed. If not an absolute path,
@@ -450,29 +459,34 @@ class Closure:
                 - A tuple of strings representing the path in the structure
                 - A dictionary of parameters or values
             """
-            if not os.path.isabs(file):
-                file = os.path.join(gpt_graph_folder, file)
+            file = ConfigRegistry.resolve_path(file, base_folder=gpt_graph_folder)
 
             if file.endswith(".py"):
-                module_name = os.path.splitext(os.path.basename(file))[0]
-                spec = importlib.util.spec_from_file_location(module_name, file)
-                module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
+                module_vars = ConfigRegistry.load_module_vars(file)
 
                 cp_name_tuple = (self.__class__.__name__,)
-                params = {
-                    name: value
-                    for name, value in module.__dict__.items()
-                    if not name.startswith("_")
-                }
-                if not is_params:
-                    params = {f"[{k}]": v for k, v in params.items()}
+                if is_params:
+                    params = {k: thaw(v) for k, v in module_vars.items()}
+                else:
+                    params = {f"[{k}]": thaw(v) for k, v in module_vars.items()}
                 return [(cp_name_tuple, params, is_params)]
 
             else:
-                with open(file, "rb") as f:
-                    toml_data = f.read()
-                return custom_toml_parse(toml_data, is_params=is_params)
+
+                def parse_toml_file(path):
+                    with open(path, "rb") as f:
+                        toml_data = f.read()
+                    return custom_toml_parse(toml_data, is_params=is_params)
+
+                parsed = ConfigRegistry.get(
+                    file,
+                    parse_toml_file,
+                    parser_name="params" if is_params else "placeholders",
+                )
+                return [
+                    (tuple(prefix), thaw(params), is_param)
+                    for prefix, params, is_param in parsed
+                ]
 
         for file, is_params in files_to_process:
             results.extend(process_file(file, is_params))
@@ -574,111 +588,166 @@ class Closure:
         - Can update at multiple levels for partial path matches
         """
 
-        def recursive_set_params(
-            cp, cp_name_tuple, params, depth_priority, base_priority
+        for cp, depth_priority in self._get_param_targets(cp_name_tuple):
+            self._set_cp_params(
+                cp=cp,
+                params=params,
+                final_priority=base_priority + depth_priority,
+                base_priority=base_priority,
+                if_verbose=if_verbose,
+            )
+
+    def _get_param_index(self):
+        """
+        Index of all cps contained (recursively) in self, self included, used in _set_params_with_tuple.
+
+        Returns:
+            dict: name -> list of (cp, path), name being cp.base_name or its class name,
+                path being the tuple of cps from self to cp (both inclusive).
+
+        Note:
+        - The index is cached in self.param_index, and rebuilt after a register/rename in the
+        tree of self (self.structure_version changes, see bump_structure_version), so the keys
+        of a params file resolve to their cps directly, rather than walking the whole tree
+        for every key.
+        """
+        if (
+            self.param_index is not None
+            and self.param_index[0] == self.structure_version
         ):
-            is_match = False
-            if cp_name_tuple:
-                target_name = cp_name_tuple[0]
-                if "." in target_name:
-                    base_name, lid = target_name.split(".", 1)
-                    is_match = (
-                        cp.__class__.__name__ == base_name
-                        or getattr(cp, "base_name", "") == base_name
-                    ) and str(getattr(cp, "lid", "")) == lid
-                else:
-                    is_match = (
-                        cp.__class__.__name__ == target_name
-                        or getattr(cp, "base_name", "") == target_name
-                    )
+            return self.param_index[1]
 
-            # Always multiply by 2 when going down a level
-            depth_priority *= 2
+        index = {}
 
-            if is_match:
-                # Add 1 to depth_priority only if there's a match
-                depth_priority += 1
-                next_tuple = cp_name_tuple[1:]
-            else:
-                next_tuple = cp_name_tuple
-
-            # Check if we should update parameters
-            if not next_tuple:
-                final_priority = base_priority + depth_priority
-                for param_name, param_value in params.items():
-                    # Special case for updating input schema
-                    if param_name == "<UPDATE_INPUT_SCHEMA>":
-                        if hasattr(cp, "update_input_schema"):
-                            cp.update_input_schema(param_value)
-                        if if_verbose:
-                            print(f"Updating input schema for {cp.full_name}")
-                        continue
-                    elif param_name == "<UPDATE_STEP_TYPE>":
-                        cp.step_type = param_value
-                        if if_verbose:
-                            print(f"Updating step type for {cp.full_name}")
-                        continue
-
-                    elif hasattr(cp, "params") and param_name in cp.params:
-                        param = cp.params[param_name]
-                        # Update parameter if new priority is higher
-                        if final_priority >= param.get("priority", 0):
-                            if if_verbose:
-                                print(
-                                    f"Setting {cp.full_name}:{param_name} = {param_value}"
-                                )
-                                print(
-                                    f"Reset priority from {param.get('priority', 0)} -> {final_priority}"
-                                )
-
-                            # Handle placeholder parameters
-                            if isinstance(param_value, str) and re.match(
-                                r"^\[.*\]$", param_value
-                            ):
-                                param["placeholder"] = param_value
-                            else:
-                                if (
-                                    param_value == "<CACHE>"
-                                    and param_name in cp.cache_schema
-                                ):
-                                    param["status"] = "cache"
-
-                                if (
-                                    param["value"] == "<CACHE>"
-                                    and param_value != "<CACHE>"
-                                ):
-                                    param["status"] = "assigned"
-
-                                param["value"] = param_value
-
-                            # Resolve placeholders
-                            if (
-                                param["placeholder"] is not None
-                                and param["placeholder"] in self.placeholders
-                            ):
-                                param["value"] = self.placeholders[param["placeholder"]]
-                                param["priority"] = 1000
-
-                            param["priority"] = final_priority
-                            param["status"] = "load" if base_priority == 0 else "manual"
-                        elif if_verbose:
-                            print(
-                                f"Params unchanged due to priority {final_priority} is lower than ori {param.get('priority', 0)}"
-                            )
-
-            # Recursive call for all contained components
+        def add_cp(cp, path):
+            path = path + (cp,)
+            names = {cp.__class__.__name__, getattr(cp, "base_name", None)}
+            for name in names:
+                if name is not None:
+                    index.setdefault(name, []).append((cp, path))
             for c in getattr(cp, "contains", []):
-                recursive_set_params(
-                    c, next_tuple, params, depth_priority, base_priority
-                )
+                add_cp(c, path)
+
+        add_cp(self, ())
+        self.param_index = (self.structure_version, index)
+        return index
+
+    @staticmethod
+    def _if_match_cp_name(cp, target_name):
+        """target_name is a class name or base name, optionally with lid: {name}.{lid}"""
+        if "." in target_name:
+            base_name, lid = target_name.split(".", 1)
+            return (
+                cp.__class__.__name__ == base_name
+                or getattr(cp, "base_name", "") == base_name
+            ) and str(getattr(cp, "lid", "")) == lid
+        else:
+            return (
+                cp.__class__.__name__ == target_name
+                or getattr(cp, "base_name", "") == target_name
+            )
 
-        recursive_set_params(
-            cp=self,
-            cp_name_tuple=cp_name_tuple,
-            params=params,
-            depth_priority=0,
-            base_priority=base_priority,
-        )
+    def _get_param_targets(self, cp_name_tuple):
+        """
+        Yield (cp, depth_priority) for every cp that cp_name_tuple sets params to.
+
+        The names in cp_name_tuple are matched greedily along the path from self to each cp.
+        depth_priority is doubled at each level and increased by 1 on each match,
+        so that deeper and more specific paths have higher priority.
+        Once the whole tuple is matched at a cp, that cp and all its sub cps are targets.
+        """
+
+        def iter_subtree(cp, depth_priority):
+            yield cp, depth_priority
+            for c in getattr(cp, "contains", []):
+                yield from iter_subtree(c, depth_priority * 2)
+
+        if not cp_name_tuple:
+            yield from iter_subtree(self, 0)
+            return
+
+        last_name = cp_name_tuple[-1]
+        candidates = self._get_param_index().get(last_name.split(".", 1)[0], [])
+        for cp, path in candidates:
+            if not self._if_match_cp_name(cp, last_name):
+                continue
+
+            # the tuple must be fully matched exactly at cp, otherwise cp is in the subtree
+            # of an ancestor that fully matches it, and is yielded there
+            i = 0
+            depth_priority = 0
+            matched_cp = None
+            for c in path:
+                depth_priority *= 2
+                if self._if_match_cp_name(c, cp_name_tuple[i]):
+                    depth_priority += 1
+                    i += 1
+                    if i == len(cp_name_tuple):
+                        matched_cp = c
+                        break
+
+            if matched_cp is cp:
+                yield from iter_subtree(cp, depth_priority)
+
+    def _set_cp_params(
+        self, cp, params, final_priority, base_priority=1000, if_verbose=True
+    ):
+        """
+        Set params of a single cp if final_priority is not lower than the current priority.
+        used in _set_params_with_tuple
+        """
+        for param_name, param_value in params.items():
+            # Special case for updating input schema
+            if param_name == "<UPDATE_INPUT_SCHEMA>":
+                if hasattr(cp, "update_input_schema"):
+                    cp.update_input_schema(param_value)
+                if if_verbose:
+                    print(f"Updating input schema for {cp.full_name}")
+                continue
+            elif param_name == "<UPDATE_STEP_TYPE>":
+                cp.step_type = param_value
+                if if_verbose:
+                    print(f"Updating step type for {cp.full_name}")
+                continue
+
+            elif hasattr(cp, "params") and param_name in cp.params:
+                param = cp.params[param_name]
+                # Update parameter if new priority is higher
+                if final_priority >= param.get("priority", 0):
+                    if if_verbose:
+                        print(f"Setting {cp.full_name}:{param_name} = {param_value}")
+                        print(
+                            f"Reset priority from {param.get('priority', 0)} -> {final_priority}"
+                        )
+
+                    # Handle placeholder parameters
+                    if isinstance(param_value, str) and re.match(
+                        r"^\[.*\]$", param_value
+                    ):
+                        param["placeholder"] = param_value
+                    else:
+                        if param_value == "<CACHE>" and param_name in cp.cache_schema:
+                            param["status"] = "cache"
+
+                        if param["value"] == "<CACHE>" and param_value != "<CACHE>":
+                            param["status"] = "assigned"
+
+                        param["value"] = param_value
+
+                    # Resolve placeholders
+                    if (
+                        param["placeholder"] is not None
+                        and param["placeholder"] in self.placeholders
+                    ):
+                        param["value"] = self.placeholders[param["placeholder"]]
+                        param["priority"] = 1000
+
+                    param["priority"] = final_priority
+                    param["status"] = "load" if base_priority == 0 else "manual"
+                elif if_verbose:
+                    print(
+                        f"Params unchanged due to priority {final_priority} is lower than ori {param.get('priority', 0)}"
+                    )
 
     def params_to_toml(self, params=None, output_file_path=None, return_string=False):
         if params is None and hasattr(self, "get_all_params"):
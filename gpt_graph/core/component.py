@@ -9,6 +9,7 @@ import re
 from gpt_graph.utils.mql import mql
 from gpt_graph.utils.uuid_ex import uuid_ex
 from gpt_graph.core.group import Group
+from gpt_graph.utils.retention import WeakList, trim_to_last
 import time
 
 
@@ -20,6 +21,11 @@ class Component(Closure):
     output_format = "plain"
     bindings = None
 
+    # retention policies for long-lived cps (None means unbounded)
+    # e.g. p.set_attr({"max_steps": 10, "max_step_clones": 1}) in a worker reusing p
+    max_steps = None  # steps kept in self.steps
+    max_step_clones = None  # per-call clones kept in Step.contains of each step
+
     def __init__(
         self,
         func=None,
@@ -91,10 +97,11 @@ class Component(Closure):
 
         # self.contains_lvl = contains_lvl
         self.clones_lvl = clones_lvl
-        self.clones = []  # prototype cps
+        self.clones = WeakList()  # prototype cps, weak so that per-call clones can be released
 
         self.global_config = {}
         self.steps = []  # {}
+        self.steps_created = 0  # step lid counter, self.steps may be trimmed by max_steps
 
         self.config_keys = [
             "step_type",
@@ -281,6 +288,8 @@ class Component(Closure):
                 "all_cps",  # NOTE:this var is created by calling functions, actually, can copy it with link later
                 # "node_graph",  # related to node
                 "steps",
+                "steps_created",
+                "param_index",  # rebuilt lazily by the clone
                 # "step_graph",  # related to step
                 # "groups"
                 # contains
@@ -512,6 +521,7 @@ class Component(Closure):
         self.lid = new_lid if new_lid is not None else self.lid
 
         self.refresh_full_name(namespace=new_namespace, if_recursive=True)
+        self.bump_structure_version()  # invalidate the cached param indexes
 
         if new_base_name and if_recursive:
             for cp in self.clones:
@@ -660,6 +670,21 @@ class Component(Closure):
             )
             return result
 
+    def reset_run_state(self):
+        """
+        Used in Pipeline._initialize_sub_steps, before each run (also of an ExecutionPlan).
+
+        Clears the state left by the previous run: binding_step_names of the $if_complete
+        bindings and the grouped nodes of the groups of the input schema (e.g. prepend(Group())
+        or the linking group), so that they are grouped again from the nodes of the new run.
+        """
+        self.binding_step_names = {}
+        for value in self.input_schema.values():
+            if isinstance(value, dict) and isinstance(value.get("group"), Group):
+                value["group"].initialize()
+        if self.linking_group is not None:
+            self.linking_group.initialize()
+
     def update_input_schema(self, input_schema):
         """
         Updates the object's input schema with new or modified entries.
@@ -736,7 +761,7 @@ class Component(Closure):
         Behavior:
         - Combines object attributes and provided params to configure the step
         - Creates a new Step instance with combined configuration
-        - Appends the new Step to self.steps
+        - Appends the new Step to self.steps, dropping the oldest ones beyond self.max_steps
 
         Returns:
         Step: The newly created and appended Step instance
@@ -763,7 +788,7 @@ class Component(Closure):
             cp_or_pp=self,
             category=self.category,
             gid=gid,  # TODO: Step.gid can be removed later. seems useless
-            lid=len(self.steps),
+            lid=self.steps_created,
             node_graph=self.node_graph,
             params=cp_params,
             if_dynamic=self.if_dynamic,
@@ -773,7 +798,9 @@ class Component(Closure):
         if if_ult_input:
             step.set_input_params_ult()
 
+        self.steps_created += 1
         self.steps.append(step)
+        trim_to_last(self.steps, self.max_steps)
         return step
 
     @staticmethod
@@ -0,0 +1,65 @@
+from gpt_graph.utils.config_registry import FrozenDict
+
+"""
+used in Pipeline.compile / Pipeline.run_plan
+"""
+
+
+class ExecutionPlan:
+    """
+    Immutable result of Pipeline.compile.
+
+    Attributes:
+        pipeline: the compiled Pipeline.
+        steps (tuple): statically discovered steps, in execution (topological) order.
+        step_params (tuple): pre-resolved params of each step, same order as steps.
+        dynamic_steps (tuple): (priority, step) left in the step q when the compilation stopped
+            at a method step (e.g. a router using route_to). Empty if the whole pipeline is static.
+        step_graph (networkx.DiGraph): step DAG of the static steps.
+        sub_steps (FrozenDict): step full_name -> step of the static steps.
+
+    Usage:
+        plan = p.compile(params={"f4:y": 2})
+        result = plan.run(input_data=10)  # same kwargs as p.run
+    """
+
+    __slots__ = (
+        "pipeline",
+        "steps",
+        "step_params",
+        "dynamic_steps",
+        "step_graph",
+        "sub_steps",
+    )
+
+    def __init__(
+        self,
+        pipeline,
+        steps,
+        step_params,
+        dynamic_steps=(),
+        step_graph=None,
+        sub_steps=None,
+    ):
+        set_attr = object.__setattr__
+        set_attr(self, "pipeline", pipeline)
+        set_attr(self, "steps", tuple(steps))
+        set_attr(self, "step_params", tuple(FrozenDict(p) for p in step_params))
+        set_attr(self, "dynamic_steps", tuple(dynamic_steps))
+        set_attr(self, "step_graph", step_graph)
+        set_attr(self, "sub_steps", FrozenDict(sub_steps or {}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ExecutionPlan is immutable, compile the pipeline again")
+
+    @property
+    def if_static(self):
+        """True if no step is discovered dynamically when running the plan"""
+        return not self.dynamic_steps
+
+    def run(self, **kwargs):
+        return self.pipeline.run_plan(self, **kwargs)
+
+    def __repr__(self):
+        steps = ", ".join(step.full_name for step in self.steps)
+        return f"<{self.__class__.__name__}(steps=[{steps}], if_static={self.if_static})>"
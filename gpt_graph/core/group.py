@@ -1,6 +1,7 @@
 from gpt_graph.utils.uuid_ex import uuid_ex
 import copy
 from gpt_graph.utils.get_nested_value import get_nested_value
+from gpt_graph.utils.retention import WeakList
 
 
 class Group:
@@ -28,7 +29,7 @@ class Group:
         self.type = type
         self.gid = gid
         self.contains = {}
-        self.clones = []
+        self.clones = WeakList()
         self.prototype = None
 
         self.if_refresh = None
@@ -41,6 +42,7 @@ class Group:
         """
         self.nodes = None
         self.contains = {}
+        self._sub_group_index = None
 
     def clone(self, if_copy_nodes=False):
         """
@@ -70,12 +70,8 @@ class Pipeline(Component):
         # self.prepend_actions = []  # vs pending actiobs
 
         self.lid_counters = {}  # Add this line
-        self.method_steps = []
-
-        for attr_name in dir(self):
-            attr = getattr(self, attr_name)
-            if callable(attr) and hasattr(attr, "if_step"):
-                self.method_steps.append(attr)
+        # method steps (@component over a method) are instantiated in __init__ of the
+        # subclass, e.g. self.router = self.router(), no scan of dir(self) is needed
 
         if if_input_initialize:
             cp = InputInitializer()
@@ -215,74 +211,207 @@ class Pipeline(Component):
         """
         print(f"running: {self.name}")
 
+        self._prepare_params(params=params, params_file=params_file)
+
+        # initialize steps
+        self._initialize_sub_steps()
+
+        # Execute each step in the steps q
+        self.curr_step_id = 0
+        self._run_sub_steps_q(kwargs)
+
+        return self._get_output()
+
+    def compile(self, params={}, params_file=None):
+        """
+        Discover the static step sequence once and return it as an ExecutionPlan.
+
+        Args:
+            params (dict): Parameters to set for the component, same as in self.run.
+            params_file (str): Path to a file containing parameters, same as in self.run.
+
+        Process:
+        1. Loads and sets parameters (only once, at compile time).
+        2. Simulates the step q of self.run without running any step:
+        bindings and linkings only depend on cps/steps names, not on nodes.
+        3. Stops at the first method step (e.g. a router calling self.route_to),
+        as the steps after it can only be discovered while running.
+
+        Returns:
+            ExecutionPlan: call plan.run(**kwargs) (same kwargs as self.run) repeatedly.
+
+        Note:
+        - params changed after compile are not seen by the plan, compile again.
+        """
+        from gpt_graph.core.execution_plan import ExecutionPlan
+
+        print(f"compiling: {self.name}")
+
+        self._prepare_params(params=params, params_file=params_file)
+        self._initialize_sub_steps()
+
+        steps = []
+        while self.sub_steps_q:
+            priority, step = self.sub_steps_q.pop()
+            if step.category == "method":
+                # dynamic escape hatch: from here on, steps are discovered in self.run_plan
+                self.sub_steps_q.push(priority, step)
+                break
+
+            steps.append(step)
+            self.sub_steps_history.append(step)
+            self._schedule_next_steps(previous_step=step)
+
+        plan = ExecutionPlan(
+            pipeline=self,
+            steps=steps,
+            step_params=[self._get_step_params(step) for step in steps],
+            dynamic_steps=self.sub_steps_q.items(),
+            step_graph=self.sub_step_graph.graph.copy(),
+            sub_steps=self.sub_steps,
+        )
+        self._initialize_sub_steps(if_create_root_steps=False)
+        return plan
+
+    def run_plan(self, plan, **kwargs):
+        """
+        Run an ExecutionPlan created by self.compile. Usually called by plan.run.
+
+        The compiled steps are run in order with their pre-resolved params, no bindings/linkings
+        are evaluated for them. If the plan stops at a method step, the remaining steps
+        are discovered dynamically as in self.run.
+        The per-run state of the cps (groups, $if_complete bindings) is reset first,
+        see Component.reset_run_state, so the plan can be run repeatedly.
+
+        Returns:
+            list: Output content from the final step.
+        """
+        print(f"running plan: {self.name}")
+
+        self._initialize_sub_steps(if_create_root_steps=False)
+        self.sub_steps.update(plan.sub_steps)
+        self.sub_step_graph.graph = plan.step_graph.copy()
+
+        self.curr_step_id = 0
+        for step, step_params in zip(plan.steps, plan.step_params):
+            self._run_sub_step(step, kwargs, step_params=step_params)
+
+        for priority, step in plan.dynamic_steps:
+            self.sub_steps_q.push(priority, step)
+        self._run_sub_steps_q(kwargs)
+
+        return self._get_output()
+
+    def reset(self, if_recursive=True):
+        """
+        Release the per-run state, e.g. between runs of a long-lived pipeline reused by a worker.
+
+        Args:
+            if_recursive (bool): Whether to reset contained pipelines as well. Default is True.
+
+        Releases the sub steps (q, history, step/node graphs), the steps of the contained cps
+        and the per-call clones (Step.contains) together with their nodes.
+        Keeps the structure, params and cache (<SELF> clones), so self.run can be called again.
+        An ExecutionPlan created by self.compile is still valid after reset.
+        """
+        self._initialize_sub_steps(if_create_root_steps=False)
+        self.curr_step_id = 0
+
+        for cp in self.contains:
+            if if_recursive and isinstance(cp, Pipeline):
+                cp.reset(if_recursive=True)
+
+            for step in cp.steps:
+                step.contains.clear()
+                step.output = None
+                step.nodes = None
+            cp.steps.clear()
+
+    def _prepare_params(self, params={}, params_file=None):
+        """used in self.run and self.compile"""
         self.load_params(params_file=params_file)  # using Closure method
-        params["self"] = self
+        params = {**params, "self": self}  # do not keep self alive in the default params={}
         self.set_params(params)
 
         for cp in self.contains:
             if not cp.params_check():
                 raise
 
-        # initialize steps
+    def _initialize_sub_steps(self, if_create_root_steps=True):
+        """reset step-related structures (queues, graphs, history) and create root steps"""
         self.sub_steps = {}  # all created steps
         self.sub_steps_q.initialize()
         self.sub_steps_history = []
         self.sub_node_graph.initialize()
         self.sub_step_graph.initialize()
         # self.sub_cp_graph.initialize()
+        for cp in self.contains:
+            cp.reset_run_state()
+
+        if if_create_root_steps:
+            # cp_roots are just InputInitializer set in __init__
+            for cp in self.cp_roots:
+                self.create_sub_step(
+                    cp=cp,
+                    if_ult_input=True,
+                    priority=0,
+                    parent_step_names=[],
+                )
 
-        # cp_roots are just InputInitializer set in __init__
-        for cp in self.cp_roots:
-            self.create_sub_step(
-                cp=cp,
-                if_ult_input=True,
-                priority=0,
-                parent_step_names=[],
-            )
+    @staticmethod
+    def _get_step_params(step):
+        return {
+            k: v["value"] for k, v in step.params.items() if v["status"] != "input"
+        }  # status is ult_input is allowed
 
-        # Execute each step in the steps q
-        self.curr_step_id = 0
+    def _run_sub_steps_q(self, kwargs):
+        """pop and run steps until the q is empty, adding the steps triggered by each of them"""
         while self.sub_steps_q:
             _, step = self.sub_steps_q.pop()
+            self._run_sub_step(step, kwargs)
+            self._schedule_next_steps(previous_step=step)
 
-            # update step graph for step_id
-            self.sub_step_graph.nodes[step.full_name]["step_id"] = self.curr_step_id
+    def _run_sub_step(self, step, kwargs, step_params=None):
+        """run a single step and record it in the history"""
+        # update step graph for step_id
+        self.sub_step_graph.nodes[step.full_name]["step_id"] = self.curr_step_id
 
-            step_params = {
-                k: v["value"] for k, v in step.params.items() if v["status"] != "input"
-            }  # status is ult_input is allowed
+        if step_params is None:
+            step_params = self._get_step_params(step)
 
-            if not self.sub_steps_history:  # Check if it's the first step
-                step_params.update(kwargs)
-                step.run(step_id=self.curr_step_id, params=step_params)
-            else:
-                prev_steps = []
-                step.run(
-                    parent_steps=prev_steps,
-                    step_id=self.curr_step_id,
-                    params=step_params,
-                )
+        if not self.sub_steps_history:  # Check if it's the first step
+            step_params = {**step_params, **kwargs}
+            step.run(step_id=self.curr_step_id, params=step_params)
+        else:
+            prev_steps = []
+            step.run(
+                parent_steps=prev_steps,
+                step_id=self.curr_step_id,
+                params=step_params,
+            )
 
-            self.curr_step_id += 1
-            self.sub_steps_history.append(step)
+        self.curr_step_id += 1
+        self.sub_steps_history.append(step)
 
-            # Check for new steps created by linkings
-            previous_step = self.sub_steps_history[-1]
-            prev_cp = previous_step.cp_or_pp
-            for cp in self.contains:
-                if prev_cp.if_trigger_linkings(next_cp=cp):
-                    self.route_to(step_name=cp.full_name)
-
-            # Check for new steps created by bindings
-            for component in self.contains:
-                if component.if_trigger_bindings(previous_step=previous_step):
-                    new_step = self.create_sub_step(
-                        cp=component,
-                        params={},
-                        priority=0,
-                        parent_step_names=[previous_step.full_name],
-                    )
+    def _schedule_next_steps(self, previous_step):
+        """create the steps triggered by previous_step through linkings and bindings"""
+        # Check for new steps created by linkings
+        prev_cp = previous_step.cp_or_pp
+        for cp in self.contains:
+            if prev_cp.if_trigger_linkings(next_cp=cp):
+                self.route_to(step_name=cp.full_name)
+
+        # Check for new steps created by bindings
+        for component in self.contains:
+            if component.if_trigger_bindings(previous_step=previous_step):
+                self.create_sub_step(
+                    cp=component,
+                    params={},
+                    priority=0,
+                    parent_step_names=[previous_step.full_name],
+                )
 
+    def _get_output(self):
         last_step = self.sub_steps_history[-1]
         result = [n["content"] for n in last_step.nodes if n["if_output"]]
         return result
@@ -305,9 +434,11 @@ class Pipeline(Component):
             "contained",  # if contained's id is recorded in memo, then use it, otherwise dont copy
             "all_cps",
             "steps",
+            "steps_created",
             "sub_steps",
             "sub_steps_q",
             "sub_steps_history",
+            "param_index",
         ]  # uuid will be generated randomly during initialization
         shallow_copy_keys = [
             # "bindings",  # should be deep copied with link
@@ -372,6 +503,7 @@ class Pipeline(Component):
         cp_or_pp.step_graph = self.sub_step_graph
         self.contains.append(cp_or_pp)
         self.refresh_full_name(if_recursive=True)
+        self.bump_structure_version()  # invalidate the cached param indexes
 
     def connect(
         self,
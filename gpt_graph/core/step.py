@@ -3,6 +3,7 @@ import logging
 from gpt_graph.utils.validation import validate_type
 from typing import List, Callable, Type, Any, Dict
 from gpt_graph.utils.uuid_ex import uuid_ex
+from gpt_graph.utils.retention import trim_to_last
 import re
 import gpt_graph.utils as utils
 from itertools import product
@@ -124,6 +125,7 @@ class Step:
                 else:
                     clone = cp_or_pp.clone()
                 self.contains.append(clone)
+                trim_to_last(self.contains, cp_or_pp.max_step_clones)
                 result = clone.run(**kwargs)
                 if "<SELF>" in self.cache_schema:
                     cache_key = self.get_cache_key(key="<SELF>")
@@ -167,6 +169,7 @@ class Step:
         self.route_to = None
 
         self.groups = {}
+        self.partial_nodes = []  # updated in place while a cp streams its output
         self.status = "idle"  # or 'running', 'finished', 'idle', 'queued'
         self.output = None
         self.nodes = None
@@ -221,6 +224,7 @@ class Step:
         """
         print(f"\nStep: {self.full_name}")
         self.step_id = step_id
+        self.partial_nodes = []
         self.parent_steps = parent_steps or []
 
         """
@@ -657,6 +661,10 @@ class Step:
             ) in params_with_parent_list:  # zip(params_list, parent_nodes_list):
                 func_args = raw_params.copy()
                 func_args.update(input_func_args)
+                if callable(func_args.get("stream_callback")):
+                    func_args["stream_callback"] = self._wrap_stream_callback(
+                        func_args["stream_callback"], parent_nodes
+                    )
 
                 func_results = self.cp_run_func(**func_args)
                 if step_type in ("node_to_node", "list_to_node"):
@@ -772,6 +780,8 @@ class Step:
                 else:
                     new_nodes.append(result)
 
+            for partial_node in self.partial_nodes:
+                partial_node["if_final"] = True
             self.nodes = new_nodes
 
             return new_nodes
@@ -785,6 +795,37 @@ class Step:
         #             self.node_graph.remove_node(node_id)
         #     self._handle_errors(e)
 
+    def _wrap_stream_callback(self, stream_callback, parent_nodes):
+        """
+        Used in self.run when the param stream_callback of the cp is set
+        (e.g. set_params({"llm:stream_callback": func}), see LLMModel.run).
+
+        The cp calls stream_callback(delta, partial) for every delta of its output. The wrapper
+        calls stream_callback(delta, partial_node) instead, where partial_node is a node-like
+        dict (content, parent_nodes, step_name, cp_name, if_final) updated in place and kept in
+        self.partial_nodes, so that consumers can already work on the prefix of the content.
+        if_final becomes True once the real nodes are created.
+        The content is the one of the current attempt: it restarts when the cp retries the
+        request (e.g. LLMModel after a transport error or an unparsable output).
+        """
+        partial_node = {
+            "content": "",
+            "parent_nodes": parent_nodes,
+            "step_name": self.full_name,
+            "cp_name": self.cp_name,
+            "if_final": False,
+        }
+        self.partial_nodes.append(partial_node)
+
+        def func(delta, partial=None):
+            if partial is not None:
+                partial_node["content"] = partial["content"]  # the text of this attempt
+            else:
+                partial_node["content"] += delta
+            return stream_callback(delta, partial_node)
+
+        return func
+
     def get_cache_key(self, key):
         """
         Generate a cache key for the given parameter key.
@@ -1,3 +1,4 @@
+import os
 from gpt_graph.components.combiners.text_combiner import TextCombiner
 from gpt_graph.core.pipeline import Pipeline
 from gpt_graph.components.dir_file_lister import DirFileLister
@@ -15,17 +16,25 @@ from gpt_graph.components.saver import Saver
 
 
 class RAG(Pipeline):
-    def __init__(self, **kwargs):
+    def __init__(self, index_folder=None, **kwargs):
+        """
+        Args:
+            index_folder (str): folder of the persisted retriever index, reopened by the next
+                RAGs so that only the added or modified files are extracted and embedded.
+                Default None.
+        """
         super().__init__(**kwargs)
         self.dir_file_lister = DirFileLister()
-        self.text_extractor = TextExtractor()
+        # node_like: the nodes keep their file (extra["input_file_path"]), the source of
+        # the rows of the retriever index, so that the edited or deleted files are updated
+        self.text_extractor = TextExtractor(output_format="node_like")
         self.prompt_formatter = PromptFormatter()
         self.llm = LLMModel()
         # self.text_to_bool_parser = TextToBoolParser()
         self.filter = Filter()
         # self.node_to_str = NodeToStr()
         # self.file_copier = FileCopier()
-        self.retriever = Retriever()
+        self.retriever = Retriever(index_folder=index_folder)
         self.summarizer = Summarizer()
         self.text_combiner = TextCombiner()
         self.saver = Saver()
@@ -121,6 +130,9 @@ class RAG(Pipeline):
             "prompt_formatter.0:prompt": prompt2,
             "prompt_formatter.1:prompt": prompt3,
         }
+        if self.retriever.index_folder is not None:
+            # the files not modified since they were indexed are neither extracted nor embedded
+            params_update["text_extractor:cached_texts"] = self.retriever.get_indexed_texts()
         params.update(params_update)
         super().run(input_data=folder_path, params=params, **kwargs)
 
@@ -17,3 +17,14 @@ Output Python list of dicts. Enclose in [], comma-separated, quote strings using
 boolean_format_prompt ="""
 Output as single boolean value either True or False, python style. DO NOT INCLUDE ANY OTHER TEXT OR INSTRUCTION
 """
+
+packed_items_prompt = """
+Answer each of the {n} items below independently, as if it was asked alone. {answer_format}
+Return the answers of all the items using the tool, each with the index of its item.
+"""
+
+packed_answer_formats = {
+    "string": "Each answer is a text.",
+    "boolean": "Each answer is a boolean value, true or false.",
+    "list": "Each answer is a list of strings.",
+}
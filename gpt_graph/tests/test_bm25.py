@@ -0,0 +1,58 @@
+import math
+import numpy as np
+import pytest
+from gpt_graph.utils.bm25 import BM25Index
+from gpt_graph.utils.vector_index import ExactIndex
+
+
+def test_1_incremental_bm25_scores():
+    texts = ["the cat sat on the mat", "a dog and a cat", "dogs bark", "The CAT, the cat!"]
+    index = BM25Index(k1=1.2, b=0.75)
+    index.add(texts[:2])
+    index.add(texts[2:])  # same as adding them at once
+    once = BM25Index(k1=1.2, b=0.75)
+    once.add(texts)
+    assert np.allclose(index.scores("cat dog"), once.scores("cat dog"))
+
+    # reference formula for "dog" in row 1
+    avg_length = (6 + 5 + 2 + 4) / 4
+    idf = math.log(1 + (4 - 1 + 0.5) / (1 + 0.5))
+    expected = idf * 1 * 2.2 / (1 + 1.2 * (1 - 0.75 + 0.75 * 5 / avg_length))
+    assert index.scores("dog")[1] == pytest.approx(expected, rel=1e-5)
+
+    rows, scores = index.search("cat", top_k=2)
+    assert list(rows) == [3, 1] and scores[0] > scores[1]  # 2 occurrences, shortest
+    assert list(index.search("cat")[0]) == [3, 1, 0]  # only the matching rows
+    assert len(index.search("unknown words")[0]) == 0
+
+
+def test_2_dense_search_of_candidate_rows():
+    rng = np.random.default_rng(0)
+    index = ExactIndex()
+    index.add(rng.normal(size=(100, 8)))
+    query = rng.normal(size=8)
+    candidates = np.array([5, 17, 42, 60, 99])
+
+    rows, scores = index.search_rows(query, candidates, top_k=3)
+    all_scores = index.scores(query)
+    expected = candidates[np.argsort(-all_scores[candidates])[:3]]
+    assert list(rows) == list(expected)
+    assert np.allclose(scores, all_scores[expected], atol=1e-6)
+    assert list(index.search_rows(query, candidates, sorted=False)[0]) == list(candidates)
+
+
+def test_3_excluded_rows_are_not_candidates():
+    index = BM25Index()
+    index.add(["cat", "cat cat", "a cat", "dog"])
+    dense = ExactIndex()
+    dense.add(np.eye(4))
+    dense.delete([1, 2])
+    assert list(dense.get_deleted_rows()) == [1, 2]
+
+    rows, _ = index.search("cat", top_k=2, excluded_rows=dense.get_deleted_rows())
+    assert list(rows) == [0]
+    assert len(index.search("cat", excluded_rows=[0, 1, 2, 9])[0]) == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
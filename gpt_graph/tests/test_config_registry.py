@@ -0,0 +1,68 @@
+import os
+import time
+import pytest
+from gpt_graph.utils.config_registry import ConfigRegistry, freeze, thaw
+
+
+def test_1_toml_parsed_once_and_refreshed_on_change(tmp_path):
+    file_path = str(tmp_path / "x.toml")
+    with open(file_path, "w") as f:
+        f.write("y = 1\n[a]\nz = [1, 2]\n")
+
+    r1 = ConfigRegistry.load_toml(file_path)
+    r2 = ConfigRegistry.load_toml(file_path)
+    assert r1 is r2
+    assert r1["a"]["z"] == (1, 2)
+    with pytest.raises(TypeError):
+        r1["y"] = 2
+
+    time.sleep(0.01)
+    with open(file_path, "w") as f:
+        f.write("y = 3\n")
+    os.utime(file_path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert ConfigRegistry.load_toml(file_path)["y"] == 3
+
+
+def test_2_thaw_returns_mutable_copy():
+    frozen = freeze({"a": [1, {"b": 2}]})
+    thawed = thaw(frozen)
+    thawed["a"][1]["b"] = 3
+    assert frozen["a"][1]["b"] == 2
+    assert isinstance(thawed["a"], list)
+
+
+def test_3_windows_style_rel_path():
+    path = ConfigRegistry.resolve_path(r".\config\config.toml", base_folder="/base")
+    assert path == os.path.normpath("/base/config/config.toml")
+
+
+def test_4_params_toml_with_booleans(tmp_path):
+    from gpt_graph.core.pipeline import Pipeline
+
+    file_path = str(tmp_path / "params.toml")
+    with open(file_path, "w") as f:
+        f.write('flag = true\nname = "x"\nconfig = {"if_with_date" = false, "n" = 2}\n')
+
+    results = Pipeline().load_params(params_file=file_path)
+    params = {k: v for _, param, _ in results for k, v in param.items()}
+    assert params["flag"] is True and params["name"] == "x"
+    assert params["config"] == {"if_with_date": False, "n": 2}
+
+
+def test_5_py_params_keep_tuples_and_lists(tmp_path):
+    from gpt_graph.core.pipeline import Pipeline
+
+    file_path = str(tmp_path / "params_py.py")
+    with open(file_path, "w") as f:
+        f.write('size = (2, 3)\nnames = ["a", ("b", ["c"])]\n')
+
+    results = Pipeline().load_params(params_file=file_path)
+    params = {k: v for _, param, _ in results for k, v in param.items()}
+    assert params["size"] == (2, 3) and isinstance(params["size"], tuple)
+    assert params["names"] == ["a", ("b", ["c"])]
+    assert isinstance(params["names"], list) and isinstance(params["names"][1], tuple)
+    assert thaw(freeze({"a": (1, [2])})) == {"a": (1, [2])}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
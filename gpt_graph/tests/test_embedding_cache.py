@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from gpt_graph.utils.embedding_cache import EmbeddingCache
+
+
+def test_1_embeddings_persist_by_model_and_normalized_text(tmp_path):
+    rng = np.random.default_rng(0)
+    texts = [f"text {i}" for i in range(1500)]  # more than the initial capacity
+    embeddings = rng.normal(size=(1500, 4)).astype(np.float32)
+
+    cache = EmbeddingCache(str(tmp_path))
+    cache.set_many("org/model-a", texts[:10], embeddings[:10])
+    cache.set_many("org/model-a", texts, embeddings)
+    assert cache.get_many("org/model-b", texts[:3]) == {}
+
+    # a new process reads them back
+    cache2 = EmbeddingCache(str(tmp_path))
+    found = cache2.get_many("org/model-a", ["  text   3\n", "new text", "text 1499"])
+    assert sorted(found) == [0, 2]
+    assert np.allclose(found[0], embeddings[3])
+    assert np.allclose(found[2], embeddings[1499])
+    assert (cache2.hits, cache2.misses) == (2, 1)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
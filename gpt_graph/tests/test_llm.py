@@ -0,0 +1,240 @@
+import re
+import json
+import pytest
+
+llm = pytest.importorskip("gpt_graph.components.llm")  # litellm, instructor...
+from gpt_graph.core.pipeline import Pipeline
+from gpt_graph.utils.llm_dispatcher import CircuitBreaker, LLMDispatcher
+from gpt_graph.utils.mock_llm_server import MockLLMServer
+
+
+class Obj(dict):
+    """dict with attribute access, like the litellm responses"""
+
+    __getattr__ = dict.__getitem__
+
+
+def make_response(content=None, arguments=None):
+    tool_calls = None
+    if arguments is not None:
+        tool_calls = [Obj(function=Obj(name="tool", arguments=json.dumps(arguments)))]
+    return Obj(choices=[Obj(message=Obj(content=content, tool_calls=tool_calls))])
+
+
+class BadRequestError(Exception):
+    status_code = 400
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """LLMModel of the "mock" model with a stubbed completion, set_completion(func(**kwargs))"""
+    LLMDispatcher.clear()
+    CircuitBreaker.clear()
+    monkeypatch.setattr(llm.time, "sleep", lambda seconds: None)  # no backoff
+    calls = []
+
+    def set_completion(func):
+        def completion(**kwargs):
+            calls.append(kwargs)
+            return func(**kwargs)
+
+        monkeypatch.setattr(llm, "completion", completion)
+
+    return llm.LLMModel(model_name="mock"), calls, set_completion
+
+
+def get_prompt(kwargs):
+    return kwargs["messages"][-1]["content"]
+
+
+def test_1_only_unparsable_items_are_retried(stub):
+    model, calls, set_completion = stub
+    n_bad = []
+
+    def completion(**kwargs):
+        prompt = get_prompt(kwargs)
+        if prompt == "bad" and not n_bad:
+            n_bad.append(1)
+            return make_response(content="not json")
+        return make_response(content=json.dumps({"prompt": prompt}))
+
+    set_completion(completion)
+    outputs = model.run(["a", "bad", "c"], output_type="json")
+    assert outputs == [{"prompt": "a"}, {"prompt": "bad"}, {"prompt": "c"}]
+    assert sorted(get_prompt(c) for c in calls) == ["a", "bad", "bad", "c"]
+
+    # an error of the dispatcher (e.g. a 400) on a batch item: only the item is requested
+    # again, its error is raised if it still fails, never returned as an output
+    n_invalid = []
+
+    def completion(**kwargs):
+        if get_prompt(kwargs) == "invalid" and len(n_invalid) < 2:
+            n_invalid.append(1)
+            raise BadRequestError()
+        return make_response(content=json.dumps({"prompt": get_prompt(kwargs)}))
+
+    set_completion(completion)
+    calls.clear()
+    outputs = model.run(["x", "invalid", "y"], output_type="json", max_fail_trials=3)
+    assert outputs == [{"prompt": "x"}, {"prompt": "invalid"}, {"prompt": "y"}]
+    assert sorted(get_prompt(c) for c in calls) == ["invalid", "invalid", "invalid", "x", "y"]
+
+    n_invalid.clear()
+    calls.clear()
+    with pytest.raises(BadRequestError):
+        model.run(["x", "invalid"], output_type="json", max_fail_trials=2)
+    assert sorted(get_prompt(c) for c in calls) == ["invalid", "invalid", "x"]
+    n_invalid.clear()
+    with pytest.raises(BadRequestError):  # a single input: raised at once
+        model.run("invalid", output_type="json")
+
+
+def test_2_prompt_prefix_and_tools_are_built_once(stub):
+    model = stub[0]
+    messages = model._prepare_messages(["a", "b"], "batch_string", output_type="json")
+    assert messages[0][0] is messages[1][0]  # shared by the items of a batch
+    assert [m[-1]["content"] for m in messages] == ["a", "b"]
+    again = model._prepare_messages("c", "string", output_type="json")
+    assert again[0] is messages[0][0] and again[-1] == {"role": "user", "content": "c"}
+
+    assert llm._get_tool(llm.ListStrSchema) is llm._get_tool(llm.ListStrSchema)
+
+
+def test_3_a_retried_stream_restarts_the_partial_content(stub, monkeypatch):
+    _, calls, set_completion = stub
+
+    def make_chunk(delta):
+        return Obj(choices=[Obj(delta=Obj(content=delta))])
+
+    def completion(**kwargs):
+        yield make_chunk("Hel")
+        if len(calls) == 1:  # the connection drops once, the dispatcher retries
+            raise ConnectionError("reset by peer")
+        yield make_chunk("lo")
+
+    set_completion(completion)
+    monkeypatch.setattr(
+        llm.litellm,
+        "stream_chunk_builder",
+        lambda chunks, messages=None: make_response(
+            content="".join(c.choices[0].delta.content for c in chunks)
+        ),
+    )
+    seen = []
+
+    def on_delta(delta, partial_node):
+        seen.append((delta, partial_node["content"]))
+
+    p = Pipeline()
+    p | llm.LLMModel()
+    params = {"LLMModel:model_name": "mock", "LLMModel:stream_callback": on_delta}
+    result = p.run(input_data="hi", params=params)
+    assert result == ["Hello"]
+    assert len(calls) == 2
+    assert seen == [("Hel", "Hel"), ("Hel", "Hel"), ("lo", "Hello")]
+    assert p.sub_steps_history[-1].partial_nodes[0]["content"] == "Hello"
+
+
+def answer_items(kwargs, answer=str.upper):
+    """answers of a packed prompt: {"list_of_item_answer": [{"index": i, "answer": ...}]}"""
+    items = re.findall(r"<ITEM (\d+)>\n(.*?)\n</ITEM", get_prompt(kwargs), flags=re.S)
+    return [{"index": int(i), "answer": answer(item)} for i, item in items]
+
+
+def test_4_packed_items_are_split_back(stub):
+    model, calls, set_completion = stub
+
+    def completion(**kwargs):
+        if kwargs.get("tools"):
+            return make_response(arguments={"list_of_item_answer": answer_items(kwargs)})
+        return make_response(content=get_prompt(kwargs).upper())
+
+    set_completion(completion)
+    items = ["a", "b", "c", "d", "e"]
+    assert model.run(items, output_type="string", pack_size=2) == ["A", "B", "C", "D", "E"]
+    assert len(calls) == 3 and all(c.get("tools") for c in calls)  # 2 + 2 + 1 items
+
+    # not packable (json output): one request per item
+    calls.clear()
+    set_completion(lambda **kwargs: make_response(content=json.dumps({"p": get_prompt(kwargs)})))
+    outputs = model.run(items[:3], output_type="json", pack_size=2)
+    assert outputs == [{"p": "a"}, {"p": "b"}, {"p": "c"}]
+    assert len(calls) == 3 and not any(c.get("tools") for c in calls)
+
+
+def test_5_missing_packed_items_are_requested_individually(stub):
+    model, calls, set_completion = stub
+
+    def completion(**kwargs):
+        if not kwargs.get("tools"):
+            return make_response(content=get_prompt(kwargs).upper())
+        answers = answer_items(kwargs)
+        answers[0]["answer"] = 0  # wrong type
+        answers[1]["index"] = 7  # out of the pack
+        del answers[2]  # missing
+        return make_response(arguments={"list_of_item_answer": answers})
+
+    set_completion(completion)
+    items = ["a", "b", "c", "d"]
+    assert model.run(items, output_type="string", pack_size=4) == ["A", "B", "C", "D"]
+    assert len(calls) == 4 and calls[0].get("tools")
+    assert sorted(get_prompt(c) for c in calls[1:]) == ["a", "b", "c"]
+
+
+def test_6_response_cache_skips_the_completion_calls(stub, monkeypatch):
+    _, calls, set_completion = stub
+    set_completion(lambda **kwargs: make_response(content=json.dumps({"p": get_prompt(kwargs)})))
+
+    # an empty cache is used, not dropped as falsy
+    cache = llm.LLMResponseCache()
+    monkeypatch.setattr(llm.LLMResponseCache, "_default", cache)
+    assert llm.LLMModel(model_name="mock", response_cache=True).response_cache is cache
+    assert llm.LLMModel(model_name="mock", response_cache=False).response_cache is None
+    model = llm.LLMModel(model_name="mock", response_cache=llm.LLMResponseCache())
+    assert model.response_cache is not None and len(model.response_cache) == 0
+
+    output = model.run("a", output_type="json")
+    assert output == {"p": "a"} and len(calls) == 1
+    assert model.run("a", output_type="json") == output
+    assert len(calls) == 1
+
+    # per item in a batch: only "b" and "c" are sent
+    calls.clear()
+    outputs = model.run(["a", "b", "c", "b"], output_type="json")
+    assert outputs == [{"p": "a"}, {"p": "b"}, {"p": "c"}, {"p": "b"}]
+    assert sorted(get_prompt(c) for c in calls) == ["b", "c"]  # "b" coalesced
+    calls.clear()
+    assert model.run(["c", "b"], output_type="json") == [{"p": "c"}, {"p": "b"}]
+    assert calls == []
+
+
+def test_7_hedged_run_keeps_the_first_response(monkeypatch):
+    import time
+
+    LLMDispatcher.clear()
+    CircuitBreaker.clear()
+    with MockLLMServer(port=0, latency=0.01, slow_latency=3.0) as slow, MockLLMServer(
+        port=0, latency=0.01
+    ) as fast:
+        nicknames = {
+            "mock": slow.get_model_info(fallbacks=["mock_fast"]),
+            "mock_fast": fast.get_model_info(),
+        }
+        monkeypatch.setattr(llm.LLMModel, "extra_model_nickname_map", nicknames)
+        model = llm.LLMModel(model_name="mock")
+
+        # latencies of the model for its percentile, then every request is slow
+        model.run([f"warm up {i}" for i in range(LLMDispatcher.min_latencies)])
+        slow.reset_stats()
+        slow.slow_rate = 1.0
+
+        for prompt, kwargs in [("hi", {"hedge_percentile": 90}), ("ho", {"latency_slo": 0.3})]:
+            t = time.monotonic()
+            output = model.run(prompt, **kwargs)
+            assert time.monotonic() - t < 2.0  # the backup answered first
+            assert output == f"Mock answer to: {prompt}"
+        assert slow.stats["requests"] == 2 and fast.stats["ok"] == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,46 @@
+import copy
+import time
+import pytest
+from gpt_graph.utils.llm_cache import LLMResponseCache
+
+
+def test_1_memory_lru_and_copies():
+    cache = LLMResponseCache(memory_size=2)
+    key = LLMResponseCache.make_key(model_id="m", messages=[{"role": "user", "content": "a"}])
+    assert key == LLMResponseCache.make_key(
+        messages=[{"content": "a", "role": "user"}], model_id="m"
+    )
+
+    cache.set(key, ["x", "y"])
+    cache.get(key).append("z")  # hits are copies
+    assert cache.get(key) == ["x", "y"]
+    assert cache.get("missing", "default") == "default"
+
+    cache.set("k2", False)
+    cache.set("k3", None)
+    assert cache.get(key) is None  # evicted, least recently used
+    assert cache.get("k2") is False
+    assert copy.deepcopy(cache) is cache
+
+
+def test_2_disk_tier_ttl_and_size(tmp_path):
+    cache = LLMResponseCache(folder=str(tmp_path), ttl=60)
+    cache.set("k1", {"name": "a", "items": [1, 2]})
+
+    # a new process reads it back from disk
+    cache2 = LLMResponseCache(folder=str(tmp_path), ttl=60)
+    assert cache2.get("k1") == {"name": "a", "items": [1, 2]}
+
+    cache3 = LLMResponseCache(folder=str(tmp_path), ttl=0)
+    time.sleep(0.01)
+    assert cache3.get("k1", "expired") == "expired"
+
+    cache4 = LLMResponseCache(folder=str(tmp_path), max_disk_bytes=500)
+    for i in range(20):
+        cache4.set(f"k{i}", "x" * 50)
+    assert cache4._scan_disk_bytes() <= 500
+    assert LLMResponseCache(folder=str(tmp_path)).get("k19") == "x" * 50
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,320 @@
+import time
+import threading
+import pytest
+from gpt_graph.utils.llm_dispatcher import LLMDispatcher, TokenBucket
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def test_1_token_bucket_reserves_wait():
+    bucket = TokenBucket(per_minute=60)  # 1 per second
+    assert bucket.reserve(60) == 0.0
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+    assert TokenBucket(None).reserve(10**9) == 0.0
+
+
+def test_2_map_keeps_order_within_concurrency_window():
+    LLMDispatcher.clear()
+    dispatcher = LLMDispatcher.get("m", max_concurrency=3)
+    in_flight = []
+    peak = []
+    lock = threading.Lock()
+
+    def func(x):
+        with lock:
+            in_flight.append(x)
+            peak.append(len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.remove(x)
+        return x * 2
+
+    assert dispatcher.map(func, range(10)) == [x * 2 for x in range(10)]
+    assert max(peak) <= 3
+    assert LLMDispatcher.get("m", max_concurrency=3) is dispatcher
+
+
+def test_3_rate_limit_backoff_and_retry():
+    LLMDispatcher.clear()
+    dispatcher = LLMDispatcher.get("m")
+    dispatcher.min_backoff = 0.01
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RateLimitError()
+        return "ok"
+
+    assert dispatcher.call(func) == "ok"
+    assert len(calls) == 3
+
+    def always_fails():
+        raise RateLimitError()
+
+    dispatcher.max_rate_limit_retries = 1
+    with pytest.raises(RateLimitError):
+        dispatcher.call(always_fails)
+
+
+def test_4_duplicate_requests_are_coalesced():
+    LLMDispatcher.clear()
+    dispatcher = LLMDispatcher.get("m", max_concurrency=4)
+    calls = []
+    lock = threading.Lock()
+
+    def func(x):
+        with lock:
+            calls.append(x)
+        time.sleep(0.05)
+        return {"echo": x}
+
+    items = ["a", "b", "a", "a", "c", "b"]
+    results = dispatcher.map(func, items, keys=items)
+    assert [r["echo"] for r in results] == items
+    assert sorted(calls) == ["a", "b", "c"]
+
+    # across concurrent callers, e.g. two steps sending the same prompt
+    calls.clear()
+    threads = [
+        threading.Thread(target=dispatcher.call, args=(func, "d"), kwargs={"key": "d"})
+        for _ in range(3)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == ["d"]
+    assert dispatcher.n_coalesced == 3 + 2
+
+
+def test_5_transport_retries_and_circuit_breaker():
+    from gpt_graph.utils.llm_dispatcher import CircuitBreaker, CircuitBreakerOpenError
+
+    LLMDispatcher.clear()
+    CircuitBreaker.clear()
+    dispatcher = LLMDispatcher.get("provider/m")
+    dispatcher.transport_backoff = 0.001
+    breaker = dispatcher.breaker
+    breaker.failure_threshold = 3
+    breaker.reset_timeout = 0.05
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TimeoutError()
+        return "ok"
+
+    assert dispatcher.call(flaky) == "ok"
+    assert breaker.state == "closed"
+
+    def parse_error():
+        raise ValueError("not a transport error")
+
+    calls.clear()
+    with pytest.raises(ValueError):
+        dispatcher.call(lambda: calls.append(1) or parse_error())
+    assert len(calls) == 1  # not retried
+
+    def outage():
+        raise ConnectionError()
+
+    with pytest.raises(CircuitBreakerOpenError):  # opened by the 3rd error, before the last retry
+        dispatcher.call(outage)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitBreakerOpenError):
+        LLMDispatcher.get("provider/other_model").call(lambda: "fails fast")
+
+    # errors of a batch are returned in place
+    results = dispatcher.map(lambda x: x, [1, 2], if_return_exceptions=True)
+    assert all(isinstance(r, CircuitBreakerOpenError) for r in results)
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert dispatcher.call(lambda: "trial") == "trial"
+    assert breaker.state == "closed"
+
+
+def test_6_token_budget_and_adaptive_window():
+    from gpt_graph.utils.llm_dispatcher import ConcurrencyWindow, estimate_tokens
+
+    LLMDispatcher.clear()
+    dispatcher = LLMDispatcher.get("m", max_concurrency=8, max_inflight_tokens=1000)
+    in_flight = []
+    peak_tokens = []
+    lock = threading.Lock()
+
+    def func(tokens):
+        with lock:
+            in_flight.append(tokens)
+            peak_tokens.append(sum(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.remove(tokens)
+        return tokens
+
+    items = [600, 100, 100, 900, 100, 1500, 100, 100]
+    assert dispatcher.map(func, items, tokens=items) == items
+    # packed against the budget, a request over it is sent alone
+    assert max(peak_tokens) <= 1500
+    assert sorted(peak_tokens)[-2] <= 1000
+
+    assert estimate_tokens([{"role": "user", "content": "x" * 400}], max_tokens=10) >= 10
+
+    window = ConcurrencyWindow(max_concurrency=8)
+    for latency in [0.1] * 5 + [10.0]:  # latency spike
+        window.acquire()
+        window.release(latency=latency)
+    assert window.limit < 8
+    window.acquire()
+    window.release(if_overloaded=True)
+    assert 1 <= window.limit < 4
+
+
+def test_7_hedged_call():
+    from gpt_graph.utils.llm_dispatcher import hedged_call
+
+    calls = []
+
+    def slow():
+        calls.append("slow")
+        time.sleep(0.5)
+        return "slow"
+
+    def fast():
+        calls.append("fast")
+        return "fast"
+
+    def invalid():
+        calls.append("invalid")
+        raise ValueError("can not parse")
+
+    start = time.monotonic()
+    assert hedged_call([slow, fast], delay=0.05) == "fast"
+    assert time.monotonic() - start < 0.3
+    assert hedged_call([fast, slow], delay=0.05) == "fast"
+    assert calls == ["slow", "fast", "fast"]  # not hedged when fast enough
+
+    # a failed call falls back at once, even without a delay
+    assert hedged_call([invalid, fast], delay=None) == "fast"
+    with pytest.raises(ValueError):
+        hedged_call([invalid, invalid], delay=None)
+
+    LLMDispatcher.clear()
+    dispatcher = LLMDispatcher.get("m")
+    assert dispatcher.get_latency_percentile(95) is None
+    dispatcher.latencies.extend([0.1] * 95 + [5.0] * 5)
+    assert dispatcher.get_latency_percentile(50) == 0.1
+    assert dispatcher.get_latency_percentile(99) == 5.0
+
+
+def test_8_circuit_breaker_trial_always_ends():
+    from gpt_graph.utils.llm_dispatcher import CircuitBreaker, CircuitBreakerOpenError
+
+    class BadRequestError(Exception):
+        status_code = 400
+
+    LLMDispatcher.clear()
+    CircuitBreaker.clear()
+    dispatcher = LLMDispatcher.get("provider/m")
+    dispatcher.min_backoff = 0.001
+    breaker = dispatcher.breaker
+    breaker.reset_timeout = 0.05
+
+    def open_circuit():
+        breaker.opened_at = time.monotonic()
+        time.sleep(0.06)
+        assert breaker.state == "half_open"
+
+    # a 400 as the trial: the provider answered, the circuit closes
+    open_circuit()
+    with pytest.raises(BadRequestError):
+        dispatcher.call(lambda: (_ for _ in ()).throw(BadRequestError()))
+    assert breaker.state == "closed" and not breaker.if_trial_in_flight
+    assert dispatcher.call(lambda: "ok") == "ok"
+
+    # a 429 as the trial counts as a failure: open again, then a new trial later
+    open_circuit()
+    with pytest.raises(CircuitBreakerOpenError):
+        dispatcher.call(lambda: (_ for _ in ()).throw(RateLimitError()))
+    assert breaker.state == "open" and not breaker.if_trial_in_flight
+    time.sleep(0.06)
+    assert dispatcher.call(lambda: "ok") == "ok"
+
+    # an error escaping before the outcome is recorded still ends the trial
+    open_circuit()
+    with pytest.raises(KeyboardInterrupt):
+        dispatcher.call(lambda: (_ for _ in ()).throw(KeyboardInterrupt()))
+    assert not breaker.if_trial_in_flight
+    assert dispatcher.call(lambda: "ok") == "ok"
+
+
+def test_9_token_estimate_falls_back_when_tiktoken_fails(monkeypatch):
+    from gpt_graph.utils import llm_dispatcher
+
+    class FailingTiktoken:
+        """e.g. the download of the encoding fails (offline)"""
+
+        calls = 0
+
+        @classmethod
+        def encoding_for_model(cls, name):
+            cls.calls += 1
+            raise ConnectionError("can not download the encoding")
+
+    monkeypatch.setattr(llm_dispatcher, "tiktoken", FailingTiktoken)
+    llm_dispatcher._get_encoding.cache_clear()
+    try:
+        messages = [{"role": "user", "content": "x" * 400}]
+        for _ in range(3):
+            n = llm_dispatcher.estimate_tokens(messages, max_tokens=10, model_id="openai/gpt-4o")
+            assert n == 110  # ~4 chars per token
+        assert FailingTiktoken.calls == 1  # the failure is cached too
+    finally:
+        llm_dispatcher._get_encoding.cache_clear()
+
+
+def test_10_one_trial_at_a_time_with_concurrent_callers():
+    from gpt_graph.utils.llm_dispatcher import CircuitBreaker, CircuitBreakerOpenError
+
+    LLMDispatcher.clear()
+    CircuitBreaker.clear()
+    dispatcher = LLMDispatcher.get("provider/m")
+    breaker = dispatcher.breaker
+    breaker.reset_timeout = 0.05
+    breaker.failures = breaker.failure_threshold
+    breaker.opened_at = time.monotonic()
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+
+    started, release = threading.Event(), threading.Event()
+
+    def slow_trial():
+        started.set()
+        release.wait(5)
+        return "trial"
+
+    results = []
+    trial = threading.Thread(target=lambda: results.append(dispatcher.call(slow_trial)))
+    trial.start()
+    assert started.wait(5) and breaker.if_trial_in_flight
+    try:
+        # a call sent before the circuit opened fails meanwhile: the circuit opens again,
+        # but the trial is still in flight, so no second trial once half open
+        breaker.record_failure()
+        time.sleep(0.06)
+        assert breaker.state == "half_open" and breaker.if_trial_in_flight
+        with pytest.raises(CircuitBreakerOpenError):
+            dispatcher.call(lambda: "second trial")
+    finally:
+        release.set()
+        trial.join()
+    assert results == ["trial"] and breaker.state == "closed"
+    assert not breaker.if_trial_in_flight
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
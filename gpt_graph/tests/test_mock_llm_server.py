@@ -0,0 +1,107 @@
+import json
+import urllib.request
+import urllib.error
+import pytest
+from gpt_graph.utils.mock_llm_server import MockLLMServer
+
+
+def post(server, body):
+    request = urllib.request.Request(
+        server.url + "/chat/completions",
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.status, response.read().decode("utf-8")
+
+
+def test_1_completion_tools_and_token_accounting():
+    with MockLLMServer(port=0, latency=0.01) as server:
+        messages = [{"role": "user", "content": "hello " * 40}]
+        status, text = post(server, {"model": "mock-llm", "messages": messages})
+        response = json.loads(text)
+        assert status == 200
+        assert response["choices"][0]["message"]["content"].startswith("Mock answer to: hello")
+        assert response["usage"]["prompt_tokens"] == server.stats["prompt_tokens"] > 0
+
+        # packed prompt answered through a list_dict tool, one item per <ITEM i>
+        tools = [
+            {
+                "type": "function",
+                "function": {
+                    "name": "List_item_answer",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "list_of_items": {
+                                "type": "array",
+                                "items": {"$ref": "#/$defs/item_answer"},
+                            }
+                        },
+                        "$defs": {
+                            "item_answer": {
+                                "type": "object",
+                                "properties": {
+                                    "index": {"type": "integer"},
+                                    "answer": {"type": "boolean"},
+                                },
+                            }
+                        },
+                    },
+                },
+            }
+        ]
+        prompt = "\n".join(f"<ITEM {i}>\nx\n</ITEM {i}>" for i in range(3))
+        _, text = post(
+            server, {"messages": [{"role": "user", "content": prompt}], "tools": tools}
+        )
+        tool_call = json.loads(text)["choices"][0]["message"]["tool_calls"][0]
+        items = json.loads(tool_call["function"]["arguments"])["list_of_items"]
+        assert [item["index"] for item in items] == [0, 1, 2]
+        assert all(isinstance(item["answer"], bool) for item in items)
+
+        _, text = post(server, {"messages": messages, "stream": True})
+        chunks = [line[6:] for line in text.split("\n\n") if line.startswith("data: ")]
+        assert chunks[-1] == "[DONE]"
+        content = "".join(
+            json.loads(c)["choices"][0]["delta"].get("content") or "" for c in chunks[:-1]
+        )
+        assert content.startswith("Mock answer to: hello")
+        assert server.stats["ok"] == 3
+
+
+def test_2_rate_limits_and_errors():
+    with MockLLMServer(port=0, latency=0, rpm=2) as server:
+        body = {"messages": [{"role": "user", "content": "hi"}]}
+        post(server, body)
+        post(server, body)
+        with pytest.raises(urllib.error.HTTPError) as e:
+            post(server, body)
+        assert e.value.code == 429
+        assert float(e.value.headers["Retry-After"]) > 0
+
+    with MockLLMServer(port=0, latency=0, error_rate=1.0) as server:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            post(server, {"messages": []})
+        assert e.value.code == 500
+        assert server.stats == {**server.stats, "requests": 1, "errors": 1, "ok": 0}
+
+
+def test_3_stopped_server_closes_keep_alive_connections():
+    httpx = pytest.importorskip("httpx")  # pooled connections, as litellm
+    body = {"messages": [{"role": "user", "content": "hi"}]}
+    servers = []
+    with httpx.Client(timeout=5) as client:
+        port = 0
+        for _ in range(2):
+            with MockLLMServer(port=port, latency=0) as server:
+                port = server.port  # the next server on the same port, as the benchmark
+                for _ in range(3):
+                    response = client.post(server.url + "/chat/completions", json=body)
+                    assert response.status_code == 200
+            servers.append(server)
+    assert [server.stats["ok"] for server in servers] == [3, 3]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,80 @@
+import gc
+import copy
+import time
+import threading
+import pytest
+from gpt_graph.utils.model_registry import ModelRegistry
+
+
+def test_1_models_are_loaded_once_and_shared():
+    ModelRegistry.clear()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        time.sleep(0.05)
+        return object()
+
+    handle = ModelRegistry.get_handle("m", loader)
+    assert loads == []  # lazy
+
+    clones = [copy.deepcopy(handle) for _ in range(3)]  # e.g. Component.clone
+    results = []
+    threads = [threading.Thread(target=lambda h=h: results.append(h.get())) for h in clones]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(loads) == 1
+    assert all(r is handle.get() for r in results)
+    assert ModelRegistry.info()["m"] == {"loaded": True, "refs": 4}
+
+    del clones, results, threads
+    gc.collect()
+    assert ModelRegistry.info()["m"]["refs"] == 1
+
+
+def test_2_idle_eviction_and_preload():
+    ModelRegistry.clear()
+    ModelRegistry.idle_timeout = 0.01
+    try:
+        ModelRegistry.register("m", lambda: "model")
+        ModelRegistry.preload(["m"])
+        assert ModelRegistry.info()["m"]["loaded"]
+
+        handle = ModelRegistry.get_handle("m")
+        time.sleep(0.02)
+        ModelRegistry.evict_idle()
+        assert ModelRegistry.info()["m"]["loaded"]  # referenced
+
+        del handle
+        gc.collect()
+        time.sleep(0.02)
+        ModelRegistry.evict_idle()
+        assert not ModelRegistry.info()["m"]["loaded"]
+        assert ModelRegistry.get_handle("m").get() == "model"  # loaded again
+    finally:
+        ModelRegistry.idle_timeout = None
+
+    with pytest.raises(KeyError):
+        ModelRegistry.get_handle("unknown")
+
+
+def test_3_preload_after_idle_keeps_the_model_loaded():
+    ModelRegistry.clear()
+    ModelRegistry.idle_timeout = 0.01
+    try:
+        ModelRegistry.register("m", lambda: "model")
+        time.sleep(0.02)  # registered long before the preload, e.g. at import
+        ModelRegistry.preload(["m"])
+        assert ModelRegistry.info()["m"] == {"loaded": True, "refs": 0}
+
+        ModelRegistry.idle_timeout = 0
+        assert ModelRegistry.get_handle("m").get() == "model"
+        assert ModelRegistry.info()["m"]["loaded"]  # not evicted by its own load
+    finally:
+        ModelRegistry.idle_timeout = None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from gpt_graph.utils import onnx_encoder
+from gpt_graph.utils.onnx_encoder import OnnxEncoder, compare_embeddings
+
+
+def test_1_parity_of_embeddings():
+    rng = np.random.default_rng(0)
+    reference = rng.normal(size=(10, 32)).astype(np.float32)
+    quantized = reference + 0.01 * rng.normal(size=(10, 32))
+
+    result = compare_embeddings(quantized, reference)
+    assert 0.99 < result["min_cosine"] <= result["mean_cosine"] <= 1
+    assert result["max_abs_diff"] < 0.1
+    assert compare_embeddings(-reference, reference)["min_cosine"] == pytest.approx(-1)
+
+
+def test_2_onnxruntime_is_optional(monkeypatch):
+    monkeypatch.setattr(onnx_encoder, "onnxruntime", None)
+    with pytest.raises(ImportError):
+        OnnxEncoder("model.onnx")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
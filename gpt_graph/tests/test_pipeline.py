@@ -147,6 +147,185 @@ def test_6_complex_pipeline_with_input_initializers():
    
 
 
+def test_7_compiled_plan_matches_run():
+    from gpt_graph.tests.components.test_components import f4 as f4_plain
+    from gpt_graph.tests.components.test_components import f5 as f5_plain
+    from gpt_graph.tests.components.test_components import f6 as f6_plain
+
+    s = Session()
+    s.f4 = f4_plain()
+    s.f6 = f6_plain()
+    s.f5 = f5_plain()
+    s.p = s.f4 | s.f6 | s.f5
+    expected = s.p.run(input_data=10)
+
+    plan = s.p.compile()
+    assert plan.if_static
+    assert [step.base_name for step in plan.steps][-1] == "f5"
+    assert plan.run(input_data=10) == expected
+    assert plan.run(input_data=20) == s.p.run(input_data=20)
+
+
+def test_8_pipeline_init_does_not_scan_attributes():
+    class pp(Pipeline):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.x = self.x()  # a method step, instantiated explicitly
+
+        @component()
+        def x(self, input_value):
+            return input_value + 10
+
+        @property
+        def not_a_step(self):
+            raise AssertionError("properties should not be evaluated")
+
+    class pp2(pp):
+        pass
+
+    p = pp2()
+    assert p.x.category == "method"
+    assert p.clone().x.category == "method"
+
+def test_9_indexed_set_params():
+    from gpt_graph.tests.components.test_pp import test_pp
+
+    s = Session()
+    s.p = test_pp()
+    s.p2 = s.p | s.p
+
+    s.p2.set_params({"p.0;f4:y": 3, "Testf:y": 7})
+    cps = s.p2.get_all_cps().values()
+    f4_values = [cp.params["y"]["value"] for cp in cps if cp.base_name == "f4"]
+    assert f4_values == [3, 1]
+    assert all(cp.params["y"]["value"] == 7 for cp in cps if cp.base_name == "Testf")
+
+    # index is rebuilt after renaming
+    s.p2.contains[-1].rename(new_base_name="q")
+    s.p2.set_params({"q;f4:y": 5})
+    cps = s.p2.get_all_cps().values()
+    f4_values = [cp.params["y"]["value"] for cp in cps if cp.base_name == "f4"]
+    assert f4_values == [3, 5]
+
+    # the per-call clones of a run do not invalidate the index of the pipeline
+    s.p2.run(input_data=10)
+    index = s.p2._get_param_index()
+    s.p2.run(input_data=10)
+    assert s.p2._get_param_index() is index
+    test_pp()  # nor the cps registered in another tree
+    assert s.p2._get_param_index() is index
+
+
+def test_10_soak_memory_is_flat_with_retention():
+    import gc
+    import tracemalloc
+    from gpt_graph.tests.components.test_pp import test_pp
+
+    s = Session()
+    s.p = test_pp()
+    s.p2 = s.p | s.p
+    s.p2.set_attr({"max_steps": 1, "max_step_clones": 1})
+    n_clones = [len(cp.clones) for cp in s.p2.contains]  # clones created by connect
+    expected = s.p2.run(input_data=10)
+
+    def run_n(n):
+        for _ in range(n):
+            assert s.p2.run(input_data=10) == expected
+
+    run_n(10)  # warm up
+    gc.collect()
+    tracemalloc.start()
+    run_n(20)
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    run_n(60)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # unbounded, every run keeps ~250 KB of steps and clones alive
+    assert after - before < 100_000
+    for cp in s.p2.contains:
+        assert len(cp.steps) <= 1
+        assert all(len(step.contains) <= 1 for step in cp.steps)
+
+    s.p2.reset()
+    gc.collect()  # clones refer to their prototype cyclically
+    assert not s.p2.sub_steps and not s.p2.sub_steps_history
+    assert all(not cp.steps for cp in s.p2.contains)
+    # prototype -> clone links are weak, the per-call clones are released
+    assert [len(cp.clones) for cp in s.p2.contains] == n_clones
+    assert s.p2.run(input_data=10) == expected
+
+
+def test_11_streaming_partial_nodes():
+    from gpt_graph.tests.components.test_components import f4 as f4_plain
+
+    @component()
+    def streamer(x, stream_callback=None):
+        content = ""
+        for token in [str(x), "-", "done"]:
+            content += token
+            if stream_callback is not None:
+                stream_callback(token, {"content": content})
+        return content
+
+    s = Session()
+    s.f4 = f4_plain()
+    s.streamer = streamer()
+    s.p = s.f4 | s.streamer
+
+    seen = []
+
+    def on_delta(delta, partial_node):
+        seen.append((delta, partial_node["content"], partial_node["if_final"]))
+
+    r = s.p.run(input_data=10, params={"streamer:stream_callback": on_delta})
+    assert r == ["11-done", "9-done"]
+    assert seen[:3] == [("11", "11", False), ("-", "11-", False), ("done", "11-done", False)]
+
+    step = s.p.sub_steps_history[-1]
+    assert [n["content"] for n in step.partial_nodes] == r
+    assert all(n["if_final"] for n in step.partial_nodes)
+    assert step.partial_nodes[0]["parent_nodes"][0]["content"] == 11
+
+
+def test_12_plan_runs_again_with_groups_and_conditions():
+    from gpt_graph.core.components.input_initializer import InputInitializer
+    from gpt_graph.tests.components.test_components import f4 as f4_plain
+    from gpt_graph.tests.components.test_components import f5 as f5_plain
+    from gpt_graph.tests.components.test_components import f6 as f6_plain
+
+    s = Session()
+    s.f4 = f4_plain()
+    s.f6 = f6_plain()
+    s.f5 = f5_plain()
+    g = Group(
+        filter_cri={"step_name": {"$regex": "f6", "$order": -1}},
+        parent_filter_cri={"step_name": {"$regex": "f4", "$order": -1}},
+    )
+    s.p = s.f4 | s.f6 | s.f5.prepend(g)
+    expected = s.p.run(input_data=10)
+    plan = s.p.compile()
+    assert plan.run(input_data=10) == expected
+    assert plan.run(input_data=10) == expected
+    assert s.p.run(input_data=10) == expected
+
+    # [a, b, c] | d: a linking group and $if_complete bindings
+    s.i0 = InputInitializer()
+    s.i1 = InputInitializer()
+    s.i2 = InputInitializer()
+
+    @component(step_type="list_to_node", input_schema={"x": {"dim": -1}, "y": {"dim": -1}})
+    def m0(x, y):
+        return sum(x) + sum(y)
+
+    s.m0 = m0()
+    s.p2 = s.i0 | [s.i1, s.i2] | s.m0
+    plan = s.p2.compile(params={"i0:input_format": "dict"})
+    assert plan.run(input_data={"i1": 1, "i2": 2}) == [3]
+    assert plan.run(input_data={"i1": 3, "i2": 4}) == [7]
+
 
 # Define the test
 # def test_7_pp_pipeline():
@@ -0,0 +1,188 @@
+import os
+import numpy as np
+import pytest
+
+retriever = pytest.importorskip("gpt_graph.components.retriever")  # transformers, torch
+text_extractor = pytest.importorskip("gpt_graph.components.text_extractor")  # PyPDF2...
+Retriever = retriever.Retriever
+TextExtractor = text_extractor.TextExtractor
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    """counts the files extracted and the texts encoded, with a stub encoder"""
+    counters = {"extracted": [], "encoded": []}
+    scrape_txt = TextExtractor._scrape_txt
+
+    def _scrape_txt(self, word_limit):
+        counters["extracted"].append(os.path.basename(self.input_file_path))
+        return scrape_txt(self, word_limit)
+
+    def _get_embeddings(self, texts, **kwargs):
+        counters["encoded"].extend(texts)
+        return np.array([[len(text), 1.0, text.count("a")] for text in texts], np.float32)
+
+    monkeypatch.setattr(TextExtractor, "_scrape_txt", _scrape_txt)
+    monkeypatch.setattr(Retriever, "_get_embeddings", _get_embeddings)
+    monkeypatch.setattr(Retriever, "set_model", lambda self, name: None)
+    return counters
+
+
+def ingest(folder, index_folder):
+    """the ingestion of RAG: the files of folder, extracted, then embedded in index_folder"""
+    retriever = Retriever(index_folder=index_folder)
+    extractor = TextExtractor(output_format="node_like")
+    cached_texts = retriever.get_indexed_texts()
+    nodes = [
+        extractor.run(
+            os.path.join(folder, name), word_limit=None, if_save=False, cached_texts=cached_texts
+        )
+        for name in sorted(os.listdir(folder))
+    ]
+    return retriever.run(nodes=nodes)
+
+
+def test_1_unchanged_files_are_not_extracted_nor_encoded(tmp_path, counters):
+    folder, index_folder = tmp_path / "docs", str(tmp_path / "index")
+    folder.mkdir()
+    for name, text in [("a.txt", "a cat"), ("b.txt", "a dog and a bird"), ("c.txt", "fish")]:
+        (folder / name).write_text(text, encoding="utf-8")
+
+    assert len(ingest(folder, index_folder)) == 3
+    assert counters["extracted"] == ["a.txt", "b.txt", "c.txt"]
+    assert len(counters["encoded"]) == 3
+
+    # second run, nothing changed
+    counters["extracted"].clear()
+    counters["encoded"].clear()
+    nodes = ingest(folder, index_folder)
+    assert counters == {"extracted": [], "encoded": []}
+    assert sorted(node["content"] for node in nodes) == ["a cat", "a dog and a bird", "fish"]
+
+    # only the modified file is extracted and encoded again
+    mtime = os.path.getmtime(folder / "b.txt")
+    (folder / "b.txt").write_text("a dog", encoding="utf-8")
+    os.utime(folder / "b.txt", (mtime + 1, mtime + 1))  # whatever the clock resolution
+    ingest(folder, index_folder)
+    assert counters == {"extracted": ["b.txt"], "encoded": ["a dog"]}
+
+
+def stub_tokenizer(texts, return_tensors=None, padding=True, truncation=True):
+    """ids of the words (a=1, b=2...), padded with 0"""
+    ids = [[ord(word) - ord("a") + 1 for word in text.split()] for text in texts]
+    length = max(len(i) for i in ids)
+    return {
+        "input_ids": np.array([i + [0] * (length - len(i)) for i in ids]),
+        "attention_mask": np.array([[1] * len(i) + [0] * (length - len(i)) for i in ids]),
+    }
+
+
+def stub_encoder(input_ids, attention_mask):
+    """hidden state (id, 1) of each token, (1000, 1000) for the padding"""
+    hidden = np.stack([input_ids, np.ones_like(input_ids)], axis=-1).astype(np.float32)
+    hidden[attention_mask == 0] = 1000
+    return hidden
+
+
+def test_2_embeddings_keep_the_input_order_and_ignore_the_padding():
+    texts = ["a b c", "d", "b b", "e a c d", "c"]
+    expected = np.array([[2, 1], [4, 1], [2, 1], [3.25, 1], [3, 1]], dtype=np.float32)
+    r = Retriever()
+    for batch_size in (1, 2, 5):
+        embeddings = r._get_embeddings(
+            texts,
+            batch_size=batch_size,
+            encoder=(stub_tokenizer, stub_encoder),
+            encoder_backend="onnx",  # numpy inputs and outputs
+        )
+        assert np.allclose(embeddings, expected)
+
+
+def test_3_nodes_with_a_row_are_not_encoded_again(counters):
+    r = Retriever(index_params={"dtype": "int8"})
+    r.run(nodes=["a cat", "a dog and a bird", "fish"])
+    assert len(counters["encoded"]) == 3
+
+    found = r.run(query="a cat", top_k=2)  # copies, with extra["embedding_row"]
+    rows = [node["extra"]["embedding_row"] for node in found]
+    counters["encoded"].clear()
+    r.add_nodes(found)
+    assert counters["encoded"] == []
+    new_rows = [node["extra"]["embedding_row"] for node in found]
+    assert new_rows == [3, 4] and r.nodes[rows[0]]["extra"]["embedding_row"] == rows[0]
+    assert np.allclose(r.index.get_vectors(rows), r.index.get_vectors(new_rows))
+
+
+def test_4_saved_index_settings_take_precedence(tmp_path, counters, capsys):
+    index_folder = str(tmp_path / "index")
+    r = Retriever(index_params={"dtype": "int8"}, index_folder=index_folder)
+    r.run(nodes=["a cat", "a dog and a bird", "fish"])
+    r.save_index()
+
+    # same settings: no warning, the non saved ones (capacity) are kept
+    capsys.readouterr()
+    r = Retriever(index_params={"dtype": "int8", "capacity": 8}, index_folder=index_folder)
+    assert "Warning" not in capsys.readouterr().out
+    assert r.index.capacity == 8 and r.index.dtype == "int8"
+
+    # other backend: the saved one is used, with a warning
+    r = Retriever(index_backend="ivf", index_folder=index_folder)
+    assert "Warning" in capsys.readouterr().out
+    assert r.index.backend == "exact" and r.index.dtype == "int8" and len(r.index) == 3
+
+
+def test_5_hybrid_search_skips_the_deleted_rows(counters):
+    r = Retriever(lexical_index=True)
+    r.run(nodes=["a cat", "a cat and a cat", "the cat", "cat food", "a dog"])
+    r.index.delete([0, 1])  # e.g. the rows of a modified file
+    for lexical_weight in (0.0, 0.5):
+        found = r.run(query="cat", top_k=2, lexical_top_m=2, lexical_weight=lexical_weight)
+        assert sorted(node["content"] for node in found) == ["cat food", "the cat"]
+
+
+def test_6_rag_updates_the_index_of_edited_and_deleted_files(tmp_path, counters, monkeypatch):
+    from gpt_graph.components.llm import LLMModel
+    from gpt_graph.pipelines.rag import RAG
+    import gpt_graph.utils.utils as utils
+
+    def run(self, input_data=None, output_type=None, if_return_prompt=False, **kwargs):
+        output = [0] if output_type == "list" else f"answer to {str(input_data)[:20]}"
+        return (output, []) if if_return_prompt else output
+
+    # no LLM nor tiktoken download: only the ingestion of RAG is checked
+    monkeypatch.setattr(LLMModel, "run", run)
+    monkeypatch.setattr(utils, "num_tokens_from_string", lambda text: len(text.split()))
+    monkeypatch.setattr(utils, "truncate_text", lambda text, word_limit: text)
+
+    folder, index_folder = tmp_path / "docs", str(tmp_path / "index")
+    folder.mkdir()
+    for name, text in [("a.txt", "a cat"), ("b.txt", "a dog"), ("c.txt", "a bird")]:
+        (folder / name).write_text(text, encoding="utf-8")
+    params = {"saver:output_folder": str(tmp_path), "retriever:top_k": 5}
+
+    p = RAG(index_folder=index_folder)
+    p.run(folder_path=str(folder), prompt="which animal?", params=dict(params))
+    assert sorted(counters["extracted"]) == ["a.txt", "b.txt", "c.txt"]
+
+    # a.txt is edited, b.txt deleted: only a.txt is extracted and encoded again
+    counters["extracted"].clear()
+    counters["encoded"].clear()
+    mtime = os.path.getmtime(folder / "a.txt")
+    (folder / "a.txt").write_text("a horse", encoding="utf-8")
+    os.utime(folder / "a.txt", (mtime + 1, mtime + 1))
+    (folder / "b.txt").unlink()
+    p.run(folder_path=str(folder), prompt="which animal?", params=dict(params))
+    assert counters["extracted"] == ["a.txt"]
+    assert "a horse" in counters["encoded"] and "a bird" not in counters["encoded"]
+
+    r = Retriever(index_folder=index_folder)
+    assert sorted(os.path.basename(source) for source in r.get_indexed_texts()) == [
+        "a.txt",
+        "c.txt",
+    ]
+    found = r.run(query="a cat", top_k=5)
+    assert sorted(node["content"] for node in found) == ["a bird", "a horse"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+from gpt_graph.utils.vector_index import ExactIndex, normalize
+
+
+def cosine(a, b):
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def test_1_exact_index_matches_cosine_similarity():
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(50, 8)).astype(np.float32)
+    index = ExactIndex(capacity=4)  # grown while adding
+    for i in range(0, 50, 7):
+        index.add(embeddings[i : i + 7])
+    assert len(index) == 50 and index.matrix.flags["C_CONTIGUOUS"]
+
+    query = rng.normal(size=(1, 8))
+    expected = np.array([cosine(e, query[0]) for e in embeddings])
+
+    indices, scores = index.search(query, top_k=5)
+    assert list(indices) == list(np.argsort(expected)[-5:][::-1])
+    assert np.allclose(scores, expected[indices], atol=1e-5)
+
+    indices, _ = index.search(query, top_k=None, lower_threshold=0.2, upper_threshold=0.6)
+    assert list(indices) == list(np.where((expected >= 0.2) & (expected <= 0.6))[0])
+
+    indices, _ = index.search(query, top_k=None, sorted=True)
+    assert list(indices) == list(np.argsort(-expected))
+    assert len(index.search(query, top_k=100)[0]) == 50
+
+    with pytest.raises(ValueError):
+        index.add(np.ones((1, 3)))
+    assert np.allclose(np.linalg.norm(normalize(np.ones(3))), 1)
+
+
+def test_2_ivf_recall_incremental_add_and_save(tmp_path):
+    from gpt_graph.utils.vector_index import ExactIndex, get_index
+
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(20, 16))
+    embeddings = (centers[rng.integers(0, 20, 4000)] + 0.3 * rng.normal(size=(4000, 16)))
+    queries = rng.normal(size=(50, 16))
+
+    exact = ExactIndex()
+    exact.add(embeddings)
+    ivf = get_index("ivf", min_train=1000, nprobe=4)
+    for i in range(0, 4000, 500):  # trained at 1000, then incremental, retrained at 4000
+        ivf.add(embeddings[i : i + 500])
+    assert ivf.centroids is not None and ivf.n_trained == 4000
+
+    def recall(**search_params):
+        hits = 0
+        for q in queries:
+            expected = set(exact.search(q, top_k=10)[0])
+            hits += len(expected & set(ivf.search(q, top_k=10, **search_params)[0]))
+        return hits / (10 * len(queries))
+
+    assert recall() > 0.8
+    assert recall(nprobe=len(ivf.centroids)) == 1.0  # all the lists, exact
+
+    # thresholds keep their exact semantics
+    lower = ivf.search(queries[0], top_k=None, lower_threshold=0.5)[0]
+    assert list(lower) == list(exact.search(queries[0], top_k=None, lower_threshold=0.5)[0])
+
+    path = str(tmp_path / "index.npz")
+    ivf.save(path)
+    loaded = ExactIndex.load(path)
+    assert type(loaded) is type(ivf) and len(loaded) == 4000
+    assert list(loaded.search(queries[1], top_k=10)[0]) == list(ivf.search(queries[1], top_k=10)[0])
+
+
+def test_3_search_many_matches_search():
+    from gpt_graph.utils.vector_index import get_index
+
+    rng = np.random.default_rng(2)
+    for index in [get_index("exact"), get_index("ivf", min_train=100)]:
+        index.max_block_scores = 1000  # several blocks of queries
+        index.add(rng.normal(size=(300, 8)))
+        queries = rng.normal(size=(12, 8))
+        results = index.search_many(queries, top_k=3)
+        assert len(results) == 12
+        for q, (indices, scores) in zip(queries, results):
+            expected_indices, expected_scores = index.search(q, top_k=3)
+            assert list(indices) == list(expected_indices)
+            assert np.allclose(scores, expected_scores, atol=1e-5)
+        # the knobs of the other backends are ignored
+        assert len(index.search(queries[0], top_k=3, nprobe=2, ef_search=8)[0]) == 3
+        lower = index.search_many(queries, top_k=None, lower_threshold=0.3)
+        assert list(lower[5][0]) == list(index.search(queries[5], top_k=None, lower_threshold=0.3)[0])
+
+
+def test_4_compressed_rows_are_rescored_in_full_precision(tmp_path):
+    from gpt_graph.utils.vector_index import get_index
+
+    rng = np.random.default_rng(3)
+    embeddings = rng.normal(size=(2000, 64))
+    queries = rng.normal(size=(20, 64))
+    exact = ExactIndex()
+    exact.add(embeddings)
+
+    for dtype, ratio in [("float16", 2), ("int8", 3.5)]:
+        for index in [ExactIndex(dtype=dtype), get_index("ivf", dtype=dtype, min_train=500)]:
+            index.add(embeddings)
+            assert exact.nbytes / index.nbytes >= ratio
+            assert np.abs(index.matrix - exact.matrix).max() < 0.02
+            for q in queries:
+                indices, scores = index.search(q, top_k=5, nprobe=1000)
+                expected_indices, expected_scores = exact.search(q, top_k=5)
+                assert list(indices) == list(expected_indices)
+                assert np.allclose(scores, expected_scores, atol=1e-5)
+            lower = index.search(queries[0], top_k=None, lower_threshold=0.1)[0]
+            assert list(lower) == list(exact.search(queries[0], top_k=None, lower_threshold=0.1)[0])
+
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    loaded = ExactIndex.load(path)
+    assert loaded.dtype == "int8" and loaded.if_rescore
+    assert list(loaded.search(queries[1], top_k=5, nprobe=1000)[0]) == list(exact.search(queries[1], top_k=5)[0])
+
+
+def test_5_deleted_rows_are_never_returned(tmp_path):
+    from gpt_graph.utils.vector_index import get_index
+
+    rng = np.random.default_rng(4)
+    embeddings = rng.normal(size=(200, 8))
+    query = embeddings[7] + 0.01 * rng.normal(size=8)
+    for index in [ExactIndex(), ExactIndex(dtype="int8"), get_index("ivf", min_train=50)]:
+        index.add(embeddings)
+        assert index.search(query, top_k=1)[0][0] == 7
+        index.delete([7, 8])
+        index.add(embeddings[:1])  # row ids of the others do not change
+        assert index.n_deleted == 2 and len(index) == 201
+        indices = index.search(query, top_k=None, sorted=True)[0]
+        assert len(indices) == 199 and 7 not in indices and 8 not in indices
+        assert 7 not in index.search(query, top_k=5, nprobe=100)[0]
+        assert list(index.search_rows(query, [6, 7, 8, 9], sorted=False)[0]) == [6, 9]
+
+        path = str(tmp_path / "index.npz")
+        index.save(path)
+        loaded = ExactIndex.load(path)
+        assert loaded.n_deleted == 2 and loaded.is_deleted(7) and not loaded.is_deleted(9)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
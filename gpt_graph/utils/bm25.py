@@ -0,0 +1,107 @@
+import re
+import math
+from collections import Counter
+import numpy as np
+from gpt_graph.utils.vector_index import select
+
+"""
+used in Retriever (lexical_index)
+"""
+
+
+def tokenize(text):
+    """lowercase words of text"""
+    return re.findall(r"\w+", text.lower())
+
+
+class BM25Index:
+    """
+    Incremental inverted index scored with BM25, row i is the i-th added text
+    (the same rows as the vector index of Retriever).
+
+    Postings are appended as texts are added, so scoring a query only reads the postings of
+    its terms. Used as a cheap first stage: the top M lexical candidates are then scored
+    with the embeddings.
+
+    Example:
+        index = BM25Index()
+        index.add(["the cat sat", "a dog"])
+        rows, scores = index.search("cat", top_k=10)
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.n = 0
+        self._postings = {}  # term -> ([rows], [term frequencies])
+        self._arrays = {}  # term -> (rows, tfs) numpy copies of the postings, until updated
+        self._lengths = []  # number of tokens of each row
+        self._lengths_array = None
+        self._total_length = 0
+
+    def __len__(self):
+        return self.n
+
+    def add(self, texts):
+        """add texts and return their row ids"""
+        rows = np.arange(self.n, self.n + len(texts))
+        for row, text in zip(rows, texts):
+            tokens = tokenize(text)
+            for term, tf in Counter(tokens).items():
+                postings = self._postings.setdefault(term, ([], []))
+                postings[0].append(int(row))
+                postings[1].append(tf)
+                self._arrays.pop(term, None)
+            self._lengths.append(len(tokens))
+            self._total_length += len(tokens)
+        self._lengths_array = None
+        self.n += len(texts)
+        return rows
+
+    def _get_postings(self, term):
+        if term not in self._arrays:
+            rows, tfs = self._postings[term]
+            self._arrays[term] = (np.array(rows), np.array(tfs, dtype=np.float32))
+        return self._arrays[term]
+
+    def scores(self, query):
+        """BM25 score of query with every row (0 for the rows without any query term)"""
+        scores = np.zeros(self.n, dtype=np.float32)
+        if self.n == 0:
+            return scores
+        if self._lengths_array is None:
+            self._lengths_array = np.array(self._lengths, dtype=np.float32)
+        lengths = self._lengths_array
+        avg_length = max(self._total_length / self.n, 1e-12)
+        for term in set(tokenize(query)):
+            if term not in self._postings:
+                continue
+            rows, tfs = self._get_postings(term)
+            idf = math.log(1 + (self.n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[rows] / avg_length)
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        return scores
+
+    def search(self, query, top_k=None, excluded_rows=None):
+        """
+        Args:
+            excluded_rows (array): rows never returned, e.g. the deleted rows of the dense index.
+
+        Returns:
+            (rows, scores) of the top_k rows matching at least one query term, best first.
+        """
+        scores = self.scores(query)
+        if excluded_rows is not None and len(excluded_rows):
+            excluded_rows = np.asarray(excluded_rows, dtype=np.int64)
+            scores[excluded_rows[excluded_rows < self.n]] = 0
+        matched = np.flatnonzero(scores > 0)
+        indices = select(scores[matched], top_k)
+        return matched[indices], scores[matched][indices]
+
+    def clear(self):
+        self.n = 0
+        self._postings = {}
+        self._arrays = {}
+        self._lengths = []
+        self._lengths_array = None
+        self._total_length = 0
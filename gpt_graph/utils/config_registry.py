@@ -0,0 +1,167 @@
+import os
+import threading
+import importlib.util
+
+import tomli
+
+"""
+used in Closure.load_params, load_env and LLMModel
+"""
+
+
+class FrozenDict(dict):
+    """
+    Read-only dict used as the immutable view of parsed config files.
+    As it can not change, copy/deepcopy return itself (e.g. in Component.clone).
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(f"{self.__class__.__name__} is read-only, use thaw() for a copy")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+
+class _FrozenList(tuple):
+    """tuple of freeze(list), so that thaw gives back a list (and a tuple for a tuple)"""
+
+    __slots__ = ()
+
+
+def freeze(value):
+    """
+    Recursively convert a parsed config value into an immutable view.
+
+    dict -> FrozenDict, list -> tuple (_FrozenList), tuple -> tuple.
+    Other values are returned as is.
+    """
+    if isinstance(value, dict):
+        return FrozenDict({k: freeze(v) for k, v in value.items()})
+    elif isinstance(value, list):
+        return _FrozenList(freeze(v) for v in value)
+    elif isinstance(value, tuple):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """
+    Reverse of freeze. Returns a plain, mutable copy (FrozenDict -> dict, frozen list -> list),
+    the tuples stay tuples.
+    Use it whenever the value is handed to code that may mutate it, e.g. component params.
+    """
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    elif isinstance(value, (list, _FrozenList)):
+        return [thaw(v) for v in value]
+    elif isinstance(value, tuple):
+        return tuple(thaw(v) for v in value)
+    return value
+
+
+class ConfigRegistry:
+    """
+    Process-wide cache of parsed config files.
+
+    Each file is parsed once and cached by (path, parser). The cache entry is invalidated
+    when the file mtime changes, so editing a toml file still takes effect on the next call.
+    Cached results are frozen (see freeze), callers must thaw them before mutating.
+
+    Example:
+        ConfigRegistry.load_toml("config/config.toml")["path"]["ReadBook"]
+    """
+
+    _entries = {}  # (path, parser_name) -> (mtime_ns, frozen result)
+    _lock = threading.RLock()
+
+    @staticmethod
+    def resolve_path(path, base_folder=None):
+        """
+        Make path absolute (relative to base_folder or GPT_GRAPH_FOLDER) and normalize separators,
+        so that windows style paths in config files (e.g. '.\\config\\x.toml') also work on posix.
+        """
+        if os.sep != "\\":
+            path = path.replace("\\", os.sep)
+        if not os.path.isabs(path):
+            base_folder = base_folder or os.environ.get("GPT_GRAPH_FOLDER") or ""
+            path = os.path.join(base_folder, path)
+        return os.path.normpath(os.path.abspath(path))
+
+    @classmethod
+    def get(cls, path, parser, parser_name=None):
+        """
+        Return the frozen result of parser(path), parsing only when the file is new or modified.
+
+        Args:
+            path (str): absolute path of the file (see resolve_path).
+            parser (callable): func(path) -> parsed value.
+            parser_name (str): cache key for the parser. Default parser.__name__.
+
+        Raises:
+            FileNotFoundError: if path does not exist.
+        """
+        parser_name = parser_name or parser.__name__
+        mtime = os.stat(path).st_mtime_ns
+        key = (path, parser_name)
+
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                return entry[1]
+
+            result = freeze(parser(path))
+            cls._entries[key] = (mtime, result)
+            return result
+
+    @classmethod
+    def load_toml(cls, path):
+        """
+        Parse a toml file (e.g. config.toml, env.toml, llm_model_map.toml) into a frozen dict.
+        """
+
+        def parse_toml(path):
+            with open(path, "rb") as f:
+                return tomli.load(f)
+
+        return cls.get(path, parse_toml, "toml")
+
+    @classmethod
+    def load_module_vars(cls, path):
+        """
+        Execute a .py config file once and return its public variables.
+        e.g. prompts files used as placeholders in load_params.
+        """
+
+        def parse_module(path):
+            module_name = os.path.splitext(os.path.basename(path))[0]
+            spec = importlib.util.spec_from_file_location(module_name, path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return {
+                name: value
+                for name, value in module.__dict__.items()
+                if not name.startswith("_")
+            }
+
+        return cls.get(path, parse_module, "module")
+
+    @classmethod
+    def clear(cls, path=None):
+        """
+        Drop cached entries, all of them or only the ones of path.
+        """
+        with cls._lock:
+            if path is None:
+                cls._entries.clear()
+            else:
+                for key in [k for k in cls._entries if k[0] == path]:
+                    del cls._entries[key]
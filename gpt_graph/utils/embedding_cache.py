@@ -0,0 +1,158 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import numpy as np
+
+"""
+used in Retriever.add_nodes
+"""
+
+
+class _ModelStore:
+    """
+    Embeddings of one model in folder:
+    - embeddings.f32: float32 rows (capacity, dim), memory-mapped, grown by doubling.
+    - keys.txt: one text hash per line, line i is row i (append only).
+    - meta.json: {"dim": dim}
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.rows = {}  # text hash -> row
+        self.dim = None
+        self._matrix = None
+
+        meta_path = os.path.join(folder, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+            self._open()
+            keys_path = os.path.join(folder, "keys.txt")
+            if os.path.exists(keys_path):
+                # the rows are flushed before their keys are written, so every key has its row
+                with open(keys_path, "r", encoding="utf-8") as f:
+                    for row, key in enumerate(f.read().split()):
+                        self.rows[key] = row
+
+    @property
+    def _path(self):
+        return os.path.join(self.folder, "embeddings.f32")
+
+    def _open(self, capacity=None):
+        if self._matrix is not None:
+            # release the old map before the file is extended (not allowed on Windows)
+            self._matrix.flush()
+            self._matrix = None
+        size = os.path.getsize(self._path) if os.path.exists(self._path) else 0
+        capacity = max(capacity or 0, size // (4 * self.dim))
+        if capacity * 4 * self.dim > size:
+            with open(self._path, "ab") as f:
+                f.truncate(capacity * 4 * self.dim)
+        self._matrix = np.memmap(
+            self._path, dtype=np.float32, mode="r+", shape=(capacity, self.dim)
+        )
+
+    def get(self, key):
+        row = self.rows.get(key)
+        return None if row is None else np.array(self._matrix[row])
+
+    def add(self, keys, embeddings):
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            with open(os.path.join(self.folder, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim}, f)
+            self._open(capacity=max(1024, len(keys)))
+
+        n = len(self.rows)
+        if n + len(keys) > len(self._matrix):
+            self._open(capacity=max(2 * len(self._matrix), n + len(keys)))
+
+        self._matrix[n : n + len(keys)] = embeddings
+        self._matrix.flush()
+        with open(os.path.join(self.folder, "keys.txt"), "a", encoding="utf-8") as f:
+            f.write("".join(key + "\n" for key in keys))
+        for i, key in enumerate(keys):
+            self.rows[key] = n + i
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of text embeddings, keyed by (model name, hash of the normalized text),
+    so that re-ingesting an unchanged corpus does not run the model.
+    Each model has its own sub folder of memory-mapped rows (see _ModelStore).
+
+    The cache is shared, not copied, by the clones of a component (see __deepcopy__).
+
+    Example:
+        cache = EmbeddingCache("outputs/embedding_cache")
+        cached = cache.get_many("BAAI/bge-small-en-v1.5", texts)  # {index: embedding}
+        cache.set_many("BAAI/bge-small-en-v1.5", new_texts, new_embeddings)
+    """
+
+    _default = None
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._stores = {}  # model name -> _ModelStore
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def get_default(cls):
+        """Process-wide cache, persisted in OUTPUT_FOLDER/embedding_cache (see env.toml)."""
+        if cls._default is None:
+            output_folder = os.environ.get("OUTPUT_FOLDER")
+            if not output_folder or output_folder == "<NONE>":
+                raise ValueError("OUTPUT_FOLDER is not set, pass a folder to EmbeddingCache")
+            cls._default = cls(os.path.join(output_folder, "embedding_cache"))
+        return cls._default
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @staticmethod
+    def get_key(text):
+        """hash of text with its whitespace normalized"""
+        normalized = " ".join(text.split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def _get_store(self, model_name):
+        if model_name not in self._stores:
+            slug = re.sub(r"[^\w.-]+", "_", model_name)
+            self._stores[model_name] = _ModelStore(os.path.join(self.folder, slug))
+        return self._stores[model_name]
+
+    def get_many(self, model_name, texts):
+        """return {index: embedding (d,)} of the texts found in the cache"""
+        with self._lock:
+            store = self._get_store(model_name)
+            found = {}
+            for i, text in enumerate(texts):
+                emb = store.get(self.get_key(text))
+                if emb is not None:
+                    found[i] = emb
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+            return found
+
+    def set_many(self, model_name, texts, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+        with self._lock:
+            store = self._get_store(model_name)
+            new = {}
+            for text, emb in zip(texts, embeddings):
+                key = self.get_key(text)
+                if key not in store.rows:
+                    new[key] = emb
+            if new:
+                store.add(list(new), np.stack(list(new.values())))
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}(folder={self.folder}, models={list(self._stores)}, "
+            f"hits={self.hits}, misses={self.misses})>"
+        )
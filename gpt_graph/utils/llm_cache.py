@@ -0,0 +1,206 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+"""
+used in LLMModel.run
+"""
+
+_MISS = object()
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache of formatted LLM outputs (what LLMModel._format_output returns).
+
+    - memory tier: LRU of at most memory_size entries.
+    - disk tier (optional): one json file per entry in folder, evicting the least recently
+    used files once the folder exceeds max_disk_bytes.
+    Entries older than ttl seconds are dropped in both tiers. ttl None means no expiry.
+
+    The cache is shared, not copied, by the clones of a component (see __deepcopy__).
+
+    Example:
+        cache = LLMResponseCache(folder="outputs/llm_cache", ttl=7 * 24 * 3600)
+        llm = LLMModel(model_name="chat_gpt4o_mini", response_cache=cache)
+        llm = LLMModel(model_name="chat_gpt4o_mini", response_cache=True)  # process-wide default
+    """
+
+    _default = None
+
+    def __init__(self, memory_size=1024, folder=None, ttl=None, max_disk_bytes=2**30):
+        self.memory_size = memory_size
+        self.folder = folder
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()  # key -> (created_at, value)
+        self._disk_bytes = None  # computed lazily
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+
+    @classmethod
+    def get_default(cls):
+        """
+        Process-wide cache, persisted in OUTPUT_FOLDER/llm_cache (see env.toml).
+        """
+        if cls._default is None:
+            output_folder = os.environ.get("OUTPUT_FOLDER")
+            folder = (
+                os.path.join(output_folder, "llm_cache")
+                if output_folder and output_folder != "<NONE>"
+                else None
+            )
+            cls._default = cls(folder=folder)
+        return cls._default
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @staticmethod
+    def make_key(**kwargs):
+        """
+        Hash of the request, e.g. make_key(model_id=..., messages=..., tools=..., params=...).
+        Dict keys are sorted, so that the key does not depend on their order.
+        """
+        text = json.dumps(kwargs, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _if_expired(self, created_at):
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _get_path(self, key):
+        return os.path.join(self.folder, key + ".json")
+
+    def get(self, key, default=None):
+        """
+        Return a copy of the cached value of key, or default.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._if_expired(entry[0]):
+                del self._memory[key]
+                entry = None
+            if entry is None:
+                entry = self._get_from_disk(key)
+                if entry is not None:
+                    self._set_memory(key, entry)
+            else:
+                self._memory.move_to_end(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def set(self, key, value):
+        entry = (time.time(), copy.deepcopy(value))
+        with self._lock:
+            self._set_memory(key, entry)
+            self._set_to_disk(key, entry)
+
+    def _set_memory(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _get_from_disk(self, key):
+        if self.folder is None:
+            return None
+        path = self._get_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self._if_expired(data["created_at"]):
+            self._remove_file(path)
+            return None
+        os.utime(path)  # mtime is used as last access for the eviction
+        return data["created_at"], data["value"]
+
+    def _set_to_disk(self, key, entry):
+        if self.folder is None:
+            return
+        try:
+            text = json.dumps({"created_at": entry[0], "value": entry[1]})
+        except (TypeError, ValueError):
+            return  # not json serializable, memory tier only
+
+        path = self._get_path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(temp_path, path)
+
+        if self._disk_bytes is None:
+            self._disk_bytes = self._scan_disk_bytes()
+        else:
+            self._disk_bytes += len(text.encode("utf-8")) - old_size
+        if self.max_disk_bytes is not None and self._disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _list_files(self):
+        files = []
+        for name in os.listdir(self.folder):
+            if name.endswith(".json"):
+                path = os.path.join(self.folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _scan_disk_bytes(self):
+        return sum(size for _, size, _ in self._list_files())
+
+    def _evict_disk(self):
+        """drop the least recently used files until the folder is below 90% of max_disk_bytes"""
+        files = sorted(self._list_files())
+        total = sum(size for _, size, _ in files)
+        target = self.max_disk_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            if self._remove_file(path):
+                total -= size
+        self._disk_bytes = total
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def clear(self, if_disk=True):
+        with self._lock:
+            self._memory.clear()
+            if if_disk and self.folder is not None:
+                for _, _, path in self._list_files():
+                    self._remove_file(path)
+                self._disk_bytes = 0
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}(memory={len(self._memory)}/{self.memory_size}, "
+            f"folder={self.folder}, ttl={self.ttl}, hits={self.hits}, misses={self.misses})>"
+        )
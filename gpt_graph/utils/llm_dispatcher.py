@@ -0,0 +1,647 @@
+import time
+import random
+import threading
+import functools
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+"""
+used in LLMModel._get_model_response
+"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at capacity per minute.
+
+    Args:
+        per_minute (float): capacity of the bucket, e.g. requests/min or tokens/min.
+            None means unlimited.
+    """
+
+    def __init__(self, per_minute=None):
+        self.per_minute = per_minute
+        self.level = per_minute or 0
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        rate = self.per_minute / 60.0
+        self.level = min(self.per_minute, self.level + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def reserve(self, amount=1):
+        """
+        Take amount from the bucket (the level may become negative) and return the seconds
+        to wait before the reserved amount is actually available.
+        Amounts larger than the capacity are capped, so that they can still be sent.
+        """
+        if not self.per_minute:
+            return 0.0
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level -= min(amount, self.per_minute)
+            if self.level >= 0:
+                return 0.0
+            return -self.level / (self.per_minute / 60.0)
+
+    def try_reserve(self, amount=1):
+        """
+        Take amount only if it is available. Return 0.0 if taken, else the seconds to wait
+        before it is (nothing is taken), e.g. for the Retry-After of a server.
+        """
+        if not self.per_minute:
+            return 0.0
+
+        with self._lock:
+            self._refill(time.monotonic())
+            amount = min(amount, self.per_minute)
+            if self.level >= amount:
+                self.level -= amount
+                return 0.0
+            return (amount - self.level) / (self.per_minute / 60.0)
+
+    def acquire(self, amount=1):
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class ConcurrencyWindow:
+    """
+    Admission control of the in-flight requests of a model.
+
+    A request is admitted while there are less than limit requests and at most max_tokens
+    estimated tokens in flight, so that many small prompts or a few large ones are sent at once.
+    A request larger than max_tokens is admitted alone.
+
+    If if_adaptive, limit follows the observed latency (AIMD) between 1 and max_concurrency:
+    +1/limit per request while the latency is stable, x0.75 when the latency (EWMA) exceeds
+    twice the best one seen, and x0.5 on rate limits.
+    """
+
+    def __init__(self, max_concurrency, max_tokens=None, if_adaptive=True):
+        self.max_concurrency = max_concurrency
+        self.max_tokens = max_tokens
+        self.if_adaptive = if_adaptive
+        self.limit = float(max_concurrency)
+
+        self.in_flight = 0
+        self.in_flight_tokens = 0
+        self.latency = None  # EWMA, seconds
+        self.best_latency = None
+        self._cond = threading.Condition()
+
+    def _if_admissible(self, tokens):
+        if self.in_flight >= max(1, int(self.limit)):
+            return False
+        if self.max_tokens is None or self.in_flight == 0:
+            return True
+        return self.in_flight_tokens + tokens <= self.max_tokens
+
+    def acquire(self, tokens=0):
+        with self._cond:
+            self._cond.wait_for(lambda: self._if_admissible(tokens))
+            self.in_flight += 1
+            self.in_flight_tokens += tokens
+
+    def release(self, tokens=0, latency=None, if_overloaded=False):
+        with self._cond:
+            self.in_flight -= 1
+            self.in_flight_tokens -= tokens
+            if self.if_adaptive:
+                self._adapt(latency, if_overloaded)
+            self._cond.notify_all()
+
+    def _adapt(self, latency, if_overloaded):
+        if if_overloaded:
+            self.limit = max(1.0, self.limit / 2)
+            return
+        if latency is None:
+            return
+
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if self.best_latency is None or self.latency < self.best_latency:
+            self.best_latency = self.latency
+
+        if self.latency > 2 * self.best_latency:
+            self.limit = max(1.0, self.limit * 0.75)
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+
+def _is_rate_limit_error(e):
+    """429 of any provider, e.g. litellm.RateLimitError, openai.RateLimitError"""
+    return (
+        getattr(e, "status_code", None) == 429 or "RateLimit" in e.__class__.__name__
+    )
+
+
+def _is_transport_error(e):
+    """
+    errors of the request itself (timeouts, connection errors, 5xx), worth retrying.
+    Rate limits (429) are handled separately, other errors (e.g. 400, parsing) are not retried.
+    """
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(e, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code >= 500 or status_code in (408, 409)
+    name = e.__class__.__name__
+    return any(
+        s in name
+        for s in ("Timeout", "APIConnectionError", "ServiceUnavailable", "InternalServerError")
+    )
+
+
+def backoff_delay(trial, base=0.5, max_delay=60.0):
+    """exponential backoff with full jitter: uniform(0, min(max_delay, base * 2 ** trial))"""
+    return random.uniform(0, min(max_delay, base * 2**trial))
+
+
+def get_provider(model_id):
+    """e.g. 'openrouter/google/gemini-pro' -> 'openrouter', 'gpt-4' -> 'gpt-4'"""
+    return model_id.split("/")[0]
+
+
+class CircuitBreakerOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker, shared by the dispatchers of all models of the provider.
+
+    After failure_threshold consecutive transport errors the circuit opens: calls fail fast
+    with CircuitBreakerOpenError for reset_timeout seconds. Then a single trial call is let
+    through (half open), closing the circuit if the provider answers (even with an error such
+    as a 400) and opening it again on a transport error or a rate limit.
+    """
+
+    _breakers = {}  # provider -> CircuitBreaker
+    _lock = threading.Lock()
+
+    failure_threshold = 5
+    reset_timeout = 30.0
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.if_trial_in_flight = False
+        self._state_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name):
+        with cls._lock:
+            if name not in cls._breakers:
+                cls._breakers[name] = cls(name)
+            return cls._breakers[name]
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._breakers.clear()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def check(self):
+        """
+        Returns:
+            True if the call is the trial of the half open circuit, its caller must then
+            record its outcome and call end_trial (in a finally), else False.
+
+        Raises:
+            CircuitBreakerOpenError: if the circuit is open, or half open with a trial in flight.
+        """
+        with self._state_lock:
+            state = self.state
+            if state == "closed":
+                return False
+            if state == "half_open" and not self.if_trial_in_flight:
+                self.if_trial_in_flight = True
+                return True
+        raise CircuitBreakerOpenError(
+            f"circuit of {self.name} is open after {self.failures} transport errors"
+        )
+
+    def record_success(self, if_trial=False):
+        """if_trial: the outcome is the one of the trial (check returned True)"""
+        with self._state_lock:
+            self.failures = 0
+            self.opened_at = None
+            if if_trial:
+                self.if_trial_in_flight = False
+
+    def record_failure(self, if_trial=False):
+        """
+        if_trial: the outcome is the one of the trial, the circuit opens again. The failure of
+        another call (e.g. sent before the circuit opened) does not end the trial in flight.
+        """
+        with self._state_lock:
+            self.failures += 1
+            if if_trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None or if_trial:
+                    print(f"circuit of {self.name} opened")
+                self.opened_at = time.monotonic()
+            if if_trial:
+                self.if_trial_in_flight = False
+
+    def end_trial(self):
+        """let another trial through, e.g. when the trial ended without an outcome"""
+        with self._state_lock:
+            self.if_trial_in_flight = False
+
+
+def _get_retry_after(e):
+    """seconds from the Retry-After header of the provider response, if any"""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class LLMDispatcher:
+    """
+    Process-wide dispatcher of LLM calls, one per model_id.
+
+    All LLMModel instances (and their clones in different steps) using the same model_id share
+    its limits, so that concurrent batches saturate the quota without tripping it:
+    - rpm / tpm: token buckets of requests per minute and tokens per minute.
+    - max_concurrency / max_inflight_tokens: max number of in-flight requests and of their
+    estimated tokens, so that batches are packed by size. The actual window adapts to the
+    observed latency (see ConcurrencyWindow).
+    - on a rate limit error (429), every caller pauses for an adaptive backoff (doubled
+    on each consecutive 429, honoring Retry-After) and the request is sent again.
+    - transport errors (timeouts, connection errors, 5xx) are retried with exponential backoff
+    and jitter, up to max_transport_retries. They also feed the CircuitBreaker of the provider,
+    which fails fast (CircuitBreakerOpenError) during outages.
+    - requests with the same key are coalesced: while one is in flight, the others wait for
+    its result instead of calling the model again (also the duplicates within a map).
+
+    The limits are read from llm_model_map.toml:
+        [chat_gpt4o_mini]
+        model_id = "openai/gpt-4o-mini"
+        rpm = 500
+        tpm = 200000
+        max_concurrency = 8
+        max_inflight_tokens = 60000
+
+    Example:
+        dispatcher = LLMDispatcher.get(model_id, rpm=500, tpm=200000)
+        response = dispatcher.call(completion, tokens=1200, model=model_id, messages=messages)
+        responses = dispatcher.map(lambda m: completion(model=model_id, messages=m), batch, tokens=[...])
+        response = dispatcher.call(completion, key=request_hash, ...)  # coalesced with duplicates
+    """
+
+    _dispatchers = {}  # model_id -> LLMDispatcher
+    _lock = threading.Lock()
+
+    default_max_concurrency = 5
+    max_rate_limit_retries = 5
+    max_transport_retries = 3
+    transport_backoff = 0.5  # base of the exponential backoff of transport errors
+    min_backoff = 1.0
+    max_backoff = 60.0
+    n_latencies = 200  # recent latencies kept for get_latency_percentile
+    min_latencies = 20
+
+    def __init__(
+        self, model_id, rpm=None, tpm=None, max_concurrency=None, max_inflight_tokens=None
+    ):
+        self.model_id = model_id
+        self.breaker = CircuitBreaker.get(get_provider(model_id))
+        self.limits = None
+        self.configure(
+            rpm=rpm,
+            tpm=tpm,
+            max_concurrency=max_concurrency,
+            max_inflight_tokens=max_inflight_tokens,
+        )
+
+        self.backoff = 0.0
+        self.paused_until = 0.0
+        self._state_lock = threading.Lock()
+
+        self._in_flight = {}  # key -> Future of the request being sent
+        self.n_coalesced = 0  # requests served by the result of an identical one
+        self.latencies = deque(maxlen=self.n_latencies)  # seconds, successful requests
+
+    @classmethod
+    def get(cls, model_id, **limits):
+        """
+        Return the shared dispatcher of model_id, creating it if needed.
+        If the limits changed (e.g. llm_model_map.toml was edited), the dispatcher is reconfigured.
+
+        Args:
+            limits: rpm, tpm, max_concurrency, max_inflight_tokens. None means default.
+        """
+        with cls._lock:
+            dispatcher = cls._dispatchers.get(model_id)
+            if dispatcher is None:
+                dispatcher = cls(model_id, **limits)
+                cls._dispatchers[model_id] = dispatcher
+            elif dispatcher._get_limits(**limits) != dispatcher.limits:
+                dispatcher.configure(**limits)
+            return dispatcher
+
+    @classmethod
+    def from_model_info(cls, model_info):
+        """shortcut of get for an entry of llm_model_map.toml"""
+        return cls.get(
+            model_info["model_id"],
+            rpm=model_info.get("rpm"),
+            tpm=model_info.get("tpm"),
+            max_concurrency=model_info.get("max_concurrency"),
+            max_inflight_tokens=model_info.get("max_inflight_tokens"),
+        )
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._dispatchers.clear()
+
+    def _get_limits(
+        self, rpm=None, tpm=None, max_concurrency=None, max_inflight_tokens=None
+    ):
+        return (rpm, tpm, max_concurrency or self.default_max_concurrency, max_inflight_tokens)
+
+    def configure(self, **limits):
+        self.limits = self._get_limits(**limits)
+        rpm, tpm, self.max_concurrency, max_inflight_tokens = self.limits
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.window = ConcurrencyWindow(self.max_concurrency, max_inflight_tokens)
+
+    def _wait_for_pause(self):
+        while True:
+            wait = self.paused_until - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _on_rate_limit(self, e):
+        with self._state_lock:
+            self.backoff = min(
+                self.max_backoff, max(self.min_backoff, self.backoff * 2)
+            )
+            pause = _get_retry_after(e) or self.backoff
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            print(f"rate limited by {self.model_id}, pausing {pause:.1f}s")
+
+    def get_latency_percentile(self, percentile):
+        """
+        percentile (0-100) of the recent latencies of the model, None if less than
+        min_latencies requests succeeded so far.
+        """
+        latencies = sorted(self.latencies)
+        if len(latencies) < self.min_latencies:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+    def _on_success(self):
+        if self.backoff:
+            with self._state_lock:
+                self.backoff = self.backoff / 2 if self.backoff > self.min_backoff else 0.0
+
+    def call(self, func, *args, tokens=0, key=None, **kwargs):
+        """
+        Call func(*args, **kwargs) within the limits of the model.
+
+        Args:
+            func (callable): the request, e.g. litellm.completion.
+            tokens (int): estimated tokens of the request (prompt + max completion), for tpm.
+            key (str): hash of the request. If an identical request is in flight, its result
+                (or error) is returned instead of calling func. None disables the coalescing.
+
+        Raises:
+            CircuitBreakerOpenError: if the provider circuit is open.
+            the last rate limit / transport error if it is still raised after
+            max_rate_limit_retries / max_transport_retries, any other error of func as is.
+        """
+        if key is None:
+            return self._call(func, *args, tokens=tokens, **kwargs)
+
+        with self._state_lock:
+            future = self._in_flight.get(key)
+            if_owner = future is None
+            if if_owner:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.n_coalesced += 1
+
+        if not if_owner:
+            return future.result()
+
+        try:
+            result = self._call(func, *args, tokens=tokens, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._state_lock:
+                self._in_flight.pop(key, None)
+
+    def _call(self, func, *args, tokens=0, **kwargs):
+        n_rate_limits = 0
+        n_transport_errors = 0
+        while True:
+            if_trial = self.breaker.check()
+            try:
+                self._wait_for_pause()
+                self.rpm.acquire(1)
+                self.tpm.acquire(tokens)
+                window = self.window
+                window.acquire(tokens)
+                start = time.monotonic()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    error = e
+                else:
+                    error = None
+                window.release(
+                    tokens,
+                    latency=time.monotonic() - start if error is None else None,
+                    if_overloaded=error is not None and _is_rate_limit_error(error),
+                )
+
+                if error is None:
+                    self.latencies.append(time.monotonic() - start)
+                    self.breaker.record_success(if_trial)
+                    self._on_success()
+                    return result
+
+                if _is_rate_limit_error(error):
+                    if if_trial:  # still overloaded, the circuit opens again
+                        self.breaker.record_failure(if_trial=True)
+                    n_rate_limits += 1
+                    if n_rate_limits > self.max_rate_limit_retries:
+                        raise error
+                    self._on_rate_limit(error)
+                elif _is_transport_error(error):
+                    self.breaker.record_failure(if_trial)
+                    n_transport_errors += 1
+                    if n_transport_errors > self.max_transport_retries:
+                        raise error
+                    delay = backoff_delay(
+                        n_transport_errors, self.transport_backoff, self.max_backoff
+                    )
+                    print(
+                        f"{error.__class__.__name__} from {self.model_id}, "
+                        f"retrying in {delay:.1f}s"
+                    )
+                    time.sleep(delay)
+                else:
+                    if if_trial:  # the provider answered (e.g. a 400), it is reachable
+                        self.breaker.record_success(if_trial=True)
+                    raise error
+            finally:
+                if if_trial:
+                    self.breaker.end_trial()
+
+    def map(self, func, items, tokens=None, keys=None, if_return_exceptions=False):
+        """
+        Call func(item) for each item concurrently (bounded by max_concurrency) and
+        return the results in the order of items.
+
+        Args:
+            tokens (list[int]): estimated tokens of each request, same length as items.
+            keys (list[str]): hash of each request, same length as items. Items with the same key
+                are sent once and the result is re-expanded to all of them (see call).
+            if_return_exceptions (bool): put the error of a failed item in its place in the results,
+                instead of raising it, so that the other items are not lost. Default False.
+
+        The largest requests are submitted first, the window then fills the remaining
+        token budget with the smaller ones.
+        """
+        items = list(items)
+        tokens = tokens or [0] * len(items)
+
+        if keys is not None:
+            # dedup before dispatch: key -> index in the unique items
+            unique_index = {}
+            unique = []
+            for item, t, key in zip(items, tokens, keys):
+                if key not in unique_index:
+                    unique_index[key] = len(unique)
+                    unique.append((item, t, key))
+            with self._state_lock:
+                self.n_coalesced += len(items) - len(unique)
+        else:
+            unique = [(item, t, None) for item, t in zip(items, tokens)]
+
+        def call(item, t, key):
+            try:
+                return self.call(func, item, tokens=t, key=key)
+            except Exception as e:
+                if not if_return_exceptions:
+                    raise
+                return e
+
+        if len(unique) <= 1:
+            results = [call(item, t, key) for item, t, key in unique]
+        else:
+            order = sorted(range(len(unique)), key=lambda i: -unique[i][1])
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_concurrency, len(unique))
+            ) as executor:
+                futures = {i: executor.submit(call, *unique[i]) for i in order}
+                results = [futures[i].result() for i in range(len(unique))]
+
+        if keys is None:
+            return results
+        return [results[unique_index[key]] for key in keys]
+
+
+def hedged_call(funcs, delay):
+    """
+    Hedged call for tail latency: call funcs[0], and the next func each time delay seconds pass
+    without a result, or at once when a call fails (fallback). The first result wins, the other
+    calls are cancelled if not started yet, else their results are dropped.
+
+    Args:
+        funcs (list): callables without args, e.g. the same request to the same model or to
+            fallback models. A func should raise if its result is not valid.
+        delay (float): seconds before hedging, None to only fall back on errors.
+
+    Returns:
+        the first result. Raises the last error if all the calls fail.
+    """
+    executor = ThreadPoolExecutor(max_workers=len(funcs))
+    futures = [executor.submit(funcs[0])]
+    pending = set(futures)
+    error = None
+    try:
+        while pending:
+            if_can_hedge = len(futures) < len(funcs)
+            done, pending = wait(
+                pending,
+                timeout=delay if if_can_hedge else None,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            if if_can_hedge and (done or delay is not None):
+                future = executor.submit(funcs[len(futures)])
+                futures.append(future)
+                pending.add(future)
+        raise error
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(name):
+    """
+    tiktoken encoding of the model name, cl100k_base for unknown (e.g. non-openai) models,
+    None if it can not be loaded (e.g. its download failed).
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"tiktoken encoding of {name} not available ({e!r}), counting ~4 chars per token")
+        return None
+
+
+def estimate_tokens(messages, max_tokens=None, model_id=None):
+    """
+    Token count of a request for the tpm bucket and the in-flight token budget:
+    prompt tokens (tiktoken if installed and its encoding loads, else ~4 chars per token)
+    plus the max completion tokens if known.
+    """
+    contents = [str(m.get("content", "")) for m in messages]
+    encoding = None
+    if tiktoken is not None and model_id is not None:
+        encoding = _get_encoding(model_id.split("/")[-1])
+    if encoding is not None:
+        n = sum(len(encoding.encode(c, disallowed_special=())) for c in contents)
+        n += 4 * len(messages)  # role and separators
+    else:
+        n = sum(len(c) for c in contents) // 4
+    return n + (max_tokens or 0)
@@ -7,7 +7,7 @@ Created on Mon Apr 15 11:58:07 2024
 
 import os
 
-import tomli
+from gpt_graph.utils.config_registry import ConfigRegistry
 
 
 def load_env(file_path=None):
@@ -18,7 +18,7 @@ def load_env(file_path=None):
     file_path (str): Path to the TOML file.
 
     Returns:
-    dict: A dictionary of the loaded environment variables.
+    FrozenDict: A read-only view of the loaded environment variables.
     """
     current_dir = os.path.dirname(os.path.abspath(__file__))
     package_root = os.path.dirname(current_dir)
@@ -30,11 +30,8 @@ def load_env(file_path=None):
         raise FileNotFoundError(f"The file {file_path} does not exist.")
 
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            toml_string = f.read()
-
-        # Load the TOML file
-        config = tomli.loads(toml_string)
+        # parsed once per process, re-parsed only if env.toml is modified
+        config = ConfigRegistry.load_toml(file_path)
 
         # Iterate through the config and set environment variables
         for key, value in config.items():
@@ -67,7 +64,7 @@ def load_env(file_path=None):
     except FileNotFoundError:
         print(f"Error: The file {file_path} was not found.")
         return {}
-    except tomli.TomlDecodeError:
+    except ValueError:  # TOMLDecodeError of tomli, used by ConfigRegistry.load_toml
         print(f"Error: The file {file_path} is not a valid TOML file.")
         return {}
     except Exception as e:
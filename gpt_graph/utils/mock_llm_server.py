@@ -0,0 +1,338 @@
+import json
+import math
+import socket
+import sys
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from gpt_graph.utils.llm_dispatcher import TokenBucket, estimate_tokens
+
+"""
+used in benchmarks/llm_throughput.py and by the "mock" model of llm_model_map.toml
+"""
+
+
+def _get_mock_value(schema, defs, text, n_items):
+    """value matching a json schema of a tool, arrays get n_items items"""
+    if "$ref" in schema:
+        schema = defs.get(schema["$ref"].split("/")[-1], {})
+    if "anyOf" in schema:
+        schema = schema["anyOf"][0]
+
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        return {
+            name: _get_mock_value(sub_schema, defs, text, n_items)
+            for name, sub_schema in schema.get("properties", {}).items()
+        }
+    elif schema_type == "array":
+        items = [
+            _get_mock_value(schema.get("items", {}), defs, text, 1) for _ in range(n_items)
+        ]
+        for i, item in enumerate(items):
+            if isinstance(item, dict) and "index" in item:
+                item["index"] = i
+        return items
+    elif schema_type == "boolean":
+        return len(text) % 2 == 0
+    elif schema_type == "integer":
+        return 0
+    elif schema_type == "number":
+        return 0.0
+    return f"mock {text[:40]}"
+
+
+class MockLLMServer:
+    """
+    Local OpenAI compatible chat completions server (POST .../chat/completions), so that
+    LLMModel, the dispatcher and whole pipelines can be run and benchmarked without network.
+
+    - latency: lognormal with median latency and latency_sigma (0 means fixed), plus
+    latency_per_token per completion token. With probability slow_rate, slow_latency is added
+    (tail latency, e.g. for hedging).
+    - error_rate / rate_limit_rate: probability of a 500 / 429 (with Retry-After) response.
+    - rpm / tpm: actual limits, requests over them get a 429.
+    - token accounting: prompt and completion tokens are counted in stats, as in "usage".
+
+    Responses echo the last user message. With tools, the first tool is called with arguments
+    generated from its json schema; arrays get one item per "<ITEM i>" of the prompt
+    (packed prompts, see LLMModel._run_packed), else one. stream=True is supported.
+
+    Example:
+        with MockLLMServer(latency=0.3, rate_limit_rate=0.05) as server:
+            llm = LLMModel()
+            llm.add_model_nickname_map({"mock": server.get_model_info()})
+            llm.run("hello", model_name="mock")
+            print(server.stats)
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8765,
+        latency=0.2,
+        latency_sigma=0.0,
+        latency_per_token=0.0,
+        slow_rate=0.0,
+        slow_latency=10.0,
+        error_rate=0.0,
+        rate_limit_rate=0.0,
+        rpm=None,
+        tpm=None,
+        seed=None,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.latency_per_token = latency_per_token
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._connections = set()  # open client sockets, closed by stop (keep-alive)
+        self.reset_stats()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def get_model_info(self, **kwargs):
+        """entry of llm_model_map.toml targeting this server, kwargs override it (e.g. max_concurrency)"""
+        return {
+            "model_id": "openai/mock-llm",
+            "if_openai": True,
+            "api_base": self.url,
+            "api_key": "mock",
+            **kwargs,
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {
+                "requests": 0,
+                "ok": 0,
+                "rate_limited": 0,
+                "errors": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "latencies": [],  # seconds, of the ok responses
+            }
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server._connections.add(self.connection)
+
+            def finish(self):
+                with server._lock:
+                    server._connections.discard(self.connection)
+                super().finish()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    request = None
+                if not self.path.endswith("/chat/completions") or request is None:
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                server._handle(self, request)
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                if not isinstance(sys.exc_info()[1], OSError):
+                    super().handle_error(request, client_address)
+                # else e.g. a connection shut down by stop while answering
+
+        self._server = Server((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]  # if port was 0
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving, also on the keep-alive connections of the clients (e.g. the pool of
+        litellm), which would else still be answered and counted in stats.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            with self._lock:
+                connections = list(self._connections)
+                self._connections.clear()
+            for connection in connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass  # already closed by the client
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _get_latency(self, completion_tokens):
+        latency = self.latency
+        if self.latency_sigma:
+            latency *= math.exp(self._random.gauss(0, self.latency_sigma))
+        if self._random.random() < self.slow_rate:
+            latency += self.slow_latency
+        return latency + self.latency_per_token * completion_tokens
+
+    def _handle(self, handler, request):
+        start = time.monotonic()
+        self._count("requests")
+        messages = request.get("messages", [])
+        prompt_tokens = estimate_tokens(messages)
+
+        retry_after = max(self.rpm.try_reserve(1), self.tpm.try_reserve(prompt_tokens))
+        if retry_after or self._random.random() < self.rate_limit_rate:
+            self._count("rate_limited")
+            handler._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                headers={"Retry-After": f"{max(retry_after, 0.1):.2f}"},
+            )
+            return
+        if self._random.random() < self.error_rate:
+            self._count("errors")
+            handler._send_json(500, {"error": {"message": "Internal server error"}})
+            return
+
+        text = str(messages[-1].get("content", "")) if messages else ""
+        content, tool_calls = self._get_answer(text, request.get("tools"))
+        completion_tokens = len(content or json.dumps(tool_calls)) // 4 + 1
+        if request.get("max_tokens"):
+            completion_tokens = min(completion_tokens, request["max_tokens"])
+
+        time.sleep(self._get_latency(completion_tokens))
+        response = {
+            "id": f"chatcmpl-mock-{self.stats['requests']}",
+            "created": int(time.time()),
+            "model": request.get("model", "mock-llm"),
+        }
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        message = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        finish_reason = "tool_calls" if tool_calls else "stop"
+
+        if request.get("stream"):
+            self._send_stream(handler, response, message, finish_reason)
+        else:
+            handler._send_json(
+                200,
+                {
+                    **response,
+                    "object": "chat.completion",
+                    "choices": [
+                        {"index": 0, "message": message, "finish_reason": finish_reason}
+                    ],
+                    "usage": usage,
+                },
+            )
+
+        with self._lock:
+            self.stats["ok"] += 1
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+            self.stats["latencies"].append(time.monotonic() - start)
+
+    def _get_answer(self, text, tools):
+        if not tools:
+            return f"Mock answer to: {text[:80]}", None
+
+        function = tools[0].get("function", {})
+        parameters = function.get("parameters", {})
+        arguments = _get_mock_value(
+            parameters,
+            parameters.get("$defs", parameters.get("definitions", {})),
+            text,
+            max(1, text.count("<ITEM ")),
+        )
+        tool_call = {
+            "id": "call_mock",
+            "type": "function",
+            "function": {"name": function.get("name"), "arguments": json.dumps(arguments)},
+        }
+        return None, [tool_call]
+
+    @staticmethod
+    def _send_stream(handler, response, message, finish_reason):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+
+        if message.get("tool_calls"):
+            tool_call = {"index": 0, **message["tool_calls"][0]}
+            deltas = [{"role": "assistant", "tool_calls": [tool_call]}]
+        else:
+            words = message["content"].split(" ")
+            deltas = [
+                {"role": "assistant", "content": word + (" " if i < len(words) - 1 else "")}
+                for i, word in enumerate(words)
+            ]
+        chunks = [
+            {"index": 0, "delta": delta, "finish_reason": None} for delta in deltas
+        ] + [{"index": 0, "delta": {}, "finish_reason": finish_reason}]
+
+        for choice in chunks:
+            data = {**response, "object": "chat.completion.chunk", "choices": [choice]}
+            handler.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
+        handler.close_connection = True
+
+
+if __name__ == "__main__":
+    # serve the "mock" model of llm_model_map.toml until interrupted
+    server = MockLLMServer(latency=0.5, latency_sigma=0.5).start()
+    print(f"mock LLM server on {server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,141 @@
+import time
+import weakref
+import threading
+
+"""
+used in Retriever
+"""
+
+
+class _Entry:
+    def __init__(self, loader):
+        self.loader = loader
+        self.value = None
+        self.if_loaded = False
+        self.refs = 0  # live ModelHandle of the entry
+        self.released_at = time.monotonic()
+        self.lock = threading.Lock()  # so that concurrent users load it once
+
+
+class ModelHandle:
+    """
+    Reference to a model of the ModelRegistry, loaded on the first get().
+    Copies (e.g. in Component.clone) are new references to the same model, not copies of it.
+    The reference is released when the handle is garbage collected.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        ModelRegistry._add_ref(name)
+        weakref.finalize(self, ModelRegistry._remove_ref, name)
+
+    def get(self):
+        return ModelRegistry._load(self.name)
+
+    def __copy__(self):
+        return ModelHandle(self.name)
+
+    def __deepcopy__(self, memo):
+        return ModelHandle(self.name)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}({self.name})>"
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of loaded models (e.g. the tokenizer and encoder of Retriever),
+    keyed by name and loaded lazily once, so that all the instances and clones of a component
+    share one copy.
+
+    - reference counting: each ModelHandle is a reference. A model without reference is kept
+    loaded, unless it was idle for more than idle_timeout seconds (None: never evicted).
+    - preload(names) loads registered models ahead of traffic, e.g. when a worker starts.
+
+    Example:
+        handle = ModelRegistry.get_handle("bge", lambda: load_model("BAAI/bge-small-en-v1.5"))
+        model = handle.get()  # loaded on the first call, shared afterwards
+        ModelRegistry.preload(["bge"])
+    """
+
+    _entries = {}  # name -> _Entry
+    _lock = threading.RLock()
+    idle_timeout = None
+
+    @classmethod
+    def register(cls, name, loader):
+        """register the loader of name, without loading it"""
+        with cls._lock:
+            if name not in cls._entries:
+                cls._entries[name] = _Entry(loader)
+            else:
+                cls._entries[name].loader = loader
+
+    @classmethod
+    def get_handle(cls, name, loader=None):
+        if loader is not None:
+            cls.register(name, loader)
+        elif name not in cls._entries:
+            raise KeyError(f"model {name} is not registered")
+        return ModelHandle(name)
+
+    @classmethod
+    def preload(cls, names):
+        for name in names:
+            cls._load(name)
+
+    @classmethod
+    def _load(cls, name):
+        entry = cls._entries[name]
+        if not entry.if_loaded:
+            with entry.lock:
+                if not entry.if_loaded:
+                    entry.value = entry.loader()
+                    entry.if_loaded = True
+        entry.released_at = time.monotonic()  # used now, idle from now if without reference
+        cls.evict_idle(keep=name)
+        return entry.value
+
+    @classmethod
+    def _add_ref(cls, name):
+        with cls._lock:
+            cls._entries[name].refs += 1
+
+    @classmethod
+    def _remove_ref(cls, name):
+        with cls._lock:
+            entry = cls._entries.get(name)
+            if entry is not None:
+                entry.refs -= 1
+                entry.released_at = time.monotonic()
+
+    @classmethod
+    def evict_idle(cls, keep=None):
+        """unload the models without reference idle for more than idle_timeout, except keep"""
+        if cls.idle_timeout is None:
+            return
+        now = time.monotonic()
+        with cls._lock:
+            for name, entry in cls._entries.items():
+                if (
+                    name != keep
+                    and entry.if_loaded
+                    and entry.refs <= 0
+                    and now - entry.released_at > cls.idle_timeout
+                ):
+                    entry.value = None
+                    entry.if_loaded = False
+
+    @classmethod
+    def info(cls):
+        """{name: {"loaded": bool, "refs": int}}"""
+        with cls._lock:
+            return {
+                name: {"loaded": entry.if_loaded, "refs": entry.refs}
+                for name, entry in cls._entries.items()
+            }
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
@@ -0,0 +1,118 @@
+import os
+import re
+import tempfile
+import numpy as np
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+"""
+used in Retriever (encoder_backend="onnx")
+"""
+
+
+def get_default_folder():
+    """OUTPUT_FOLDER/onnx (see env.toml), else a folder in the temporary directory"""
+    output_folder = os.environ.get("OUTPUT_FOLDER")
+    if not output_folder or output_folder == "<NONE>":
+        output_folder = os.path.join(tempfile.gettempdir(), "gpt_graph")
+    return os.path.join(output_folder, "onnx")
+
+
+def export_encoder(model_name, folder=None, if_quantize=True):
+    """
+    Export the HF model model_name to ONNX (dynamic batch and sequence axes), then quantize
+    its weights to int8 (dynamic quantization), once: the exported files are reused.
+
+    Returns:
+        path of the .onnx file to run.
+    """
+    from transformers import AutoTokenizer, AutoModel
+    import torch
+
+    folder = os.path.join(folder or get_default_folder(), re.sub(r"[^\w.-]+", "_", model_name))
+    fp32_path = os.path.join(folder, "model.onnx")
+    int8_path = os.path.join(folder, "model.int8.onnx")
+    path = int8_path if if_quantize else fp32_path
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(folder, exist_ok=True)
+    if not os.path.exists(fp32_path):
+        print(f"exporting {model_name} to {fp32_path}")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        inputs = dict(tokenizer(["an example sentence"], return_tensors="pt"))
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in inputs}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (inputs,),
+                fp32_path,
+                input_names=list(inputs),
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14,
+            )
+
+    if if_quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print(f"quantizing {fp32_path} to int8")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return path
+
+
+class OnnxEncoder:
+    """
+    CPU inference session of an encoder exported by export_encoder.
+    Called like the HF model, but with numpy inputs (return_tensors="np"),
+    and returns last_hidden_state as a numpy array.
+
+    Args:
+        intra_op_threads (int): threads of each matrix operation, None for onnxruntime's
+            default (all the physical cores).
+
+    Example:
+        encoder = OnnxEncoder(export_encoder("BAAI/bge-small-en-v1.5"), intra_op_threads=4)
+        hidden = encoder(**tokenizer(texts, return_tensors="np", padding=True))
+    """
+
+    def __init__(self, path, intra_op_threads=None):
+        if onnxruntime is None:
+            raise ImportError("onnxruntime is required, pip install onnxruntime")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads or 0
+        self.path = path
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, **inputs):
+        feed = {name: np.asarray(inputs[name], dtype=np.int64) for name in self.input_names}
+        return self.session.run(["last_hidden_state"], feed)[0]
+
+
+def compare_embeddings(embeddings, reference):
+    """
+    Parity of embeddings (n, d) with reference embeddings of the same texts.
+
+    Returns:
+        {"min_cosine": float, "mean_cosine": float, "max_abs_diff": float}
+    """
+    a = np.asarray(embeddings, dtype=np.float32)
+    b = np.asarray(reference, dtype=np.float32)
+    cosine = (a * b).sum(axis=1) / np.maximum(
+        np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12
+    )
+    return {
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "max_abs_diff": float(np.abs(a - b).max()),
+    }
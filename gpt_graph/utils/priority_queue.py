@@ -27,6 +27,12 @@ class PriorityQueue:
         priority = neg_priority * -1
         return priority, item
 
+    def items(self):
+        """
+        Return [(priority, item), ...] in pop order, without popping. used in Pipeline.compile
+        """
+        return [(-p, item) for p, _, item in sorted(self.pq, key=lambda x: x[:2])]
+
     def __bool__(self):
         return bool(self.pq)
 
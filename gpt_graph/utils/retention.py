@@ -0,0 +1,54 @@
+import weakref
+
+"""
+used in Component (steps, clones), Step (contains) and Group (clones)
+"""
+
+
+class WeakList:
+    """
+    List-like container holding weak references only, in insertion order.
+
+    Used for prototype -> clone links: a prototype should not keep its (per-call) clones alive.
+    Dead references are skipped when iterating and pruned on append.
+    """
+
+    def __init__(self, items=None):
+        self._refs = []
+        for item in items or []:
+            self.append(item)
+
+    def append(self, item):
+        self._refs = [r for r in self._refs if r() is not None]
+        self._refs.append(weakref.ref(item))
+
+    def clear(self):
+        self._refs = []
+
+    def __iter__(self):
+        for r in list(self._refs):
+            item = r()
+            if item is not None:
+                yield item
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self)})"
+
+
+def trim_to_last(items, max_len=None):
+    """
+    Drop the oldest elements of the list items in place, keeping only the last max_len.
+    max_len None means unbounded.
+    """
+    if max_len is not None and len(items) > max_len:
+        del items[: len(items) - max_len]
+    return items
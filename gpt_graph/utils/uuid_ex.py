@@ -1,6 +1,7 @@
 import uuid
 import weakref
 from functools import total_ordering
+from gpt_graph.utils.retention import WeakList
 
 
 @total_ordering
@@ -55,7 +56,7 @@ class uuid_ex:
             ]
             for edge_type in edge_types:
                 if hasattr(instance, edge_type):
-                    if isinstance(getattr(instance, edge_type), list):
+                    if isinstance(getattr(instance, edge_type), (list, WeakList)):
                         temp = getattr(instance, edge_type)
                     elif isinstance(getattr(instance, edge_type), dict):
                         temp = getattr(instance, edge_type).values()
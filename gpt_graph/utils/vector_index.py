@@ -0,0 +1,568 @@
+import os
+import shutil
+import tempfile
+import weakref
+import numpy as np
+
+"""
+used in Retriever
+"""
+
+
+def normalize(embeddings):
+    """float32 (n, d) matrix of L2-normalized rows, e.g. from a (d,) or (1, d) embedding"""
+    x = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def select(scores, top_k=None, lower_threshold=None, upper_threshold=None, sorted=True):
+    """
+    Indices of scores to return, with the semantics of Retriever.run:
+    the top_k best (best first), else the ones within the thresholds (in index order),
+    else all of them, best first if sorted.
+    """
+    n = len(scores)
+    if top_k is not None:
+        top_k = min(top_k, n)
+        if top_k <= 0:
+            return np.arange(0)
+        indices = np.argpartition(-scores, top_k - 1)[:top_k]
+        return indices[np.argsort(-scores[indices], kind="stable")]
+    elif lower_threshold is not None or upper_threshold is not None:
+        lower = -np.inf if lower_threshold is None else lower_threshold
+        upper = np.inf if upper_threshold is None else upper_threshold
+        return np.where((scores >= lower) & (scores <= upper))[0]
+    elif sorted:
+        return np.argsort(-scores, kind="stable")
+    return np.arange(n)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class _RowFile:
+    """
+    float32 rows appended to a file and read back memory-mapped, the full precision copy of a
+    compressed ExactIndex (in a temporary file, removed with the object, if path is None).
+    """
+
+    def __init__(self, dim, path=None):
+        self.dim = dim
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".f32")
+            os.close(fd)
+            weakref.finalize(self, _remove_file, path)
+        else:
+            open(path, "wb").close()
+        self.path = path
+        self.n = 0
+        self._map = None
+
+    def append(self, x):
+        self._map = None  # remapped with the new size on the next get
+        with open(self.path, "ab") as f:
+            f.write(np.ascontiguousarray(x, dtype=np.float32).tobytes())
+        self.n += len(x)
+
+    def get(self, rows=None):
+        if self.n == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if self._map is None:
+            self._map = np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.n, self.dim))
+        return np.array(self._map if rows is None else self._map[rows])
+
+    def __deepcopy__(self, memo):
+        copied = _RowFile(self.dim)
+        shutil.copyfile(self.path, copied.path)
+        copied.n = self.n
+        return copied
+
+
+class ExactIndex:
+    """
+    Brute-force cosine similarity index.
+
+    Embeddings are kept as one contiguous matrix of L2-normalized rows (grown by
+    doubling), so that a query is scored with a single matrix-vector product and the
+    top_k are selected with argpartition.
+
+    - dtype: "float32" (default), "float16" (half the memory) or "int8" (a quarter, scalar
+    quantization with one scale per row). Compressed rows are dequantized by blocks when
+    scoring, and the top_k * rescore_factor candidates (or the rows close to the thresholds)
+    are rescored with the float32 rows, kept memory-mapped on disk (full_precision_path,
+    a temporary file by default). rescore_factor=None keeps only the compressed rows.
+
+    Example:
+        index = ExactIndex(dtype="int8")
+        rows = index.add(embeddings)  # (n, d)
+        indices, scores = index.search(query_embedding, top_k=3)
+    """
+
+    backend = "exact"
+    dtypes = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+    # bound of the score error of a compressed row, to rescore the rows close to a threshold
+    threshold_margins = {"float32": 0.0, "float16": 0.005, "int8": 0.05}
+    max_block_scores = 2**24  # scores per block of search_many, 64MB
+    max_block_rows = 2**16  # compressed rows dequantized at once
+
+    def __init__(self, capacity=1024, dtype="float32", rescore_factor=4, full_precision_path=None):
+        if dtype not in self.dtypes:
+            raise ValueError(f"unknown dtype {dtype}, use one of {list(self.dtypes)}")
+        self.capacity = capacity
+        self.dtype = dtype
+        self.rescore_factor = rescore_factor
+        self.full_precision_path = full_precision_path
+        self._matrix = None
+        self._scales = None  # int8: scale of each row
+        self._full = None  # _RowFile of the float32 rows, if rescored
+        self._deleted = None  # tombstones, see delete
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def dim(self):
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    @property
+    def n_deleted(self):
+        return 0 if self._deleted is None else int(self._deleted[: self.n].sum())
+
+    @property
+    def if_rescore(self):
+        return self.dtype != "float32" and bool(self.rescore_factor)
+
+    @property
+    def nbytes(self):
+        """memory of the rows (without the float32 copy on disk)"""
+        if self._matrix is None:
+            return 0
+        scales = 0 if self._scales is None else self._scales[: self.n].nbytes
+        return self._matrix[: self.n].nbytes + scales
+
+    @property
+    def matrix(self):
+        """(n, d) normalized embeddings (a dequantized copy if compressed)"""
+        return self.get_vectors()
+
+    def get_vectors(self, rows=None, if_full_precision=False):
+        """
+        float32 normalized embeddings of rows (ids or slice, all if None).
+        if_full_precision reads them from the float32 rows kept for the rescoring, if any.
+        """
+        if if_full_precision and self._full is not None:
+            return self._full.get(rows)
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        rows = slice(0, self.n) if rows is None else rows
+        if self.dtype == "float32":
+            return self._matrix[rows]
+        x = self._matrix[rows].astype(np.float32)
+        if self._scales is not None:
+            x *= self._scales[rows][:, None]
+        return x
+
+    def _reserve(self, n_new, dim):
+        if self._matrix is None:
+            size = max(self.capacity, n_new)
+        elif dim != self.dim:
+            raise ValueError(f"embedding dim {dim} does not match the index dim {self.dim}")
+        elif self.n + n_new > len(self._matrix):
+            size = max(2 * len(self._matrix), self.n + n_new)
+        else:
+            return
+        matrix = np.empty((size, dim), dtype=self.dtypes[self.dtype])
+        if self._matrix is not None:
+            matrix[: self.n] = self._matrix[: self.n]
+        self._matrix = matrix
+        if self.dtype == "int8":
+            scales = np.empty(size, dtype=np.float32)
+            if self._scales is not None:
+                scales[: self.n] = self._scales[: self.n]
+            self._scales = scales
+
+    def _encode(self, x):
+        """(rows in the index dtype, int8 scales or None) of normalized rows"""
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(x).max(axis=1), 1e-12) / 127
+            return np.round(x / scales[:, None]).astype(np.int8), scales
+        return x.astype(self.dtypes[self.dtype]), None
+
+    def add(self, embeddings):
+        """
+        Append embeddings (n, d) and return their row ids.
+        """
+        x = normalize(embeddings)
+        self._reserve(len(x), x.shape[1])
+        stored, scales = self._encode(x)
+        self._matrix[self.n : self.n + len(x)] = stored
+        if scales is not None:
+            self._scales[self.n : self.n + len(x)] = scales
+        if self.if_rescore:
+            if self._full is None:
+                self._full = _RowFile(x.shape[1], self.full_precision_path)
+            self._full.append(x)
+        rows = np.arange(self.n, self.n + len(x))
+        self.n += len(x)
+        return rows
+
+    def delete(self, rows):
+        """
+        Tombstone rows: they are kept (the row ids of the others do not change) but never
+        returned by a search.
+        """
+        if self._deleted is None:
+            self._deleted = np.zeros(self.n, dtype=bool)
+        elif len(self._deleted) < self.n:
+            self._deleted = np.concatenate(
+                [self._deleted, np.zeros(self.n - len(self._deleted), dtype=bool)]
+            )
+        self._deleted[np.asarray(rows, dtype=np.int64)] = True
+
+    def is_deleted(self, row):
+        return self._deleted is not None and row < len(self._deleted) and self._deleted[row]
+
+    def get_deleted_rows(self):
+        """row ids of the tombstoned rows"""
+        if not self.n_deleted:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self._deleted[: self.n])
+
+    def _get_scores(self, queries, rows=None):
+        """(q, n) cosine similarity of normalized queries with rows (all if None)"""
+        if self.dtype == "float32":
+            return queries @ self.get_vectors(rows).T
+        n = self.n if rows is None else len(rows)
+        scores = np.empty((len(queries), n), dtype=np.float32)
+        for start in range(0, n, self.max_block_rows):
+            end = min(start + self.max_block_rows, n)
+            block = slice(start, end) if rows is None else rows[start:end]
+            scores[:, start:end] = queries @ self.get_vectors(block).T
+        return scores
+
+    def _select(self, query, scores, top_k, lower_threshold, upper_threshold, sorted, rows=None):
+        """
+        select among the scores of rows (all if None), rescored in full precision if the
+        index is compressed.
+
+        Returns:
+            (row ids, scores)
+        """
+        if self.n_deleted:
+            rows = np.arange(self.n) if rows is None else rows
+            deleted = np.zeros(len(rows), dtype=bool)
+            in_range = rows < len(self._deleted)
+            deleted[in_range] = self._deleted[rows[in_range]]
+            rows, scores = rows[~deleted], scores[~deleted]
+        if self.if_rescore:
+            if top_k is not None:
+                candidates = select(scores, top_k * self.rescore_factor)
+            elif lower_threshold is not None or upper_threshold is not None:
+                margin = self.threshold_margins[self.dtype]
+                candidates = select(
+                    scores,
+                    lower_threshold=None if lower_threshold is None else lower_threshold - margin,
+                    upper_threshold=None if upper_threshold is None else upper_threshold + margin,
+                )
+            else:
+                candidates = np.arange(len(scores))
+            exact = self._full.get(candidates if rows is None else rows[candidates]) @ query
+            positions = select(exact, top_k, lower_threshold, upper_threshold, sorted)
+            indices, scores = candidates[positions], exact[positions]
+        else:
+            indices = select(scores, top_k, lower_threshold, upper_threshold, sorted)
+            scores = scores[indices]
+        return (indices if rows is None else rows[indices]), scores
+
+    def scores(self, query):
+        """cosine similarity of query (d,) or (1, d) with every row"""
+        if self.n == 0:
+            return np.zeros(0, dtype=np.float32)
+        return self._get_scores(normalize(query))[0]
+
+    def search(
+        self,
+        query,
+        top_k=None,
+        lower_threshold=None,
+        upper_threshold=None,
+        sorted=True,
+        **search_params,
+    ):
+        """
+        search_params are the knobs of the other backends (e.g. nprobe), ignored here.
+
+        Returns:
+            (indices, scores): row ids (see select) and their cosine similarity.
+        """
+        queries = normalize(query)
+        return self._search_many(queries, top_k, lower_threshold, upper_threshold, sorted)[0]
+
+    def search_rows(
+        self, query, rows, top_k=None, lower_threshold=None, upper_threshold=None, sorted=True
+    ):
+        """
+        search among rows only, e.g. the candidates of a lexical first stage:
+        the scoring work is proportional to len(rows), not to the index size.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return np.arange(0), np.zeros(0, dtype=np.float32)
+        queries = normalize(query)
+        scores = self._get_scores(queries, rows)[0]
+        return self._select(
+            queries[0], scores, top_k, lower_threshold, upper_threshold, sorted, rows=rows
+        )
+
+    def search_many(
+        self,
+        queries,
+        top_k=None,
+        lower_threshold=None,
+        upper_threshold=None,
+        sorted=True,
+        **search_params,
+    ):
+        """
+        search for each query of queries (q, d), scored with matrix-matrix products
+        (by blocks of queries, so that the score matrix stays small).
+
+        Returns:
+            list of (indices, scores), one per query.
+        """
+        queries = normalize(queries)
+        return self._search_many(queries, top_k, lower_threshold, upper_threshold, sorted)
+
+    def _search_many(self, queries, top_k, lower_threshold, upper_threshold, sorted):
+        if self.n == 0:
+            empty = (np.arange(0), np.zeros(0, dtype=np.float32))
+            return [empty for _ in queries]
+        block = max(1, self.max_block_scores // self.n)
+        results = []
+        for start in range(0, len(queries), block):
+            block_queries = queries[start : start + block]
+            for query, row in zip(block_queries, self._get_scores(block_queries)):
+                results.append(
+                    self._select(query, row, top_k, lower_threshold, upper_threshold, sorted)
+                )
+        return results
+
+    def clear(self):
+        self._matrix = None
+        self._scales = None
+        self._full = None
+        self._deleted = None
+        self.n = 0
+
+    def get_params(self):
+        """the settings kept by save (capacity and full_precision_path are not)"""
+        return {"backend": self.backend, "dtype": self.dtype, "rescore_factor": self.rescore_factor}
+
+    def _get_state(self):
+        # the float32 rows if kept, so that the loaded index is quantized the same way
+        matrix = self._full.get() if self._full is not None else self.matrix
+        return {
+            "matrix": matrix,
+            "dtype": np.array(self.dtype),
+            "rescore_factor": np.array(self.rescore_factor or 0),
+            "deleted": self.get_deleted_rows(),
+        }
+
+    def _set_state(self, state):
+        self.dtype = str(state.get("dtype", "float32"))
+        self.rescore_factor = int(state.get("rescore_factor", 0)) or None
+        self.clear()
+        if len(state["matrix"]):
+            ExactIndex.add(self, state["matrix"])
+        if len(state.get("deleted", [])):
+            self.delete(state["deleted"])
+
+    def save(self, path):
+        """save to path (.npz)"""
+        np.savez(path, backend=self.backend, **self._get_state())
+
+    @staticmethod
+    def load(path, index=None):
+        """
+        load an index saved by save, of any backend. The saved settings are set on index
+        (an empty index, whose capacity and full_precision_path are kept) if it is of the
+        saved backend, else on a new index of the saved backend.
+        """
+        with np.load(path) as data:
+            state = {key: data[key] for key in data.files}
+        backend = str(state.pop("backend"))
+        if index is None or index.backend != backend:
+            index = get_index(backend)
+        index._set_state(state)
+        return index
+
+
+class IVFIndex(ExactIndex):
+    """
+    Approximate index (inverted file, CPU only): the rows are clustered by spherical k-means
+    into nlist lists, and a top_k query only scores the rows of the nprobe lists whose
+    centroids are the closest to the query.
+
+    - the lists are trained once there are min_train rows (before, search is exact), and
+    retrained when the index grew retrain_factor times since, new rows are added to the list
+    of their closest centroid.
+    - recall/latency knobs: nprobe (more lists scored, better recall) and nlist
+    (default sqrt(n) at training time).
+    - threshold queries and sorted queries of all rows scan every row (exact), as their
+    results can not be bounded by a few lists.
+    """
+
+    backend = "ivf"
+
+    def __init__(
+        self,
+        nlist=None,
+        nprobe=8,
+        min_train=5000,
+        retrain_factor=4,
+        n_iter=10,
+        capacity=1024,
+        seed=0,
+        **kwargs,
+    ):
+        """kwargs of ExactIndex, e.g. dtype="int8"."""
+        super().__init__(capacity=capacity, **kwargs)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self.retrain_factor = retrain_factor
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids = None
+        self.n_trained = 0
+        self._assignments = np.zeros(0, dtype=np.int32)  # list of each row
+        self._lists = []  # row ids of each list
+
+    def add(self, embeddings):
+        rows = super().add(embeddings)
+        if self.centroids is None:
+            if self.n >= self.min_train:
+                self.train()
+        elif self.n >= self.retrain_factor * self.n_trained:
+            self.train()
+        else:
+            self._assign(rows)
+        return rows
+
+    def train(self):
+        """cluster the rows into nlist lists (spherical k-means)"""
+        matrix = self.matrix
+        nlist = min(self.nlist or max(1, int(np.sqrt(self.n))), self.n)
+        rng = np.random.default_rng(self.seed)
+        sample = matrix[rng.choice(self.n, size=min(self.n, nlist * 256), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(self.n_iter):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            sums[empty] = centroids[empty]  # keep the centroids without rows
+            centroids = normalize(sums)
+
+        self.centroids = centroids
+        self.n_trained = self.n
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        self._assign(np.arange(self.n))
+
+    def _assign(self, rows):
+        labels = np.argmax(self.get_vectors(rows) @ self.centroids.T, axis=1).astype(np.int32)
+        self._assignments = np.concatenate([self._assignments, labels])
+        for label in np.unique(labels):
+            self._lists[label] = np.concatenate([self._lists[label], rows[labels == label]])
+
+    def search(
+        self,
+        query,
+        top_k=None,
+        lower_threshold=None,
+        upper_threshold=None,
+        sorted=True,
+        nprobe=None,
+        **search_params,
+    ):
+        """
+        search_params are the knobs of the other backends, ignored here as in ExactIndex.search.
+        """
+        queries = normalize(query)
+        if self.centroids is None or top_k is None:
+            return self._search_many(queries, top_k, lower_threshold, upper_threshold, sorted)[0]
+
+        q = queries[0]
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probed = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        candidates = np.concatenate([self._lists[i] for i in probed])
+        if len(candidates) < top_k:  # not enough rows in the probed lists
+            return self._search_many(queries, top_k, None, None, True)[0]
+        scores = self._get_scores(queries, candidates)[0]
+        return self._select(q, scores, top_k, None, None, True, rows=candidates)
+
+    def search_many(self, queries, top_k=None, **kwargs):
+        if self.centroids is None or top_k is None:
+            return super().search_many(queries, top_k, **kwargs)
+        return [self.search(query, top_k, **kwargs) for query in normalize(queries)]
+
+    def clear(self):
+        super().clear()
+        self.centroids = None
+        self.n_trained = 0
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists = []
+
+    def get_params(self):
+        params = super().get_params()
+        params.update(
+            nlist=self.nlist,
+            nprobe=self.nprobe,
+            min_train=self.min_train,
+            retrain_factor=self.retrain_factor,
+            n_iter=self.n_iter,
+        )
+        return params
+
+    def _get_state(self):
+        state = super()._get_state()
+        params = [self.nlist or 0, self.nprobe, self.min_train, self.retrain_factor, self.n_iter]
+        state["params"] = np.array(params)
+        if self.centroids is not None:
+            state.update(
+                centroids=self.centroids,
+                n_trained=np.array(self.n_trained),
+                assignments=self._assignments,
+            )
+        return state
+
+    def _set_state(self, state):
+        nlist, self.nprobe, self.min_train, self.retrain_factor, self.n_iter = (
+            int(v) for v in state["params"]
+        )
+        self.nlist = nlist or None
+        super()._set_state(state)  # rows added without training
+        if "centroids" in state:
+            self.centroids = state["centroids"]
+            self.n_trained = int(state["n_trained"])
+            self._assignments = state["assignments"].astype(np.int32)
+            self._lists = [
+                np.flatnonzero(self._assignments == i) for i in range(len(self.centroids))
+            ]
+
+
+def get_index(backend="exact", **kwargs):
+    """
+    Create an index by backend name, e.g. get_index("ivf", nprobe=16).
+    """
+    backends = {"exact": ExactIndex, "ivf": IVFIndex}
+    if backend not in backends:
+        raise ValueError(f"unknown index backend {backend}, use one of {list(backends)}")
+    return backends[backend](**kwargs)